@@ -3,10 +3,11 @@ from __future__ import absolute_import, division, print_function
 import errno
 import logging
 import os
-import subprocess
 
 from . import aws  # noqa
+from . import checkpoint  # noqa
 from . import config  # noqa
+from . import taskqueue  # noqa
 from .aws.base_classes import get_profile, set_profile, list_profiles  # noqa
 from .aws.base_classes import get_region, set_region  # noqa
 from .aws.base_classes import get_ecr_repo, set_ecr_repo  # noqa
@@ -16,18 +17,6 @@ from .cloudknot import *  # noqa
 from .dockerimage import *  # noqa
 from .version import __version__  # noqa
 
-try:
-    fnull = open(os.devnull, 'w')
-    subprocess.check_call('docker version', shell=True,
-                          stdout=fnull, stderr=subprocess.STDOUT)
-except subprocess.CalledProcessError:
-    raise ImportError(
-        "It looks like you don't have Docker installed or running. Please go "
-        "to https://docs.docker.com/engine/installation/ to install it. Once "
-        "installed, make sure that the Docker daemon is running before using "
-        "cloudknot."
-    )
-
 module_logger = logging.getLogger(__name__)
 
 # get the log level from environment variable
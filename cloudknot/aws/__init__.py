@@ -19,3 +19,4 @@ from __future__ import absolute_import, division, print_function
 from .base_classes import *  # noqa: F401,F403
 from .batch import *  # noqa: F401,F403
 from .ecr import *  # noqa: F401,F403
+from .s3 import *  # noqa: F401,F403
@@ -1,16 +1,24 @@
 from __future__ import absolute_import, division, print_function
 
-import boto3
-import botocore
 import configparser
+import functools
 import json
 import logging
 import os
 import re
+import threading
 import uuid
 from collections import namedtuple
+from contextlib import contextmanager
+from threading import RLock
 
-from ..config import get_config_file, rlock
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # pragma: nocover
+    from collections import MutableMapping
+
+from ..config import (_stat_key, get_config_file, read_config, rlock,
+                      write_config)
 
 __all__ = ["clients"]
 
@@ -22,6 +30,90 @@ def registered(fn):
 
 mod_logger = logging.getLogger(__name__)
 
+# Resolved and validated S3 and ECR parameters, keyed by config file,
+# profile, and region. Only the set_* functions and changes to the config
+# file make them resolve again, so that submitting jobs makes no calls to
+# create or validate these resources.
+_snapshot_lock = RLock()
+_s3_params = {}
+_ecr_repos = {}
+
+# Key of the files and environment in which get_profile last found no
+# profile, see _profile_sources_key
+_no_profile = {'key': None}
+
+
+# Profile and region overrides of the current thread, see session_context
+_session_override = threading.local()
+
+
+@registered
+@contextmanager
+def session_context(profile=None, region=None):
+    """Use another AWS profile and/or region in the current thread
+
+    Within this context, get_profile, get_region, the module-level clients,
+    and every resource created in the current thread use the given profile
+    and region instead of those in the cloudknot config file, which is left
+    unchanged. Resources keep using the profile and region in which they
+    were created, so this allows driving knots in several regions from one
+    process at the same time::
+
+        with cloudknot.aws.session_context(region='us-west-2'):
+            knot = cloudknot.Knot(name='west', func=func)
+
+    Parameters
+    ----------
+    profile : string
+        An AWS profile listed in the aws config file or aws shared
+        credentials file
+        Default: None means keep the current profile
+
+    region : string
+        An AWS region
+        Default: None means keep the current region
+    """
+    previous = (getattr(_session_override, 'profile', None),
+                getattr(_session_override, 'region', None))
+
+    if profile is not None:
+        _session_override.profile = profile
+    if region is not None:
+        _session_override.region = region
+
+    try:
+        yield
+    finally:
+        _session_override.profile, _session_override.region = previous
+
+
+def in_resource_session(method):
+    """Run a NamedObject method in the session of the resource
+
+    Module-level functions and resources created by the method then use
+    the profile and region of the resource.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with session_context(profile=self.profile, region=self.region):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _session_key():
+    """Return the key of the current session in the snapshot caches"""
+    return get_config_file(), get_profile(fallback=None), get_region()
+
+
+def _configured(option):
+    """Return the value of an option in the aws section of the cached
+    config or None"""
+    config = read_config()
+    if config.has_section('aws') and config.has_option('aws', option):
+        return config.get('aws', option)
+    return None
+
 
 @registered
 def get_ecr_repo():
@@ -31,11 +123,23 @@ def get_ecr_repo():
     If that fails, check for the CLOUDKNOT_ECR_REPO environment variable.
     If that fails, use 'cloudknot'
 
+    The result is cached until `set_ecr_repo` is called or the ecr-repo
+    option in the config file changes, so that subsequent calls make no AWS
+    calls.
+
     Returns
     -------
     repo : string
         Cloudknot ECR repository name
     """
+    key = _session_key()
+    with _snapshot_lock:
+        repo = _ecr_repos.get(key)
+
+    # The repo was already validated, unless the config file changed
+    if repo is not None and repo == _configured('ecr-repo'):
+        return repo
+
     config_file = get_config_file()
     config = configparser.ConfigParser()
 
@@ -83,8 +187,7 @@ def set_ecr_repo(repo):
             config.add_section('aws')
 
         config.set('aws', 'ecr-repo', repo)
-        with open(config_file, 'w') as f:
-            config.write(f)
+        write_config(config, config_file)
 
         try:
             # If repo exists, retrieve its info
@@ -95,6 +198,9 @@ def set_ecr_repo(repo):
             # If it doesn't exists already, then create it
             clients['ecr'].create_repository(repositoryName=repo)
 
+    with _snapshot_lock:
+        _ecr_repos[_session_key()] = repo
+
 
 @registered
 def get_s3_params():
@@ -111,11 +217,25 @@ def get_s3_params():
     For the region, first check the cloudknot config file. If that fails,
     use the current cloudknot region
 
+    The result is cached until `set_s3_params` is called or the S3 options
+    in the config file change, so that subsequent calls make no AWS calls.
+
     Returns
     -------
     bucket : NamedTuple
         A namedtuple with fields ['bucket', 'policy', 'policy_arn', 'sse']
     """
+    key = _session_key()
+    with _snapshot_lock:
+        cached = _s3_params.get(key)
+
+    if cached is not None and all([
+        cached.bucket == _configured('s3-bucket'),
+        cached.policy == _configured('s3-bucket-policy'),
+        str(cached.sse) == _configured('s3-sse'),
+    ]):
+        return cached
+
     config_file = get_config_file()
     config = configparser.ConfigParser()
 
@@ -181,8 +301,13 @@ def get_s3_params():
         response.get('Policies')
     ))[0]['Arn']
 
-    return BucketInfo(bucket=bucket, policy=policy,
-                      policy_arn=policy_arn, sse=sse)
+    bucket_info = BucketInfo(bucket=bucket, policy=policy,
+                             policy_arn=policy_arn, sse=sse)
+
+    with _snapshot_lock:
+        _s3_params[key] = bucket_info
+
+    return bucket_info
 
 
 @registered
@@ -301,8 +426,11 @@ def set_s3_params(bucket, policy=None, sse=None):
 
         config.set('aws', 's3-bucket-policy', policy)
         config.set('aws', 's3-sse', str(sse))
-        with open(config_file, 'w') as f:
-            config.write(f)
+        write_config(config, config_file)
+
+    # Resolve the policy ARN again on the next call to get_s3_params
+    with _snapshot_lock:
+        _s3_params.clear()
 
 
 def bucket_policy_document(bucket):
@@ -329,7 +457,8 @@ def bucket_policy_document(bucket):
             },
             {
                 "Effect": "Allow",
-                "Action": ["s3:PutObject", "s3:GetObject"],
+                "Action": ["s3:PutObject", "s3:GetObject",
+                           "s3:DeleteObject"],
                 "Resource": ["arn:aws:s3:::{0:s}/*".format(bucket)]
             },
         ]
@@ -409,6 +538,16 @@ def get_region():
     region : string
         default AWS region
     """
+    override = getattr(_session_override, 'region', None)
+    if override is not None:
+        return override
+
+    # Look up the region in the cached config first, since this is called
+    # whenever a resource checks its region
+    cached = read_config()
+    if cached.has_section('aws') and cached.has_option('aws', 'region'):
+        return cached.get('aws', 'region')
+
     config_file = get_config_file()
     config = configparser.ConfigParser()
 
@@ -447,8 +586,7 @@ def get_region():
                 config.add_section('aws')
 
             config.set('aws', 'region', region)
-            with open(config_file, 'w') as f:
-                config.write(f)
+            write_config(config, config_file)
 
             return region
 
@@ -483,47 +621,15 @@ def set_region(region='us-east-1'):
             config.add_section('aws')
 
         config.set('aws', 'region', region)
-        with open(config_file, 'w') as f:
-            config.write(f)
+        write_config(config, config_file)
 
-        # Update the boto3 clients so that the region change is reflected
+        # Drop the boto3 clients so that the region change is reflected
         # throughout the package
-        max_pool = clients['iam'].meta.config.max_pool_connections
-        boto_config = botocore.config.Config(max_pool_connections=max_pool)
-        session = boto3.Session(profile_name=get_profile(fallback=None))
-        clients['batch'] = session.client('batch', region_name=region,
-                                          config=boto_config)
-        clients['cloudformation'] = session.client('cloudformation',
-                                                   region_name=region,
-                                                   config=boto_config)
-        clients['ecr'] = session.client('ecr', region_name=region,
-                                        config=boto_config)
-        clients['ecs'] = session.client('ecs', region_name=region,
-                                        config=boto_config)
-        clients['ec2'] = session.client('ec2', region_name=region,
-                                        config=boto_config)
-        clients['iam'] = session.client('iam', region_name=region,
-                                        config=boto_config)
-        clients['sts'] = session.client('sts', region_name=region,
-                                        config=boto_config)
-        clients['s3'] = session.client('s3', region_name=region,
-                                       config=boto_config)
-
+        clients.reset()
 
-@registered
-def list_profiles():
-    """Return a list of available AWS profile names
 
-    Search the aws credentials file and the aws config file for profile names
-
-    Returns
-    -------
-    profile_names : namedtuple
-        A named tuple with fields: `profile_names`, a list of AWS profiles in
-        the aws config file and the aws shared credentials file;
-        `credentials_file`, a path to the aws shared credentials file;
-        and `aws_config_file`, a path to the aws config file
-    """
+def _aws_profile_files():
+    """Return the paths of the aws credentials file and aws config file"""
     aws = os.path.join(os.path.expanduser('~'), '.aws')
 
     try:
@@ -542,6 +648,33 @@ def list_profiles():
         # Fallback on default aws config file path
         aws_config_file = os.path.join(aws, 'config')
 
+    return credentials_file, aws_config_file
+
+
+def _profile_sources_key(config_file):
+    """Return a key that changes whenever the cloudknot config file, the
+    aws credentials and config files, or AWS_PROFILE change"""
+    paths = (config_file,) + _aws_profile_files()
+    return (paths, tuple(_stat_key(path) for path in paths),
+            os.environ.get('AWS_PROFILE'))
+
+
+@registered
+def list_profiles():
+    """Return a list of available AWS profile names
+
+    Search the aws credentials file and the aws config file for profile names
+
+    Returns
+    -------
+    profile_names : namedtuple
+        A named tuple with fields: `profile_names`, a list of AWS profiles in
+        the aws config file and the aws shared credentials file;
+        `credentials_file`, a path to the aws shared credentials file;
+        and `aws_config_file`, a path to the aws config file
+    """
+    credentials_file, aws_config_file = _aws_profile_files()
+
     credentials = configparser.ConfigParser()
     credentials.read(credentials_file)
 
@@ -592,7 +725,26 @@ def get_profile(fallback='from-env'):
         An AWS profile listed in the aws config file or aws shared
         credentials file
     """
+    override = getattr(_session_override, 'profile', None)
+    if override is not None:
+        return fallback if override == 'from-env' else override
+
+    # Look up the profile in the cached config first, since this is called
+    # whenever a resource checks its profile
+    cached = read_config()
+    if cached.has_section('aws') and cached.has_option('aws', 'profile'):
+        return cached.get('aws', 'profile')
+
     config_file = get_config_file()
+
+    # Without any profile to use, e.g. with an instance role, nothing is
+    # saved in the config file. Remember that until one of the files or
+    # AWS_PROFILE changes, instead of parsing the files on every call.
+    sources_key = _profile_sources_key(config_file)
+    with _snapshot_lock:
+        if _no_profile['key'] == sources_key:
+            return fallback
+
     config = configparser.ConfigParser()
 
     with rlock:
@@ -609,14 +761,15 @@ def get_profile(fallback='from-env'):
                     # Set profile in cloudknot config to 'default'
                     profile = 'default'
                 else:
+                    with _snapshot_lock:
+                        _no_profile['key'] = sources_key
                     return fallback
 
             if not config.has_section('aws'):
                 config.add_section('aws')
 
             config.set('aws', 'profile', profile)
-            with open(config_file, 'w') as f:
-                config.write(f)
+            write_config(config, config_file)
 
             return profile
 
@@ -655,64 +808,241 @@ def set_profile(profile_name):
             config.add_section('aws')
 
         config.set('aws', 'profile', profile_name)
-        with open(config_file, 'w') as f:
-            config.write(f)
+        write_config(config, config_file)
 
-        # Update the boto3 clients so that the profile change is reflected
+        # Drop the boto3 clients so that the profile change is reflected
         # throughout the package
-        max_pool = clients['iam'].meta.config.max_pool_connections
-        boto_config = botocore.config.Config(max_pool_connections=max_pool)
-        session = boto3.Session(profile_name=profile_name)
-        clients['batch'] = session.client('batch', region_name=get_region(),
-                                          config=boto_config)
-        clients['cloudformation'] = session.client('cloudformation',
-                                                   region_name=get_region(),
-                                                   config=boto_config)
-        clients['ecr'] = session.client('ecr', region_name=get_region(),
-                                        config=boto_config)
-        clients['ecs'] = session.client('ecs', region_name=get_region(),
-                                        config=boto_config)
-        clients['ec2'] = session.client('ec2', region_name=get_region(),
-                                        config=boto_config)
-        clients['iam'] = session.client('iam', region_name=get_region(),
-                                        config=boto_config)
-        clients['sts'] = session.client('sts', region_name=get_region(),
-                                        config=boto_config)
-        clients['s3'] = session.client('s3', region_name=get_region(),
-                                       config=boto_config)
+        clients.reset()
+
+
+#: Number of connections in each client's connection pool, unless more
+#: concurrency is requested
+DEFAULT_MAX_POOL = 10
+
+
+class _ClientRegistry(object):
+    """Thread-safe registry of long-lived boto3 clients
+
+    Clients are keyed by profile, region, and connection pool size, and are
+    created from one boto3 session per profile. boto3 clients are thread-safe,
+    so every thread shares them. The pool size of a profile and region only
+    grows: requesting more concurrency creates new clients with a larger pool
+    for subsequent callers, while threads in flight keep using the clients
+    that they already hold.
+    """
+    def __init__(self):
+        self._lock = RLock()
+        self._sessions = {}
+        self._pools = {}
+        self._clients = {}
+
+    def pool(self, profile, region):
+        """Return the connection pool size for a profile and region"""
+        return self._pools.get((profile, region), DEFAULT_MAX_POOL)
+
+    def grow_pool(self, max_pool, profile, region):
+        """Grow the connection pool size for a profile and region
+
+        Parameters
+        ----------
+        max_pool : int
+            Requested number of connections in each client's pool. Smaller
+            values than the current pool size are ignored.
+
+        profile : string
+            AWS profile name
+
+        region : string
+            AWS region
+        """
+        if max_pool <= self.pool(profile, region):
+            return
+
+        with self._lock:
+            if max_pool > self.pool(profile, region):
+                self._pools[(profile, region)] = max_pool
+                # Forget the smaller clients. Threads that hold them may
+                # keep using them.
+                self._clients = dict(
+                    (k, c) for k, c in self._clients.items()
+                    if k[:2] != (profile, region)
+                )
+
+    def client(self, service, profile, region, max_pool=None):
+        """Return the client for a service, profile, and region
+
+        Parameters
+        ----------
+        service : string
+            AWS service name, e.g. 'batch'
+
+        profile : string
+            AWS profile name. None means the boto3 default profile.
+
+        region : string
+            AWS region
+
+        max_pool : int
+            Requested number of connections in the client's pool
+            Default: None means the current pool size
+        """
+        if max_pool is not None:
+            self.grow_pool(max_pool, profile, region)
+
+        pool = self.pool(profile, region)
+        key = (profile, region, pool, service)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # boto3 sessions are not thread-safe, so create clients
+                # while holding the lock
+                session = self._sessions.get(profile)
+                if session is None:
+                    import boto3
+                    session = boto3.Session(profile_name=profile)
+                    self._sessions[profile] = session
+
+                import botocore.config
+                client = session.client(
+                    service, region_name=region,
+                    config=botocore.config.Config(max_pool_connections=pool)
+                )
+                self._clients[key] = client
+
+            return client
+
+    def clear(self):
+        """Drop all sessions and clients, to be recreated on next use"""
+        with self._lock:
+            self._sessions = {}
+            self._pools = {}
+            self._clients = {}
+
+
+_client_registry = _ClientRegistry()
+
+
+class _LazyClients(MutableMapping):
+    """Dictionary of boto3 clients for one profile and region
+
+    Clients come from the shared client registry and are created on first
+    use, so that importing cloudknot neither builds a session nor reads the
+    config file. Clients assigned to the dictionary override those of the
+    registry.
+    """
+    services = ('batch', 'cloudformation', 'ecr', 'ecs', 'ec2', 'iam', 'sts',
+                's3')
+
+    def __init__(self, profile=None, region=None):
+        """Initialize a client dictionary
+
+        Parameters
+        ----------
+        profile : string
+            AWS profile name. None means the boto3 default profile.
+
+        region : string
+            AWS region
+            Default: None means follow the current profile and region (see
+            get_profile, get_region, and session_context)
+        """
+        self._lock = RLock()
+        self._bound = region is not None
+        self._key = (profile, region) if self._bound else None
+        self._max_pool = None
+        self._overrides = {}
+
+    @property
+    def key(self):
+        """The (profile, region) of the clients"""
+        return self._session_key()
+
+    def _session_key(self):
+        if self._bound:
+            return self._key
+
+        if (getattr(_session_override, 'profile', None) is not None
+                or getattr(_session_override, 'region', None) is not None):
+            return get_profile(fallback=None), get_region()
+
+        key = self._key
+        if key is None:
+            key = (get_profile(fallback=None), get_region())
+            self._key = key
+        return key
+
+    @property
+    def max_pool(self):
+        """Number of connections in each client's connection pool"""
+        return max(_client_registry.pool(*self._session_key()),
+                   self._max_pool or 0)
+
+    def grow_pool(self, max_pool):
+        """Request at least `max_pool` connections in each client's pool
+
+        The clients are replaced on their next use only if the pool grows.
+        """
+        with self._lock:
+            self._max_pool = max(self._max_pool or 0, max_pool)
+
+        profile, region = self._session_key()
+        _client_registry.grow_pool(max_pool, profile, region)
+
+    def reset(self, max_pool=None):
+        """Resolve the profile and region again on next use
+
+        Parameters
+        ----------
+        max_pool : int
+            Number of connections in each client's connection pool
+            Default: None means keep the requested pool size
+        """
+        with self._lock:
+            if not self._bound:
+                self._key = None
+            self._overrides = {}
+            if max_pool is not None:
+                self._max_pool = max_pool
+
+    def __getitem__(self, service):
+        client = self._overrides.get(service)
+        if client is not None:
+            return client
+
+        if service not in self.services:
+            raise KeyError(service)
+
+        profile, region = self._session_key()
+        return _client_registry.client(service, profile, region,
+                                       max_pool=self._max_pool)
+
+    def __setitem__(self, service, client):
+        with self._lock:
+            self._overrides[service] = client
+
+    def __delitem__(self, service):
+        with self._lock:
+            del self._overrides[service]
+
+    def __iter__(self):
+        extra = [s for s in list(self._overrides) if s not in self.services]
+        return iter(list(self.services) + extra)
+
+    def __len__(self):
+        return len(list(iter(self)))
 
 
 #: module-level dictionary of boto3 clients for IAM, EC2, Batch, ECR, ECS, S3.
-clients = {
-    'batch': boto3.Session(profile_name=get_profile(fallback=None)).client(
-        'batch', region_name=get_region()
-    ),
-    'cloudformation': boto3.Session(
-        profile_name=get_profile(fallback=None)
-    ).client('cloudformation', region_name=get_region()),
-    'ecr': boto3.Session(profile_name=get_profile(fallback=None)).client(
-        'ecr', region_name=get_region()
-    ),
-    'ecs': boto3.Session(profile_name=get_profile(fallback=None)).client(
-        'ecs', region_name=get_region()
-    ),
-    'ec2': boto3.Session(profile_name=get_profile(fallback=None)).client(
-        'ec2', region_name=get_region()
-    ),
-    'iam': boto3.Session(profile_name=get_profile(fallback=None)).client(
-        'iam', region_name=get_region()
-    ),
-    'sts': boto3.Session(profile_name=get_profile(fallback=None)).client(
-        'sts', region_name=get_region()
-    ),
-    's3': boto3.Session(profile_name=get_profile(fallback=None)).client(
-        's3', region_name=get_region()
-    ),
-}
+clients = _LazyClients()
 """module-level dictionary of boto3 clients.
 
 Storing the boto3 clients in a module-level dictionary allows us to change
-the region and profile and have those changes reflected globally.
+the region and profile and have those changes reflected globally. Each
+client is created on first use.
 
 Advanced users: if you want to use cloudknot and boto3 at the same time,
 you should use these clients to ensure that you have the right profile
@@ -722,25 +1052,22 @@ and region.
 
 @registered
 def refresh_clients(max_pool=10):
-    """Refresh the boto3 clients dictionary"""
+    """Refresh the boto3 clients dictionary
+
+    Drop all boto3 sessions and clients, e.g. to pick up new credentials.
+    The clients are recreated lazily, on their next use. To only allow more
+    concurrent requests, use `clients.grow_pool` instead, which does not
+    discard warm clients.
+
+    Parameters
+    ----------
+    max_pool : int
+        Maximum number of connections in each client's connection pool
+        Default: 10
+    """
     with rlock:
-        config = botocore.config.Config(max_pool_connections=max_pool)
-        session = boto3.Session(profile_name=get_profile(fallback=None))
-        clients['iam'] = session.client('iam', region_name=get_region(),
-                                        config=config)
-        clients['ec2'] = session.client('ec2', region_name=get_region(),
-                                        config=config)
-        clients['batch'] = session.client('batch', region_name=get_region(),
-                                          config=config)
-        clients['ecr'] = session.client('ecr', region_name=get_region(),
-                                        config=config)
-        clients['ecs'] = session.client('ecs', region_name=get_region(),
-                                        config=config)
-        clients['s3'] = session.client('s3', region_name=get_region(),
-                                       config=config)
-        clients['cloudformation'] = session.client('cloudformation',
-                                                   region_name=get_region(),
-                                                   config=config)
+        _client_registry.clear()
+        clients.reset(max_pool=max_pool)
 
 
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
@@ -899,18 +1226,49 @@ class CKTimeoutError(Exception):
 @registered
 class BatchJobFailedError(Exception):
     """Error indicating an AWS Batch job failed"""
-    def __init__(self, job_id):
+    def __init__(self, job_id, index=None, reason=None,
+                 remote_traceback=None):
         """Initialize the Exception
 
         Parameters
         ----------
         job_id : string
             The AWS jobId of the failed job
+
+        index : int
+            The array index of the failed child job, if applicable
+            Default: None
+
+        reason : string
+            The AWS Batch status reason for the failure, if available
+            Default: None
+
+        remote_traceback : string
+            The traceback of the exception raised in the batch job
+            container, if available
+            Default: None
         """
-        super(BatchJobFailedError, self).__init__(
-            "AWS Batch job {job_id:s} has failed.".format(job_id=job_id)
-        )
+        if index is None:
+            message = "AWS Batch job {job_id:s} has failed.".format(
+                job_id=job_id
+            )
+        else:
+            message = ("Element {index:d} of AWS Batch array job {job_id:s} "
+                       "has failed.".format(index=index, job_id=job_id))
+
+        if reason:
+            message += " Reason: {reason:s}".format(reason=reason)
+
+        if remote_traceback:
+            message += "\n\nRemote traceback:\n{tb:s}".format(
+                tb=remote_traceback
+            )
+
+        super(BatchJobFailedError, self).__init__(message)
         self.job_id = job_id
+        self.index = index
+        self.reason = reason
+        self.remote_traceback = remote_traceback
 
 
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
@@ -982,6 +1340,7 @@ class NamedObject(object):
         self._clobbered = False
         self._region = get_region()
         self._profile = get_profile()
+        self._clients = None
 
     @property
     def name(self):
@@ -1003,6 +1362,20 @@ class NamedObject(object):
         """The AWS profile in which this resource was created"""
         return self._profile
 
+    @property
+    def clients(self):
+        """Dictionary of boto3 clients for this resource's profile and region
+
+        Use these instead of the module-level clients, so that resources in
+        different profiles and regions can be used at the same time.
+        """
+        profile = None if self.profile == 'from-env' else self.profile
+        clients_ = self._clients
+        if clients_ is None or clients_.key != (profile, self.region):
+            clients_ = _LazyClients(profile=profile, region=self.region)
+            self._clients = clients_
+        return clients_
+
     def _get_section_name(self, resource_type):
         """Return the config section name
 
@@ -1011,12 +1384,24 @@ class NamedObject(object):
         return ' '.join([resource_type, self.profile, self.region])
 
     def check_profile(self):
-        """Check for profile exception"""
-        if self.profile != get_profile():
+        """Check for profile exception
+
+        Resources make their AWS calls with their own clients, so they may
+        be used while cloudknot is configured with another profile. This only
+        fails if the resource's profile no longer exists.
+        """
+        if (self.profile != 'from-env'
+                and self.profile != get_profile()
+                and self.profile not in list_profiles().profile_names):
             raise ProfileException(resource_profile=self.profile)
 
     def check_profile_and_region(self):
-        """Check for region and profile exceptions"""
+        """Check for region and profile exceptions
+
+        Methods decorated with in_resource_session run in the region of the
+        resource, so they pass this check from any region. Elsewhere, the
+        current region must be the resource's region.
+        """
         if self.region != get_region():
             raise RegionException(resource_region=self.region)
 
@@ -3,15 +3,21 @@ from __future__ import absolute_import, division, print_function
 import cloudknot.config
 import cloudpickle
 from datetime import datetime
+import gzip
+import io
+import json
 import logging
 import pickle
 import six
 import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from .base_classes import NamedObject, clients, \
     ResourceDoesNotExistException, ResourceClobberedException, \
-    BatchJobFailedError, CKTimeoutError, CloudknotInputError, get_s3_params
+    BatchJobFailedError, CKTimeoutError, CloudknotInputError, get_s3_params, \
+    in_resource_session
+from .s3 import REF_KEY
 
 __all__ = []
 
@@ -23,6 +29,62 @@ def registered(fn):
 
 mod_logger = logging.getLogger(__name__)
 
+#: namedtuple returned in place of results that were written to a sink
+SinkReference = namedtuple('SinkReference', ['bucket', 'key'])
+__all__.append('SinkReference')
+
+#: namedtuple returned by gathered results for elements without output
+MissingResult = namedtuple('MissingResult', ['index'])
+__all__.append('MissingResult')
+
+SINK_FORMATS = ['pickle', 'json', 'bytes']
+
+# Dictionary key that the container uses to mark missing gathered results
+MISSING_KEY = '__cloudknot_missing__'
+
+# Names of the objects stored by an attempt that succeeded
+SUCCESS_NAMES = {'output.pickle', 'manifest-ok.json', 'manifest-none.json'}
+
+# Exit code with which the container reports an exception raised by the
+# user's function (see the cloudknot script template)
+USER_ERROR_EXIT_CODE = '3'
+
+
+def _loads(body):
+    """Unpickle an S3 object body, decompressing it if it is gzipped"""
+    if body[:2] == b'\x1f\x8b':
+        body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+
+    return pickle.loads(body)
+
+
+def _list_children(job_id, status, batch=None):
+    """Return a dict mapping the array indices of child jobs with `status`
+    to their status reasons
+
+    `batch` is the boto3 Batch client to use. Default: None means the
+    module-level client.
+    """
+    batch = clients['batch'] if batch is None else batch
+    paginator = batch.get_paginator('list_jobs')
+
+    children = {}
+    for page in paginator.paginate(arrayJobId=job_id, jobStatus=status):
+        for summary in page.get('jobSummaryList', []):
+            # Child job IDs have the form <array job ID>:<index>
+            index = int(summary['jobId'].rsplit(':', 1)[1])
+            children[index] = summary.get('statusReason')
+
+    return children
+
+
+def _command_option(command, flag):
+    """Return the value following `flag` in a job command or None"""
+    try:
+        return command[command.index(flag) + 1]
+    except (ValueError, IndexError):
+        return None
+
 
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 @registered
@@ -30,7 +92,12 @@ class BatchJob(NamedObject):
     """Class for defining AWS Batch Job"""
     def __init__(self, job_id=None, name=None, job_queue=None,
                  job_definition=None, input_=None, starmap=False,
-                 environment_variables=None, array_job=True):
+                 environment_variables=None, array_job=True,
+                 resolve_refs=False, sink=None, sink_format='pickle',
+                 depends_on=None, dependency_type=None, gather=False,
+                 retry_of=None, attempt_offset=0, retry_user_errors=True,
+                 workers=None, ranking=None, chunksize=None, vcpus=None,
+                 memory=None):
         """Initialize an AWS Batch Job object.
 
         If requesting information on a pre-existing job, `job_id` is required.
@@ -51,7 +118,9 @@ class BatchJob(NamedObject):
 
         job_definition : namedtuple or object
             namedtuple specifying the job definition on which to base this job.
-            Must contain fields 'name', 'arn', 'output_bucket', and 'retries'
+            Must contain fields 'name', 'arn', 'output_bucket', and 'retries'.
+            An optional field 'vcpus' sets the default number of processes
+            that each child of a chunked job runs (see `chunksize`).
 
         input_ :
             The input to be pickled and sent to the batch job via S3
@@ -67,6 +136,99 @@ class BatchJob(NamedObject):
         array_job : bool
             If True, this batch job will be an array_job.
             Default: True
+
+        resolve_refs : bool
+            If True, the container resolves references (e.g. to S3 objects)
+            in the input before passing it to the function.
+            Default: False
+
+        sink : string
+            S3 URL template to which the container writes each result instead
+            of the cloudknot output location, e.g.
+            's3://bucket/prefix/{index}/{attempt}.pickle'. The template may use
+            the fields `index`, `attempt`, `job_id`, and `input` (the unpickled
+            input element). If provided, the results of this job are
+            SinkReference namedtuples pointing to the written objects.
+            Default: None
+
+        sink_format : 'pickle', 'json', or 'bytes'
+            Serialization format for results written to `sink`
+            Default: 'pickle'
+
+        depends_on : sequence of BatchJob instances or job ID strings
+            Jobs that must complete before this job may start
+            Default: None
+
+        dependency_type : 'N_TO_N', 'SEQUENTIAL', or None
+            Type of the dependencies in `depends_on`. If 'N_TO_N', each
+            child of this array job depends only on the child with the same
+            index in each of the `depends_on` array jobs.
+            Default: None means that this job waits for all of the
+            `depends_on` jobs to complete
+
+        gather : bool
+            If True, this job does not call the function. Instead, the
+            container resolves the input, which should be a reference to the
+            output of another job (see `BatchJob.output_ref`), and stores it
+            as a single compressed result.
+            Default: False
+
+        retry_of : BatchJob instance or job ID string
+            A previous array job whose elements this job runs again. If
+            provided, `input_` must be a list of indices into the input of
+            `retry_of` and the container writes the results to the output
+            location of `retry_of`. See `BatchJob.resubmit_failed`.
+            Default: None
+
+        attempt_offset : int
+            Offset added to the attempt numbers of this job's outputs, so
+            that they do not overwrite those of previous attempts
+            Default: 0
+
+        retry_user_errors : bool
+            If False, AWS Batch does not retry attempts that failed because
+            the python function raised an exception, since they would most
+            likely fail in the same way again. Attempts that failed for other
+            reasons, e.g. spot instance interruptions, are still retried.
+            Default: True
+
+        workers : int
+            If provided, this array job has this many long-lived child jobs
+            (at least two) that claim the elements of `input_` from a shared
+            task queue in S3 (see cloudknot.taskqueue) and process them until
+            none are left, instead of one child job per element. An exception
+            raised for one element does not stop its worker.
+            Default: None
+
+        ranking : sequence of ints
+            If provided with `workers`, the indices of the elements of
+            `input_` in the order in which the workers should process them,
+            e.g. by decreasing estimated cost. The ranked elements are dealt
+            round-robin to the workers, which steal the remaining elements of
+            other workers once they run out (see cloudknot.taskqueue).
+            Default: None means in order of their indices
+
+        chunksize : int
+            If provided, each child of this array job processes a chunk of
+            this many consecutive elements of `input_`, in a pool of as many
+            processes as the job definition has vCPUs, instead of a single
+            element. The results are still stored per element, so that
+            `result` returns one result per element. There must be at least
+            two chunks. An exception raised for one element does not stop the
+            other elements of its chunk, and retries of a chunk skip its
+            elements that already succeeded.
+            Default: None
+
+        vcpus : int
+            Number of vCPUs reserved for each container of this job,
+            overriding that of the job definition. Chunked jobs run this many
+            processes per chunk.
+            Default: None means use the job definition's vCPUs
+
+        memory : int
+            Memory (MiB) reserved for each container of this job, overriding
+            that of the job definition
+            Default: None means use the job definition's memory
         """
         has_input = input_ is not None
         if not (job_id or all([name, job_queue, has_input, job_definition])):
@@ -97,6 +259,35 @@ class BatchJob(NamedObject):
             self._environment_variables = job.environment_variables
             self._job_id = job.job_id
             self._array_job = job.array_job
+            self._resolve_refs = '--refs' in job.command
+            self._sink = _command_option(job.command, '--sink')
+            self._sink_format = (_command_option(job.command, '--sink-format')
+                                 or 'pickle')
+            self._depends_on = [d['jobId'] for d in job.depends_on]
+            dependency_types = [d.get('type') for d in job.depends_on]
+            self._dependency_type = (dependency_types[0] if dependency_types
+                                     else None)
+            self._gather = '--gather' in job.command
+            self._retry_of = _command_option(job.command, '--retry-of')
+            self._attempt_offset = int(
+                _command_option(job.command, '--attempt-offset') or 0
+            )
+            self._resubmissions = []
+            self._speculations = []
+            self._workers = int(
+                _command_option(job.command, '--workers') or 0
+            ) or None
+            self._ranking = None
+            self._chunksize = int(
+                _command_option(job.command, '--chunksize') or 0
+            ) or None
+            self._vcpus = job.resources.get('VCPU')
+            self._memory = job.resources.get('MEMORY')
+            self._retry_user_errors = not any(
+                rule.get('onExitCode') == USER_ERROR_EXIT_CODE
+                and rule.get('action', '').upper() == 'EXIT'
+                for rule in job.retry_strategy.get('evaluateOnExit', [])
+            )
 
             bucket = self._job_definition.output_bucket
             key = '/'.join([
@@ -107,14 +298,15 @@ class BatchJob(NamedObject):
             ])
 
             try:
-                response = clients['s3'].get_object(Bucket=bucket, Key=key)
+                response = self.clients['s3'].get_object(Bucket=bucket,
+                                                         Key=key)
                 self._input = pickle.loads(response.get('Body').read())
-            except (clients['s3'].exceptions.NoSuchBucket,
-                    clients['s3'].exceptions.NoSuchKey):
+            except (self.clients['s3'].exceptions.NoSuchBucket,
+                    self.clients['s3'].exceptions.NoSuchKey):
                 self._input = None
 
             self._section_name = self._get_section_name('batch-jobs')
-            cloudknot.config.add_resource(
+            cloudknot.config.add_job(
                 self._section_name, self.job_id, self.name
             )
 
@@ -152,8 +344,79 @@ class BatchJob(NamedObject):
             else:
                 self._environment_variables = None
 
+            if sink is not None:
+                if not (isinstance(sink, six.string_types)
+                        and sink.startswith('s3://')):
+                    raise CloudknotInputError(
+                        'sink must be an S3 URL template of the form '
+                        's3://bucket/key-template'
+                    )
+                if sink_format not in SINK_FORMATS:
+                    raise CloudknotInputError(
+                        'sink_format must be one of {formats!s}'.format(
+                            formats=SINK_FORMATS
+                        )
+                    )
+
+            if workers is not None and (not array_job or int(workers) < 2):
+                raise CloudknotInputError(
+                    'workers requires an array job with at least two workers.'
+                )
+
+            if ranking is not None:
+                if workers is None:
+                    raise CloudknotInputError('ranking requires workers.')
+
+                ranking = [int(i) for i in ranking]
+                if sorted(ranking) != list(range(len(input_))):
+                    raise CloudknotInputError(
+                        'ranking must be a permutation of the indices of '
+                        'input_.'
+                    )
+
+            if chunksize is not None:
+                chunksize = int(chunksize)
+                if chunksize < 1:
+                    raise CloudknotInputError('chunksize must be positive.')
+
+                if (not array_job or workers is not None
+                        or len(input_) <= chunksize):
+                    raise CloudknotInputError(
+                        'chunksize requires an array job without workers '
+                        'and with at least two chunks.'
+                    )
+
+            for resource, value in [('vcpus', vcpus), ('memory', memory)]:
+                if value is not None and int(value) < 1:
+                    raise CloudknotInputError(
+                        '{r:s} must be positive.'.format(r=resource)
+                    )
+
             self._input = input_
             self._array_job = array_job
+            self._vcpus = int(vcpus) if vcpus is not None else None
+            self._memory = int(memory) if memory is not None else None
+            self._workers = int(workers) if workers is not None else None
+            self._ranking = ranking
+            self._chunksize = chunksize
+            self._resolve_refs = resolve_refs
+            self._sink = sink
+            self._sink_format = sink_format
+            if dependency_type not in [None, 'N_TO_N', 'SEQUENTIAL']:
+                raise CloudknotInputError(
+                    "dependency_type must be 'N_TO_N', 'SEQUENTIAL', or None"
+                )
+
+            self._depends_on = [d.job_id if isinstance(d, BatchJob) else d
+                                for d in (depends_on or [])]
+            self._dependency_type = dependency_type
+            self._gather = gather
+            self._retry_of = (retry_of.job_id if isinstance(retry_of, BatchJob)
+                              else retry_of)
+            self._attempt_offset = int(attempt_offset)
+            self._resubmissions = []
+            self._speculations = []
+            self._retry_user_errors = retry_user_errors
             self._job_id = self._create()
 
     @property
@@ -189,6 +452,84 @@ class BatchJob(NamedObject):
         """Boolean flag to indicate whether this is an array job"""
         return self._array_job
 
+    @property
+    def resolve_refs(self):
+        """Boolean flag to indicate whether the container resolves refs"""
+        return self._resolve_refs
+
+    @property
+    def sink(self):
+        """S3 URL template to which results are written, or None"""
+        return self._sink
+
+    @property
+    def sink_format(self):
+        """Serialization format for results written to the sink"""
+        return self._sink_format
+
+    @property
+    def depends_on(self):
+        """List of job IDs on which this job depends"""
+        return self._depends_on
+
+    @property
+    def dependency_type(self):
+        """Type of the dependencies on the jobs in `depends_on`"""
+        return self._dependency_type
+
+    @property
+    def gather(self):
+        """Boolean flag to indicate whether this is a gather job"""
+        return self._gather
+
+    @property
+    def retry_of(self):
+        """Job ID of the array job whose elements this job runs again"""
+        return self._retry_of
+
+    @property
+    def attempt_offset(self):
+        """Offset added to the attempt numbers of this job's outputs"""
+        return self._attempt_offset
+
+    @property
+    def retry_user_errors(self):
+        """Boolean flag to indicate whether user errors are retried"""
+        return self._retry_user_errors
+
+    @property
+    def workers(self):
+        """Number of worker child jobs, or None if each element has its own
+        child job"""
+        return self._workers
+
+    @property
+    def ranking(self):
+        """Order in which workers process the elements, if known"""
+        return self._ranking
+
+    @property
+    def chunksize(self):
+        """Number of elements processed by each child of a chunked job"""
+        return self._chunksize
+
+    @property
+    def vcpus(self):
+        """vCPUs reserved for each container, if they override the job
+        definition's"""
+        return self._vcpus
+
+    @property
+    def memory(self):
+        """Memory (MiB) reserved for each container, if it overrides the
+        job definition's"""
+        return self._memory
+
+    @property
+    def resubmissions(self):
+        """Jobs submitted by `resubmit_failed` to run failed elements"""
+        return self._resubmissions
+
     @property
     def job_id(self):
         """This job's AWS jobID"""
@@ -206,13 +547,15 @@ class BatchJob(NamedObject):
         namedtuple JobExists
             A namedtuple with fields
             ['exists', 'name', 'job_id', 'job_queue_arn', 'job_definition',
-             'environment_variables', 'array_job']
+             'environment_variables', 'array_job', 'command', 'depends_on',
+             'retry_strategy']
         """
         # define a namedtuple for return value type
         JobExists = namedtuple(
             'JobExists',
             ['exists', 'name', 'job_id', 'job_queue_arn', 'job_definition',
-             'environment_variables', 'array_job']
+             'environment_variables', 'array_job', 'command', 'depends_on',
+             'retry_strategy', 'resources']
         )
         # make all but the first value default to None
         JobExists.__new__.__defaults__ = \
@@ -226,6 +569,14 @@ class BatchJob(NamedObject):
             job_queue_arn = job['jobQueue']
             job_def_arn = job['jobDefinition']
             environment_variables = job['container']['environment']
+            command = job['container'].get('command', [])
+            depends_on = job.get('dependsOn', [])
+            retry_strategy = job.get('retryStrategy', {})
+            resources = dict(
+                (r['type'], int(float(r['value'])))
+                for r in job['container'].get('resourceRequirements', [])
+                if r['type'] in ['VCPU', 'MEMORY']
+            )
 
             array_job = 'arrayProperties' in job
 
@@ -241,12 +592,14 @@ class BatchJob(NamedObject):
             job_def_retries = job_def['retryStrategy']['attempts']
 
             JobDef = namedtuple('JobDef',
-                                ['name', 'arn', 'output_bucket', 'retries'])
+                                ['name', 'arn', 'output_bucket', 'retries',
+                                 'vcpus'])
             job_definition = JobDef(
                 name=job_def_name,
                 arn=job_def_arn,
                 output_bucket=output_bucket,
-                retries=job_def_retries
+                retries=job_def_retries,
+                vcpus=job_def['containerProperties'].get('vcpus')
             )
 
             mod_logger.info('Job {id:s} exists.'.format(id=job_id))
@@ -256,7 +609,11 @@ class BatchJob(NamedObject):
                 job_queue_arn=job_queue_arn,
                 job_definition=job_definition,
                 environment_variables=environment_variables,
-                array_job=array_job
+                array_job=array_job,
+                command=command,
+                depends_on=depends_on,
+                retry_strategy=retry_strategy,
+                resources=resources
             )
         else:
             return JobExists(exists=False)
@@ -282,6 +639,32 @@ class BatchJob(NamedObject):
         if sse:
             command = ['--sse', sse] + command
 
+        if self.resolve_refs:
+            command = ['--refs'] + command
+
+        if self.sink is not None:
+            command = ['--sink', self.sink,
+                       '--sink-format', self.sink_format] + command
+
+        if self.gather:
+            command = ['--gather'] + command
+
+        if self.retry_of is not None:
+            command = ['--retry-of', self.retry_of,
+                       '--attempt-offset', str(self.attempt_offset)] + command
+
+        if self.workers:
+            command = ['--workers', str(self.workers)] + command
+
+        if self.ranking is not None:
+            command = ['--ranked'] + command
+
+        if self.chunksize:
+            command = ['--chunksize', str(self.chunksize)] + command
+            vcpus = self.vcpus or getattr(self.job_definition, 'vcpus', None)
+            if vcpus:
+                command = ['--processes', str(vcpus)] + command
+
         if self.array_job:
             command = ['--arrayjob'] + command
 
@@ -295,40 +678,81 @@ class BatchJob(NamedObject):
                 'command': command
             }
 
+        resource_requirements = [
+            {'type': resource, 'value': str(value)}
+            for resource, value in [('VCPU', self.vcpus),
+                                    ('MEMORY', self.memory)]
+            if value is not None
+        ]
+        if resource_requirements:
+            container_overrides['resourceRequirements'] = \
+                resource_requirements
+
+        submit_kwargs = {
+            'jobName': self.name,
+            'jobQueue': self.job_queue_arn,
+            'jobDefinition': self.job_definition.arn,
+            'containerOverrides': container_overrides
+        }
+
+        if self.array_job:
+            if self.chunksize:
+                size = len(range(0, len(self.input), self.chunksize))
+            else:
+                size = self.workers or len(self.input)
+
+            submit_kwargs['arrayProperties'] = {'size': size}
+
+        if not self.retry_user_errors:
+            # Do not retry attempts that exited with the user error code.
+            # AWS Batch retries attempts that match none of these rules.
+            submit_kwargs['retryStrategy'] = {
+                'attempts': self.job_definition.retries,
+                'evaluateOnExit': [{
+                    'onExitCode': USER_ERROR_EXIT_CODE,
+                    'action': 'EXIT'
+                }]
+            }
+
+        if self.depends_on:
+            submit_kwargs['dependsOn'] = [{'jobId': jid}
+                                          for jid in self.depends_on]
+            if self.dependency_type:
+                for dependency in submit_kwargs['dependsOn']:
+                    dependency['type'] = self.dependency_type
+
         # We have to submit before uploading the input in order to get the
         # jobID first.
-        if self.array_job:
-            response = clients['batch'].submit_job(
-                jobName=self.name,
-                jobQueue=self.job_queue_arn,
-                arrayProperties={'size': len(self.input)},
-                jobDefinition=self.job_definition.arn,
-                containerOverrides=container_overrides
-            )
-        else:
-            response = clients['batch'].submit_job(
-                jobName=self.name,
-                jobQueue=self.job_queue_arn,
-                jobDefinition=self.job_definition.arn,
-                containerOverrides=container_overrides
-            )
+        response = self.clients['batch'].submit_job(**submit_kwargs)
 
         job_id = response['jobId']
         key = '/'.join([
             'cloudknot.jobs', self.job_definition.name, job_id, 'input.pickle'
         ])
 
+        if self.ranking is not None:
+            # Upload the ranking for the workers' task queue
+            put_kwargs = {'ServerSideEncryption': sse} if sse else {}
+            self.clients['s3'].put_object(
+                Bucket=bucket, Body=json.dumps(self.ranking).encode('utf-8'),
+                Key='/'.join([
+                    'cloudknot.jobs', self.job_definition.name, job_id,
+                    'ranking.json'
+                ]),
+                **put_kwargs
+            )
+
         # Upload the input pickle
         if sse:
-            clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
-                                     Key=key, ServerSideEncryption=sse)
+            self.clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
+                                          Key=key, ServerSideEncryption=sse)
         else:
-            clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
-                                     Key=key)
+            self.clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
+                                          Key=key)
 
         # Add this job to the list of jobs in the config file
         self._section_name = self._get_section_name('batch-jobs')
-        cloudknot.config.add_resource(
+        cloudknot.config.add_job(
             self._section_name, job_id, self.name
         )
 
@@ -340,6 +764,7 @@ class BatchJob(NamedObject):
         return job_id
 
     @property
+    @in_resource_session
     def status(self):
         """Query AWS batch job status using instance parameter `self.job_id`
 
@@ -358,7 +783,7 @@ class BatchJob(NamedObject):
         self.check_profile_and_region()
 
         # Query the job_id
-        response = clients['batch'].describe_jobs(jobs=[self.job_id])
+        response = self.clients['batch'].describe_jobs(jobs=[self.job_id])
         job = response.get('jobs')[0]
 
         # Return only a subset of the job dictionary
@@ -401,18 +826,266 @@ class BatchJob(NamedObject):
     def done(self):
         """Return True if the job is done.
 
-        In this case, "done" means the job status is SUCCEEDED or that it is
-        FAILED and the job has exceeded the max number of retry attempts
+        In this case, "done" means the job status is SUCCEEDED or FAILED.
+        AWS Batch only sets the FAILED status after the last retry attempt,
+        or after an attempt that should not be retried. Array jobs only fail
+        after all of their child jobs are done. Jobs with resubmitted
+        elements are only done when all resubmissions are done.
         """
-        stat = self.status
-        done = (stat['status'] == 'SUCCEEDED'
-                or (stat['status'] == 'FAILED'
-                    and len(stat['attempts']) >= self.job_definition.retries))
+        done = self.status['status'] in ['SUCCEEDED', 'FAILED']
 
-        return done
+        return done and all(r.done for r in self._reruns)
 
-    def _collect_array_job_result(self, idx=0):
-        """Collect the array job results and return as a complete list
+    @property
+    def _reruns(self):
+        """Resubmission and speculative jobs for elements of this job"""
+        return self.resubmissions + self._speculations
+
+    @property
+    def _max_attempt(self):
+        """Highest attempt number of any output of this job"""
+        return max(
+            [self.attempt_offset + self.job_definition.retries]
+            + [r._max_attempt for r in self._reruns]
+        )
+
+    def _children(self, status):
+        """Return a dict mapping indices of elements with `status` to their
+        status reasons. For a non-array job, the only index is 0."""
+        if self.array_job:
+            return _list_children(self.job_id, status,
+                                  batch=self.clients['batch'])
+
+        job_status = self.status
+        return ({0: job_status.get('statusReason')}
+                if job_status['status'] == status else {})
+
+    def _chunk_indices(self, chunk):
+        """Return the indices of the elements in child `chunk` of a chunked
+        job"""
+        start = chunk * self.chunksize
+        return range(start, min(start + self.chunksize, len(self.input)))
+
+    def _child_id(self, idx):
+        """Return the AWS jobID of element `idx` of this job"""
+        if self.array_job:
+            return '{id:s}:{idx:d}'.format(id=self.job_id, idx=idx)
+        return self.job_id
+
+    def _failed_children(self):
+        """Return a dict mapping failed indices to their status reasons
+
+        Indices of elements that were resubmitted are replaced by the
+        failures, if any, of the latest resubmission. Elements with a
+        speculative duplicate only fail if the duplicate also failed. The
+        indices of resubmission and speculative jobs are positions in their
+        own input.
+
+        The child jobs of a worker-pool job are workers, not elements. Its
+        elements fail individually (see `result`) or, if the job failed,
+        because no worker processed them. The child jobs of a chunked job
+        fail if any element of their chunk failed.
+        """
+        if self.workers:
+            if self.status['status'] != 'FAILED':
+                return {}
+
+            attempts = self._latest_attempts()
+            return dict((idx, 'No worker processed this element')
+                        for idx in range(len(self.input))
+                        if idx not in attempts)
+
+        failed = self._children('FAILED')
+
+        if self.chunksize and failed:
+            # Only the elements of a failed chunk that did not succeed in
+            # their latest attempt failed
+            attempts = self._latest_attempts()
+            failed = dict(
+                (idx, reason)
+                for chunk, reason in failed.items()
+                for idx in self._chunk_indices(chunk)
+                if not attempts.get(idx, (None, set()))[1]
+                & {'manifest-ok.json', 'manifest-none.json'}
+            )
+
+        for speculation in self._speculations:
+            speculation_failed = speculation._failed_children()
+            for i, idx in enumerate(speculation.input):
+                if i not in speculation_failed:
+                    failed.pop(idx, None)
+
+        for resubmission in self.resubmissions:
+            for idx in resubmission.input:
+                failed.pop(idx, None)
+
+            failed.update(
+                (resubmission.input[i], reason)
+                for i, reason in resubmission._failed_children().items()
+            )
+
+        return failed
+
+    @property
+    def failed_indices(self):
+        """Sorted list of indices of failed elements of this job
+
+        For array jobs, these are the array indices of the child jobs that
+        failed after exhausting their retries and were not successfully
+        resubmitted. For other jobs, this is [0] if the job failed.
+        """
+        return sorted(self._failed_children().keys())
+
+    def _output_location(self, idx):
+        """Return the job ID and index under which element `idx` is stored
+
+        Resubmission jobs write to the original job's output location.
+        """
+        if self.retry_of is not None:
+            return self.retry_of, self.input[idx]
+
+        return self.job_id, idx
+
+    def _output_prefix(self):
+        """Return the S3 key prefix of this job's outputs"""
+        return '/'.join([
+            'cloudknot.jobs', self.job_definition.name,
+            self.retry_of or self.job_id, ''
+        ])
+
+    def _latest_attempts(self, idx=None):
+        """Return a dict mapping element indices to their latest attempts
+
+        The container writes a status manifest for each element and attempt
+        (see the cloudknot script template), so all elements are resolved
+        from a single listing of this job's output location, without
+        probing for missing keys. The latest attempt of an element that
+        succeeded takes precedence over later attempts that failed, since
+        speculative duplicates write with higher attempt numbers and may
+        fail after the original succeeded.
+
+        Parameters
+        ----------
+        idx : int
+            If provided, only list the attempts of this output index
+            Default: None
+
+        Returns
+        -------
+        latest : dict
+            Maps output indices (i.e. original indices for resubmission jobs)
+            to (attempt, names) tuples, where names is the set of object
+            names, e.g. 'output.pickle' or 'manifest-ok.json', stored for
+            that attempt
+        """
+        bucket = self.job_definition.output_bucket
+        prefix = self._output_prefix()
+        list_prefix = prefix if idx is None else prefix + str(idx) + '/'
+
+        attempts = {}
+        paginator = self.clients['s3'].get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=list_prefix):
+            for obj in page.get('Contents', []):
+                # Keys look like <prefix>/<index>/<attempt>/<name>
+                parts = obj['Key'][len(prefix):].split('/')
+                if not (len(parts) == 3 and parts[0].isdigit()
+                        and parts[1].isdigit()):
+                    continue
+
+                index, attempt = int(parts[0]), int(parts[1])
+                attempts.setdefault(index, {}).setdefault(
+                    attempt, set()
+                ).add(parts[2])
+
+        latest = {}
+        for index, names_by_attempt in attempts.items():
+            succeeded = [a for a in names_by_attempt
+                         if names_by_attempt[a] & SUCCESS_NAMES]
+            attempt = max(succeeded or names_by_attempt)
+            latest[index] = (attempt, names_by_attempt[attempt])
+
+        return latest
+
+    def _remote_traceback(self, idx=0):
+        """Return the traceback stored by the latest failed attempt or None
+
+        Parameters
+        ----------
+        idx : int
+            Index of the array job element
+            Default: 0
+        """
+        _, idx = self._output_location(idx)
+        bucket = self.job_definition.output_bucket
+        prefix = self._output_prefix() + str(idx) + '/'
+
+        keys = []
+        paginator = self.clients['s3'].get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys += [o['Key'] for o in page.get('Contents', [])
+                     if o['Key'].endswith('/manifest-exception.json')]
+
+        if not keys:
+            return None
+
+        # Attempt numbers are zero-padded, so the last key is the latest
+        response = self.clients['s3'].get_object(Bucket=bucket, Key=max(keys))
+        manifest = json.loads(response.get('Body').read().decode('utf-8'))
+        return manifest.get('traceback')
+
+    def manifests(self, max_threads=32):
+        """Return the status manifests of all attempts of this job's elements
+
+        The container writes a manifest for each attempt of each element
+        that ran to completion, whether the function returned or raised an
+        exception. Attempts that were killed, e.g. for running out of memory,
+        leave no manifest. Resubmission jobs write their manifests to the
+        original job's output location, so the manifests of the original
+        job include theirs.
+
+        Parameters
+        ----------
+        max_threads : int
+            Maximum number of threads used to download the manifests
+            Default: 32
+
+        Returns
+        -------
+        manifests : list of dicts
+            The manifests, with keys 'job_id', 'index', 'attempt', 'status'
+            (one of 'ok', 'none', or 'exception'), 'started_at',
+            'finished_at', 'duration', 'cpu_time' (seconds), and
+            'peak_rss_mib', sorted by index and attempt. Manifests written by
+            earlier versions of cloudknot lack some of these keys.
+        """
+        bucket = self.job_definition.output_bucket
+
+        keys = []
+        paginator = self.clients['s3'].get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket,
+                                       Prefix=self._output_prefix()):
+            keys += [o['Key'] for o in page.get('Contents', [])
+                     if o['Key'].rsplit('/', 1)[-1].startswith('manifest-')]
+
+        def load(key):
+            response = self.clients['s3'].get_object(Bucket=bucket, Key=key)
+            return json.loads(response.get('Body').read().decode('utf-8'))
+
+        with ThreadPoolExecutor(max(min(len(keys), max_threads), 1)) as e:
+            manifests = list(e.map(load, keys))
+
+        return sorted(manifests,
+                      key=lambda m: (m.get('index'), m.get('attempt')))
+
+    def _failure(self, idx, reason):
+        """Return a BatchJobFailedError for a failed element"""
+        return BatchJobFailedError(
+            self.job_id, index=idx if self.array_job else None, reason=reason,
+            remote_traceback=self._remote_traceback(idx)
+        )
+
+    def _collect_array_job_result(self, idx=0, attempts=None):
+        """Collect the result of one array job element
 
         Parameters
         ----------
@@ -420,46 +1093,137 @@ class BatchJob(NamedObject):
             Index of the array job element to be retrieved.
             Default: 0
 
+        attempts : dict
+            Latest attempts of this job's elements, as returned by
+            `_latest_attempts`
+            Default: None means list the attempts of element `idx`
+
         Returns
         -------
         The array job element at index `idx`
         """
         bucket = self.job_definition.output_bucket
+        _, out_idx = self._output_location(idx)
 
-        # For array jobs, different child jobs may have had different
-        # numbers of attempts. So we start at the highest possible attempt
-        # number and retrieve the latest one.
-        attempt = self.job_definition.retries
-        result_retrieved = False
+        if attempts is None:
+            attempts = self._latest_attempts(out_idx)
 
-        while not result_retrieved and attempt >= 0:
-            key = '/'.join([
-                'cloudknot.jobs', self.job_definition.name,
-                self.job_id, str(idx),
-                '{0:03d}'.format(attempt), 'output.pickle'
-            ])
+        # Different child jobs may have had different numbers of attempts.
+        # Only the latest (successful) attempt of each element counts.
+        attempt, names = attempts.get(out_idx, (None, set()))
 
-            try:
-                response = clients['s3'].get_object(Bucket=bucket, Key=key)
-                result_retrieved = True
-            except clients['s3'].exceptions.NoSuchKey:
-                attempt -= 1
+        if 'manifest-none.json' in names:
+            return None
 
-        if not result_retrieved:
+        if 'manifest-exception.json' in names:
+            raise self._failure(idx, None)
+
+        if 'output.pickle' not in names:
             raise CKTimeoutError(
-                'Result not available in bucket {bucket:s} with key {key:s}'
-                ''.format(bucket=bucket, key=key)
+                'Result not available in bucket {bucket:s} for element '
+                '{idx:d} of job {job_id:s}'.format(
+                    bucket=bucket, idx=idx, job_id=self.job_id
+                )
             )
 
-        return pickle.loads(response.get('Body').read())
+        key = '{prefix:s}{idx:d}/{attempt:03d}/output.pickle'.format(
+            prefix=self._output_prefix(), idx=out_idx, attempt=attempt
+        )
+        response = self.clients['s3'].get_object(Bucket=bucket, Key=key)
+        result = _loads(response.get('Body').read())
+
+        if self.gather:
+            # Replace the container's markers for missing results
+            def replace_missing(r):
+                if isinstance(r, dict) and MISSING_KEY in r:
+                    return MissingResult(index=r[MISSING_KEY])
+                return r
+
+            if isinstance(result, list):
+                result = [replace_missing(r) for r in result]
+            else:
+                result = replace_missing(result)
+        elif self.sink is not None:
+            # The container stored a reference to the sink object
+            result = SinkReference(**result)
+
+        return result
+
+    def output_ref(self, indices=None, index=None, skip_missing=False):
+        """Return a reference to this job's output for use as job input
+
+        When the batch job container resolves the references in its input,
+        it replaces this reference with this job's output. Elements that
+        failed are replaced with MissingResult namedtuples, unless
+        `skip_missing` is True, and elements for which the function returned
+        None are replaced with None.
+
+        Parameters
+        ----------
+        indices : sequence of ints
+            Array job indices of the elements to reference. The reference
+            resolves to a list of outputs.
+            Default: None
 
-    def result(self, timeout=None):
+        index : int
+            Array job index of a single element to reference. The reference
+            resolves to the output of that element. Must not be specified
+            with `indices`.
+            Default: None
+
+        skip_missing : bool
+            If True, drop the elements that failed from a list of outputs
+            instead of marking them as missing. Has no effect on the
+            reference to a single element.
+            Default: False
+
+        If neither `indices` nor `index` are provided, the reference
+        resolves to the list of all outputs of an array job or to the
+        output of a non-array job.
+
+        Returns
+        -------
+        ref : dict
+            The output reference
+        """
+        if indices is not None and index is not None:
+            raise CloudknotInputError('You may specify either `indices` or '
+                                      '`index`, not both.')
+
+        ref = {
+            REF_KEY: 'outputs',
+            'bucket': self.job_definition.output_bucket,
+            'jobdef': self.job_definition.name,
+            'job_id': self.job_id,
+        }
+
+        if index is not None:
+            ref['index'] = int(index)
+        elif indices is not None:
+            ref['indices'] = list(indices)
+        elif self.array_job:
+            ref['indices'] = list(range(len(self.input)))
+        else:
+            ref['index'] = 0
+
+        if skip_missing and 'indices' in ref:
+            ref['skip_missing'] = True
+
+        return ref
+
+    def result(self, timeout=None, partial=False, speculate=None):
         """Return the result of the latest attempt
 
         If the call hasn't yet completed then this method will wait up to
         timeout seconds. If the call hasn't completed in timeout seconds,
         then a CKTimeoutError is raised. If the batch job is in FAILED status
-        then a BatchJobFailedError is raised.
+        then a BatchJobFailedError is raised. For array jobs, the error is
+        raised as soon as any child job fails, without waiting for the other
+        child jobs. If the python function raised an exception, the error
+        includes its remote traceback.
+
+        The results of elements resubmitted with `resubmit_failed` are
+        merged into the results of this job.
 
         Parameters
         ----------
@@ -468,6 +1232,31 @@ class BatchJob(NamedObject):
             there is no limit to the wait time.
             Default: None
 
+        partial : bool
+            If True and this is an array job, do not raise an error if some
+            of its elements failed. Instead, return the list of results with
+            a BatchJobFailedError (or CKTimeoutError if the output is missing)
+            in place of each element that failed.
+            Default: False
+
+        speculate : float
+            If provided, and this is an array job, then once this fraction
+            (e.g. 0.95) of its child jobs have finished, submit duplicates of
+            the remaining child jobs. Whichever copy of each element finishes
+            first wins. If the original wins, the duplicate is terminated.
+            If the duplicate wins, the original keeps running, because
+            terminating a child job would fail the whole array job and any
+            jobs that depend on it, but the result is returned as soon as
+            every element succeeded in either copy. The duplicates write
+            their outputs with higher attempt numbers, so they do not
+            overwrite the original outputs and the result uses theirs.
+            Default: None means no speculative execution
+
+        All elements are resolved from one listing of the status manifests
+        that the container writes for each attempt, and their outputs are
+        downloaded in parallel. Elements for which the function returned
+        None have a result of None.
+
         Returns
         -------
         result:
@@ -479,22 +1268,238 @@ class BatchJob(NamedObject):
         def time_diff():
             return (datetime.now() - start_time).seconds
 
-        while not self.done and (timeout is None or time_diff() < timeout):
+        fail_fast = (self.array_job and not partial and not self.workers
+                     and not self.chunksize)
+
+        if speculate is not None and not 0 < speculate < 1:
+            raise CloudknotInputError('speculate must be between 0 and 1.')
+
+        if speculate is not None and (self.workers or self.chunksize):
+            raise CloudknotInputError(
+                '`speculate` may not be combined with `workers` or '
+                '`chunksize`.'
+            )
+
+        speculation = None
+        settled = set()
+        winners = set()
+
+        def finished():
+            if self.done:
+                return True
+
+            # Originals whose duplicates won keep running, so the result is
+            # ready once every element succeeded in either copy
+            return speculation is not None and len(
+                set(self._children('SUCCEEDED')) | winners
+            ) == len(self.input)
+
+        while not finished() and (timeout is None or time_diff() < timeout):
+            if (speculate is not None and self.array_job
+                    and self.retry_of is None and not self.workers
+                    and not self.chunksize):
+                if speculation is None:
+                    summary = self.status['arrayProperties'].get(
+                        'statusSummary', {}
+                    )
+                    n_finished = (summary.get('SUCCEEDED', 0)
+                                  + summary.get('FAILED', 0))
+                    if n_finished >= speculate * len(self.input):
+                        speculation = self._speculate()
+                        # Do not speculate again if nothing was left
+                        speculate = None if speculation is None else speculate
+                else:
+                    self._settle_speculation(speculation, settled, winners)
+
+            if fail_fast:
+                # Elements whose speculative duplicate is still running are
+                # not reported as failed (see `_failed_children`)
+                failed = self._failed_children()
+                if failed:
+                    idx = min(failed)
+                    raise self._failure(idx, failed[idx])
+
             time.sleep(5)
 
-        if not self.done:
+        if not finished():
             raise CKTimeoutError(self.job_id)
 
-        status = self.status
-        if status['status'] == 'FAILED':
-            raise BatchJobFailedError(self.job_id)
-        else:
-            if self.array_job:
-                return [self._collect_array_job_result(idx)
-                        for idx in range(len(self.input))]
+        failed = self._failed_children()
+
+        if failed and not (partial and self.array_job):
+            idx = min(failed)
+            raise self._failure(idx, failed[idx])
+
+        attempts = self._latest_attempts()
+
+        if not self.array_job:
+            return self._collect_array_job_result(attempts=attempts)
+
+        def collect(idx):
+            if idx in failed:
+                return self._failure(idx, failed[idx])
+
+            try:
+                return self._collect_array_job_result(idx, attempts)
+            except (CKTimeoutError, BatchJobFailedError) as e:
+                if not partial:
+                    raise e
+                return e
+
+        with ThreadPoolExecutor(max(min(len(self.input), 32), 1)) as e:
+            return list(e.map(collect, range(len(self.input))))
+
+    @in_resource_session
+    def resubmit_failed(self, indices=None):
+        """Submit a new job to run the failed elements of this array job
+
+        The new job reuses the input that was already uploaded for this job
+        and writes its results to this job's output location, so that the
+        results of this job (see `result`) include those of the resubmitted
+        elements in their original order. The new job is an array job only
+        if there are at least two elements to resubmit.
+
+        Parameters
+        ----------
+        indices : sequence of ints
+            Array indices of the elements to resubmit
+            Default: None means all elements in `failed_indices`
+
+        Returns
+        -------
+        job : BatchJob or None
+            The new batch job, or None if there is nothing to resubmit
+        """
+        if self.clobbered:
+            raise ResourceClobberedException(
+                'This batch job has already been clobbered.',
+                self.job_id
+            )
+
+        if not self.array_job or self.retry_of is not None or self.workers:
+            raise CloudknotInputError(
+                'Only elements of an original array job without workers may '
+                'be resubmitted.'
+            )
+
+        self.check_profile_and_region()
+
+        indices = self.failed_indices if indices is None else list(indices)
+        if not indices:
+            return None
+
+        job = self._rerun(indices, name='{name:s}-retry-{n:d}'.format(
+            name=self.name, n=len(self.resubmissions)
+        ))
+
+        self._resubmissions.append(job)
+
+        mod_logger.info(
+            'Resubmitted {n:d} elements of job {id:s} as job {new:s}'.format(
+                n=len(indices), id=self.job_id, new=job.job_id
+            )
+        )
+
+        return job
+
+    @in_resource_session
+    def _rerun(self, indices, name):
+        """Submit a job that runs elements of this job again
+
+        The new job writes to this job's output location, with attempt
+        numbers above those of any previous attempt.
+        """
+        # AWS Batch reserves environment variables starting with AWS_BATCH
+        env_vars = [e for e in (self.environment_variables or [])
+                    if not e['name'].startswith('AWS_BATCH')]
+
+        return BatchJob(
+            name=name,
+            job_queue=self.job_queue_arn,
+            job_definition=self.job_definition,
+            input_=indices,
+            starmap=self.starmap,
+            environment_variables=env_vars or None,
+            array_job=len(indices) > 1,
+            resolve_refs=self.resolve_refs,
+            sink=self.sink,
+            sink_format=self.sink_format,
+            retry_user_errors=self.retry_user_errors,
+            vcpus=self.vcpus,
+            memory=self.memory,
+            retry_of=self,
+            attempt_offset=self._max_attempt
+        )
+
+    def _speculate(self):
+        """Submit speculative duplicates of this job's unfinished elements"""
+        finished = set(self._children('SUCCEEDED')) | set(
+            self._children('FAILED')
+        )
+        indices = [idx for idx in range(len(self.input))
+                   if idx not in finished]
+
+        if not indices:
+            return None
+
+        job = self._rerun(indices, name='{name:s}-speculative-{n:d}'.format(
+            name=self.name, n=len(self._speculations)
+        ))
+
+        self._speculations.append(job)
+
+        mod_logger.info(
+            'Submitted speculative duplicates of {n:d} elements of job '
+            '{id:s} as job {new:s}'.format(
+                n=len(indices), id=self.job_id, new=job.job_id
+            )
+        )
+
+        return job
+
+    def _settle_speculation(self, speculation, settled, winners):
+        """Settle each speculatively duplicated element that finished
+
+        Duplicates are terminated when the original copy succeeded first.
+        Originals are never terminated, since terminating a child job fails
+        the whole array job, and with it any jobs that depend on it.
+
+        Parameters
+        ----------
+        speculation : BatchJob
+            The speculative job, as returned by `_speculate`
+
+        settled : set
+            Positions in the speculative job's input that were already
+            settled. Updated in place.
+
+        winners : set
+            Indices of the elements whose duplicate succeeded first. Updated
+            in place.
+        """
+        original_done = set(self._children('SUCCEEDED'))
+        duplicate_done = set(speculation._children('SUCCEEDED'))
+
+        for i, idx in enumerate(speculation.input):
+            if i in settled:
+                continue
+
+            if idx in original_done:
+                self.clients['batch'].terminate_job(
+                    jobId=speculation._child_id(i),
+                    reason='Cloudknot speculative execution: the original '
+                           'copy of this element finished first'
+                )
+            elif i in duplicate_done:
+                # The duplicate's output has the higher attempt number, so
+                # the result uses it while the original keeps running
+                winners.add(idx)
             else:
-                return self._collect_array_job_result()
+                continue
+
+            settled.add(i)
 
+    @in_resource_session
     def terminate(self, reason):
         """Kill AWS batch job using instance parameter `self.job_id`
 
@@ -526,20 +1531,22 @@ class BatchJob(NamedObject):
         state = self.status['status']
 
         if state in ['SUBMITTED', 'PENDING', 'RUNNABLE']:
-            clients['batch'].cancel_job(jobId=self.job_id, reason=reason)
+            self.clients['batch'].cancel_job(jobId=self.job_id, reason=reason)
             mod_logger.info(
                 'Cancelled job {name:s} with jobID {job_id:s}'.format(
                     name=self.name, job_id=self.job_id
                 )
             )
         elif state in ['STARTING', 'RUNNING']:
-            clients['batch'].terminate_job(jobId=self.job_id, reason=reason)
+            self.clients['batch'].terminate_job(jobId=self.job_id,
+                                                reason=reason)
             mod_logger.info(
                 'Terminated job {name:s} with jobID {job_id:s}'.format(
                     name=self.name, job_id=self.job_id
                 )
             )
 
+    @in_resource_session
     def clobber(self):
         """Kill an batch job and remove it's info from config"""
         if self.clobbered:
@@ -555,4 +1562,4 @@ class BatchJob(NamedObject):
         self._clobbered = True
 
         # Remove this job from the list of jobs in the config file
-        cloudknot.config.remove_resource(self._section_name, self.job_id)
+        cloudknot.config.remove_job(self._section_name, self.job_id)
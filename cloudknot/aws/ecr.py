@@ -4,7 +4,7 @@ import cloudknot.config
 import logging
 from collections import namedtuple
 
-from .base_classes import NamedObject, clients, get_ecr_repo
+from .base_classes import NamedObject, get_ecr_repo, in_resource_session
 
 __all__ = []
 
@@ -67,7 +67,7 @@ class DockerRepo(NamedObject):
         """
         try:
             # If repo exists, retrieve its info
-            response = clients['ecr'].describe_repositories(
+            response = self.clients['ecr'].describe_repositories(
                 repositoryNames=[self.name]
             )
 
@@ -77,9 +77,9 @@ class DockerRepo(NamedObject):
 
             mod_logger.info('Repository {name:s} already exists at '
                             '{uri:s}'.format(name=self.name, uri=repo_uri))
-        except clients['ecr'].exceptions.RepositoryNotFoundException:
+        except self.clients['ecr'].exceptions.RepositoryNotFoundException:
             # If it doesn't exists already, then create it
-            response = clients['ecr'].create_repository(
+            response = self.clients['ecr'].create_repository(
                 repositoryName=self.name
             )
 
@@ -97,6 +97,7 @@ class DockerRepo(NamedObject):
             name=repo_name, uri=repo_uri, registry_id=repo_registry_id
         )
 
+    @in_resource_session
     def clobber(self):
         """Delete this remote repository"""
         if self.clobbered:
@@ -107,12 +108,12 @@ class DockerRepo(NamedObject):
         if self.name != get_ecr_repo():
             try:
                 # Remove the remote docker image
-                clients['ecr'].delete_repository(
+                self.clients['ecr'].delete_repository(
                     registryId=self.repo_registry_id,
                     repositoryName=self.name,
                     force=True
                 )
-            except clients['ecr'].exceptions.RepositoryNotFoundException:
+            except self.clients['ecr'].exceptions.RepositoryNotFoundException:
                 # It doesn't exist anyway, so carry on
                 pass
 
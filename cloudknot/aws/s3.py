@@ -0,0 +1,298 @@
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import heapq
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .base_classes import clients, CloudknotInputError
+
+__all__ = ["REF_KEY"]
+
+
+def registered(fn):
+    __all__.append(fn.__name__)
+    return fn
+
+
+mod_logger = logging.getLogger(__name__)
+
+#: Dictionary key that marks an input element as a reference to be resolved
+#: inside the batch job container (see the cloudknot script template)
+REF_KEY = '__cloudknot_ref__'
+
+S3Object = namedtuple('S3Object', ['bucket', 'key', 'size'])
+
+
+@registered
+def split_s3_url(url):
+    """Split an S3 URL into bucket and key prefix
+
+    Parameters
+    ----------
+    url : string
+        An S3 URL of the form 's3://bucket/prefix'
+
+    Returns
+    -------
+    bucket, prefix : tuple of strings
+        The bucket name and the (possibly empty) key prefix
+    """
+    if not url.startswith('s3://'):
+        raise CloudknotInputError(
+            '{url:s} is not an S3 URL of the form s3://bucket/prefix'.format(
+                url=url
+            )
+        )
+
+    bucket, _, prefix = url[len('s3://'):].partition('/')
+    if not bucket:
+        raise CloudknotInputError('The S3 URL {url:s} has no bucket'.format(
+            url=url
+        ))
+
+    return bucket, prefix
+
+
+@registered
+def list_s3_objects(bucket, prefix='', client=None):
+    """List all objects under an S3 prefix
+
+    Directory placeholder keys (ending in '/') are skipped.
+
+    Parameters
+    ----------
+    bucket : string
+        Name of the S3 bucket
+
+    prefix : string
+        Key prefix to list
+        Default: ''
+
+    client : boto3 S3 client
+        Client with which to list the objects, e.g. the S3 client of the
+        knot that will process them
+        Default: None means the S3 client of the current session
+
+    Returns
+    -------
+    objects : list of namedtuples
+        A list of S3Object namedtuples with fields ['bucket', 'key', 'size'],
+        sorted by key
+    """
+    if client is None:
+        client = clients['s3']
+
+    paginator = client.get_paginator('list_objects_v2')
+
+    objects = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects += [S3Object(bucket=bucket, key=o['Key'], size=o['Size'])
+                    for o in page.get('Contents', [])
+                    if not o['Key'].endswith('/')]
+
+    mod_logger.debug('Listed {n:d} objects in s3://{b:s}/{p:s}'.format(
+        n=len(objects), b=bucket, p=prefix
+    ))
+
+    return sorted(objects, key=lambda o: o.key)
+
+
+@registered
+def shard_by_size(objects, n_shards):
+    """Split S3 objects into shards with approximately equal total size
+
+    Uses the greedy longest-processing-time heuristic: objects are assigned
+    in order of decreasing size to the shard with the smallest total size.
+
+    Parameters
+    ----------
+    objects : sequence of S3Object namedtuples
+        Objects to shard, as returned by list_s3_objects
+
+    n_shards : int
+        Maximum number of shards
+
+    Returns
+    -------
+    shards : list of lists of S3Object namedtuples
+        Non-empty shards, with objects within each shard sorted by key
+    """
+    n_shards = int(n_shards)
+    if n_shards < 1:
+        raise CloudknotInputError('n_shards must be positive')
+
+    # heap entries are (total size, shard index)
+    heap = [(0, i) for i in range(min(n_shards, len(objects)))]
+    shards = [[] for _ in heap]
+
+    for obj in sorted(objects, key=lambda o: o.size, reverse=True):
+        total, i = heapq.heappop(heap)
+        shards[i].append(obj)
+        heapq.heappush(heap, (total + obj.size, i))
+
+    return [sorted(s, key=lambda o: o.key) for s in shards]
+
+
+@registered
+def s3_ref(bucket, key, stream=False, path=None):
+    """Return a reference to an S3 object for use as batch job input
+
+    When the batch job container unpickles its input, it replaces each
+    reference with either a local path to a downloaded copy of the object
+    or a streaming handle to the object.
+
+    Parameters
+    ----------
+    bucket : string
+        Name of the S3 bucket
+
+    key : string
+        Key of the S3 object
+
+    stream : bool
+        If True, the container receives a streaming handle to the object
+        instead of a local file path
+        Default: False
+
+    path : string
+        Local path in the container to which to download the object.
+        Relative paths are relative to the container's scratch space.
+        Default: None means a path in the container's scratch space
+
+    Returns
+    -------
+    ref : dict
+        The S3 object reference
+    """
+    ref = {REF_KEY: 's3', 'bucket': bucket, 'key': key, 'stream': stream}
+    if path is not None:
+        ref['path'] = path
+
+    return ref
+
+
+def _file_sha256(path, blocksize=1024 ** 2):
+    """Return the hex SHA-256 digest of a file's contents"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def _map_paths(obj, fn):
+    """Recursively apply `fn` to each path-like object in `obj`"""
+    if hasattr(obj, '__fspath__'):
+        return fn(obj)
+    elif isinstance(obj, dict):
+        return dict((k, _map_paths(v, fn)) for k, v in obj.items())
+    elif isinstance(obj, list):
+        return [_map_paths(o, fn) for o in obj]
+    elif isinstance(obj, tuple):
+        return tuple(_map_paths(o, fn) for o in obj)
+    else:
+        return obj
+
+
+@registered
+def stage_files(iterdata, bucket, sse=None, max_threads=64, client=None):
+    """Upload local files in the input to S3 and replace them with references
+
+    Every path-like object (e.g. a pathlib.Path) found in the elements of
+    `iterdata`, including inside of lists, tuples and dicts, is uploaded to
+    the content-addressed staging prefix 'cloudknot.staging/<sha256>/' in
+    `bucket`. Files that were already staged, by this or any previous call,
+    are not uploaded again. Each path is then replaced with an S3 reference
+    that the batch job container resolves to the local path of a downloaded
+    copy of the file.
+
+    Parameters
+    ----------
+    iterdata :
+        An iterable of input data
+
+    bucket : string
+        Name of the S3 bucket in which to stage the files
+
+    sse : string
+        S3 server side encryption method, one of ['AES256', 'aws:kms']
+        Default: None
+
+    max_threads : int
+        Maximum number of threads used to hash and upload files
+        Default: 64
+
+    client : boto3 S3 client
+        Client with which to upload the files, e.g. the S3 client of the
+        knot that will read them
+        Default: None means the S3 client of the current session
+
+    Returns
+    -------
+    staged : list
+        The elements of `iterdata` with file paths replaced by S3 references
+    """
+    iterdata = list(iterdata)
+
+    paths = set()
+
+    def collect(p):
+        paths.add(os.path.abspath(p.__fspath__()))
+        return p
+
+    _map_paths(iterdata, collect)
+
+    if not paths:
+        return iterdata
+
+    if client is None:
+        client = clients['s3']
+
+    def upload(path):
+        if not os.path.isfile(path):
+            raise CloudknotInputError(
+                'Cannot stage {path:s} because it is not a regular '
+                'file.'.format(path=path)
+            )
+
+        digest = _file_sha256(path)
+        key = '/'.join([
+            'cloudknot.staging', digest, os.path.basename(path)
+        ])
+
+        try:
+            client.head_object(Bucket=bucket, Key=key)
+            mod_logger.debug('{path:s} already staged at {key:s}'.format(
+                path=path, key=key
+            ))
+        except client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ['404', 'NoSuchKey']:
+                raise e
+
+            extra_args = {'ServerSideEncryption': sse} if sse else None
+            client.upload_file(path, bucket, key, ExtraArgs=extra_args)
+            mod_logger.debug('Staged {path:s} at {key:s}'.format(
+                path=path, key=key
+            ))
+
+        return path, key
+
+    with ThreadPoolExecutor(max(min(len(paths), max_threads), 1)) as e:
+        keys = dict(e.map(upload, sorted(paths)))
+
+    mod_logger.info(
+        'Staged {n:d} files in s3://{b:s}/cloudknot.staging'.format(
+            n=len(keys), b=bucket
+        )
+    )
+
+    def to_ref(p):
+        key = keys[os.path.abspath(p.__fspath__())]
+        return s3_ref(bucket=bucket, key=key,
+                      path=os.path.join('cloudknot-staged', key))
+
+    return _map_paths(iterdata, to_ref)
@@ -0,0 +1,227 @@
+"""Checkpoint and resume long-running functions in cloudknot batch jobs
+
+Use this module inside of a function that you submit with a Knot in order
+to resume from the latest saved state after the batch job is interrupted,
+e.g. when a spot instance is reclaimed::
+
+    def simulate(n_steps):
+        import cloudknot.checkpoint as checkpoint
+
+        state = checkpoint.load(default={'step': 0, 'total': 0})
+        for step in range(state['step'], n_steps):
+            state['total'] += expensive_step(step)
+            state['step'] = step + 1
+            checkpoint.save(state)
+
+        return state['total']
+
+In a batch job, the saved state is persisted to the S3 object
+'cloudknot.jobs/<job definition>/<job ID>/<index>/checkpoint' in the
+cloudknot jobs bucket. Saved states are flushed to S3 periodically (every
+FLUSH_INTERVAL seconds), when `flush` is called, and when the container
+receives SIGTERM, which AWS Batch sends before killing a container. The next
+attempt of the same element, and any resubmission of it, loads the latest
+flushed state. The checkpoint is deleted after the function succeeds.
+
+Outside of a batch job, e.g. when testing the function locally, the state
+is only kept in memory.
+
+The cloudknot script template injects this module into the batch job
+container, so that the function can import it even though cloudknot itself
+is not installed there. It must therefore depend only on the standard
+library and on boto3.
+"""
+from __future__ import absolute_import, division, print_function
+
+import logging
+import pickle
+import signal
+import sys
+import threading
+import time
+
+__all__ = ['save', 'load', 'flush', 'clear']
+
+mod_logger = logging.getLogger(__name__)
+
+#: Default number of seconds between periodic flushes to S3
+FLUSH_INTERVAL = 60
+
+_lock = threading.RLock()
+_store = {
+    'bucket': None,
+    'key': None,
+    'sse': None,
+    'client': None,
+    'pickled': None,
+    'dirty': False,
+    'stored': False,
+    'started': False,
+}
+
+
+def configure(bucket, key, sse=None, interval=None):
+    """Persist checkpoints to an S3 object
+
+    This is called by the batch job container before calling the function
+    for each input element. On the first call, it starts a daemon thread
+    that periodically flushes the saved state and installs a SIGTERM handler
+    that flushes it before exiting. Any state saved for a previous element
+    is discarded.
+
+    Parameters
+    ----------
+    bucket : string
+        Name of the S3 bucket
+
+    key : string
+        Key of the checkpoint object
+
+    sse : string
+        S3 server side encryption method, one of ['AES256', 'aws:kms']
+        Default: None
+
+    interval : int or float
+        Number of seconds between periodic flushes. Non-positive values
+        disable periodic flushing.
+        Default: None means FLUSH_INTERVAL
+    """
+    import boto3
+
+    with _lock:
+        if _store['client'] is None:
+            _store['client'] = boto3.client('s3')
+
+        _store.update(bucket=bucket, key=key, sse=sse, pickled=None,
+                      dirty=False, stored=False)
+
+        if _store['started']:
+            return
+
+        _store['started'] = True
+
+    interval = FLUSH_INTERVAL if interval is None else interval
+
+    if interval > 0:
+        def flush_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    flush()
+                except Exception as e:
+                    mod_logger.warning(
+                        'Periodic checkpoint flush failed: {e!s}'.format(e=e)
+                    )
+
+        thread = threading.Thread(target=flush_periodically)
+        thread.daemon = True
+        thread.start()
+
+    try:
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+    except ValueError:
+        # Signal handlers can only be installed from the main thread
+        mod_logger.warning('Could not install the checkpoint SIGTERM handler')
+
+
+def _handle_sigterm(signum, frame):
+    """Flush the saved state and exit"""
+    flush()
+    sys.exit(128 + signum)
+
+
+def save(state, flush_now=False):
+    """Save the current state of the function
+
+    The state is pickled immediately, so later changes to `state` are not
+    saved until the next call.
+
+    Parameters
+    ----------
+    state :
+        A picklable object from which the function can resume
+
+    flush_now : bool
+        If True, write the state to S3 before returning
+        Default: False
+    """
+    pickled = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    with _lock:
+        _store.update(pickled=pickled, dirty=True)
+
+    if flush_now:
+        flush()
+
+
+def load(default=None):
+    """Return the latest saved state or `default` if there is none
+
+    Parameters
+    ----------
+    default :
+        The value to return if no state was saved, e.g. on the first attempt
+        Default: None
+    """
+    with _lock:
+        if _store['pickled'] is not None or _store['key'] is None:
+            pickled = _store['pickled']
+        else:
+            s3 = _store['client']
+            try:
+                response = s3.get_object(Bucket=_store['bucket'],
+                                         Key=_store['key'])
+                pickled = response.get('Body').read()
+                _store.update(pickled=pickled, stored=True)
+                mod_logger.info('Resuming from checkpoint {key:s}'.format(
+                    key=_store['key']
+                ))
+            except s3.exceptions.NoSuchKey:
+                pickled = None
+
+    return default if pickled is None else pickle.loads(pickled)
+
+
+def flush():
+    """Write the latest saved state to S3, if it changed since the last flush
+
+    Returns
+    -------
+    flushed : bool
+        True if the state was written to S3
+    """
+    with _lock:
+        if not _store['dirty'] or _store['key'] is None:
+            return False
+
+        # Hold the lock while uploading, so that concurrent flushes cannot
+        # overwrite a newer state with an older one
+        put_kwargs = {}
+        if _store['sse'] is not None:
+            put_kwargs['ServerSideEncryption'] = _store['sse']
+
+        _store['client'].put_object(Bucket=_store['bucket'],
+                                    Key=_store['key'],
+                                    Body=_store['pickled'], **put_kwargs)
+        _store.update(dirty=False, stored=True)
+
+    return True
+
+
+def clear():
+    """Discard the saved state and delete the checkpoint from S3, if any"""
+    with _lock:
+        if _store['key'] is not None and _store['stored']:
+            try:
+                _store['client'].delete_object(Bucket=_store['bucket'],
+                                               Key=_store['key'])
+            except Exception as e:
+                # Roles created before checkpoints existed may not be
+                # allowed to delete objects
+                mod_logger.warning(
+                    'Could not delete checkpoint {key:s}: {e!s}'.format(
+                        key=_store['key'], e=e
+                    )
+                )
+
+        _store.update(pickled=None, dirty=False, stored=False)
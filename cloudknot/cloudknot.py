@@ -1,17 +1,19 @@
 from __future__ import absolute_import, division, print_function
 
-import botocore
 import configparser
 import ipaddress
 import logging
+import math
 import os
 import six
-from collections import Iterable, namedtuple
+from collections import Iterable, namedtuple, OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
 from . import aws
-from .config import get_config_file, rlock
+from . import config as cloudknot_config
+from .config import get_config_file, rlock, write_config
 from . import dockerimage
+from .aws.base_classes import in_resource_session
 
 __all__ = []
 
@@ -23,12 +25,67 @@ def registered(fn):
 
 mod_logger = logging.getLogger(__name__)
 
+#: namedtuple returned by Knot.recommend_resources
+ResourceRecommendation = namedtuple(
+    'ResourceRecommendation',
+    ['vcpus', 'memory', 'peak_memory', 'cpu_utilization', 'n_samples']
+)
+__all__.append('ResourceRecommendation')
+
 
 def _stack_out(key, outputs):
     o = list(filter(lambda d: d['OutputKey'] == key, outputs))[0]
     return o['OutputValue']
 
 
+def _check_env_vars(env_vars):
+    """Validate environment variables for batch jobs"""
+    # env_vars should be a sequence of sequences of dicts
+    if env_vars and not all(isinstance(s, dict) for s in env_vars):
+        raise aws.CloudknotInputError('env_vars must be a sequence of '
+                                      'dicts')
+
+    # and each dict should have only 'name' and 'value' keys
+    if env_vars and not all(set(d.keys()) == {'name', 'value'}
+                            for d in env_vars):
+        raise aws.CloudknotInputError('each dict in env_vars must have '
+                                      'keys "name" and "value"')
+
+
+def _check_array_input(iterdata):
+    """Return the input data of an array job as a list
+
+    AWS Batch array jobs need at least two child jobs, so the input data
+    must have at least two elements.
+    """
+    if not isinstance(iterdata, Iterable):
+        raise TypeError('iterdata must be an iterable.')
+
+    iterdata = list(iterdata)
+    if len(iterdata) < 2:
+        raise aws.CloudknotInputError(
+            'iterdata must have at least two elements, since it is mapped '
+            'over in an array job.'
+        )
+
+    return iterdata
+
+
+def _resource_classes(iterdata, resources):
+    """Group the indices of the items by resource class
+
+    Returns an OrderedDict that maps each (vcpus, memory) pair returned by
+    `resources` to the indices of its items, in order of first appearance.
+    """
+    classes = OrderedDict()
+    for idx, item in enumerate(iterdata):
+        resource_class = resources(item)
+        key = (resource_class.get('vcpus'), resource_class.get('memory'))
+        classes.setdefault(key, []).append(idx)
+
+    return classes
+
+
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 @registered
 class Pars(aws.NamedObject):
@@ -121,10 +178,10 @@ class Pars(aws.NamedObject):
             self._stack_id = config.get(self._pars_name, 'stack-id')
 
             try:
-                response = aws.clients['cloudformation'].describe_stacks(
+                response = self.clients['cloudformation'].describe_stacks(
                     StackName=self._stack_id
                 )
-            except aws.clients['cloudformation'].exceptions.ClientError as e:
+            except self.clients['cloudformation'].exceptions.ClientError as e:
                 error_code = e.response.get('Error').get('Message')
                 no_stack_code = ('Stack with id {0:s} does not exist'
                                  ''.format(self._stack_id))
@@ -133,8 +190,7 @@ class Pars(aws.NamedObject):
                     with rlock:
                         config.read(get_config_file())
                         config.remove_section(self._pars_name)
-                        with open(get_config_file(), 'w') as f:
-                            config.write(f)
+                        write_config(config)
                     raise aws.ResourceDoesNotExistException(
                         'The PARS stack that you requested does not exist. '
                         'Cloudknot has deleted this PARS from the config '
@@ -160,8 +216,7 @@ class Pars(aws.NamedObject):
                 with rlock:
                     config.read(get_config_file())
                     config.remove_section(self._pars_name)
-                    with open(get_config_file(), 'w') as f:
-                        config.write(f)
+                    write_config(config)
 
                 raise aws.ResourceDoesNotExistException(
                     'The PARS stack that you requested does not exist. '
@@ -243,29 +298,30 @@ class Pars(aws.NamedObject):
                                                   'or a sequence of strings')
 
             # Validate policies against the available policies
+            import botocore.exceptions
             policy_arns = []
             policy_names = []
             for policy in input_policies:
                 try:
-                    aws.clients['iam'].get_policy(PolicyArn=policy)
+                    self.clients['iam'].get_policy(PolicyArn=policy)
                     policy_arns.append(policy)
                 except (
-                    aws.clients['iam'].exceptions.InvalidInputException,
-                    aws.clients['iam'].exceptions.NoSuchEntityException,
+                    self.clients['iam'].exceptions.InvalidInputException,
+                    self.clients['iam'].exceptions.NoSuchEntityException,
                     botocore.exceptions.ParamValidationError,
                 ):
                     policy_names.append(policy)
 
             if policy_names:
                 # Get all AWS policies
-                response = aws.clients['iam'].list_policies()
+                response = self.clients['iam'].list_policies()
                 aws_policies = {d['PolicyName']: d['Arn']
                                 for d in response.get('Policies')}
 
                 # If results are paginated, continue appending to aws_policies,
                 # using `Marker` to tell next call where to start
                 while response['IsTruncated']:
-                    response = aws.clients['iam'].list_policies(
+                    response = self.clients['iam'].list_policies(
                         Marker=response['Marker']
                     )
                     aws_policies.update(
@@ -299,12 +355,12 @@ class Pars(aws.NamedObject):
 
                 # Retrieve the default VPC ID
                 try:
-                    response = aws.clients['ec2'].create_default_vpc()
+                    response = self.clients['ec2'].create_default_vpc()
                     vpc_id = response.get('Vpc').get('VpcId')
-                except aws.clients['ec2'].exceptions.ClientError as e:
+                except self.clients['ec2'].exceptions.ClientError as e:
                     error_code = e.response.get('Error').get('Code')
                     if error_code == 'DefaultVpcAlreadyExists':
-                        response = aws.clients['ec2'].describe_vpcs(Filters=[{
+                        response = self.clients['ec2'].describe_vpcs(Filters=[{
                             'Name': 'isDefault',
                             'Values': ['true']
                         }])
@@ -325,7 +381,7 @@ class Pars(aws.NamedObject):
                         raise e
 
                 # Retrieve the subnets for the default VPC
-                response = aws.clients['ec2'].describe_subnets(Filters=[{
+                response = self.clients['ec2'].describe_subnets(Filters=[{
                     'Name': 'vpc-id',
                     'Values': [vpc_id]
                 }])
@@ -341,7 +397,7 @@ class Pars(aws.NamedObject):
                 with open(template_path, 'r') as fp:
                     template_body = fp.read()
 
-                response = aws.clients['cloudformation'].create_stack(
+                response = self.clients['cloudformation'].create_stack(
                     StackName=self.name + '-pars',
                     TemplateBody=template_body,
                     Parameters=[
@@ -389,13 +445,13 @@ class Pars(aws.NamedObject):
 
                 self._stack_id = response['StackId']
 
-                waiter = aws.clients['cloudformation'].get_waiter(
+                waiter = self.clients['cloudformation'].get_waiter(
                     'stack_create_complete'
                 )
                 waiter.wait(StackName=self._stack_id,
                             WaiterConfig={'Delay': 10})
 
-                response = aws.clients['cloudformation'].describe_stacks(
+                response = self.clients['cloudformation'].describe_stacks(
                     StackName=self._stack_id
                 )
 
@@ -462,7 +518,7 @@ class Pars(aws.NamedObject):
                 with open(template_path, 'r') as fp:
                     template_body = fp.read()
 
-                response = aws.clients['cloudformation'].create_stack(
+                response = self.clients['cloudformation'].create_stack(
                     StackName=self.name + '-pars',
                     TemplateBody=template_body,
                     Parameters=[
@@ -518,13 +574,13 @@ class Pars(aws.NamedObject):
 
                 self._stack_id = response['StackId']
 
-                waiter = aws.clients['cloudformation'].get_waiter(
+                waiter = self.clients['cloudformation'].get_waiter(
                     'stack_create_complete'
                 )
                 waiter.wait(StackName=self._stack_id,
                             WaiterConfig={'Delay': 10})
 
-                response = aws.clients['cloudformation'].describe_stacks(
+                response = self.clients['cloudformation'].describe_stacks(
                     StackName=self._stack_id
                 )
 
@@ -561,8 +617,7 @@ class Pars(aws.NamedObject):
                            'security-group', self._security_group)
 
                 # Save config to file
-                with open(get_config_file(), 'w') as f:
-                    config.write(f)
+                write_config(config)
 
     @property
     def pars_name(self):
@@ -609,6 +664,7 @@ class Pars(aws.NamedObject):
         """The security group ID attached to this PARS"""
         return self._security_group
 
+    @in_resource_session
     def clobber(self):
         """Delete associated AWS resources and remove section from config"""
         if self.clobbered:
@@ -616,7 +672,7 @@ class Pars(aws.NamedObject):
 
         self.check_profile_and_region()
 
-        aws.clients['cloudformation'].delete_stack(StackName=self._stack_id)
+        self.clients['cloudformation'].delete_stack(StackName=self._stack_id)
 
         # Remove this section from the config file
         config = configparser.ConfigParser()
@@ -624,8 +680,7 @@ class Pars(aws.NamedObject):
         with rlock:
             config.read(get_config_file())
             config.remove_section(self._pars_name)
-            with open(get_config_file(), 'w') as f:
-                config.write(f)
+            write_config(config)
 
         # Set the clobbered parameter to True,
         # preventing subsequent method calls
@@ -657,7 +712,7 @@ class Knot(aws.NamedObject):
                  instance_types=None, resource_type=None, min_vcpus=None,
                  max_vcpus=None, desired_vcpus=None, image_id=None,
                  ec2_key_pair=None, bid_percentage=None,
-                 job_queue_name=None, priority=None):
+                 job_queue_name=None, priority=None, retry_user_errors=None):
         """Initialize a Knot instance
 
         Parameters
@@ -786,6 +841,13 @@ class Knot(aws.NamedObject):
         priority : int, optional
             Default priority for jobs in this knot's job queue
             Default: 1
+
+        retry_user_errors : bool, optional
+            If False, AWS Batch does not retry job attempts that failed
+            because the python function raised an exception. Attempts that
+            failed for other reasons, e.g. spot instance interruptions, are
+            still retried. May be overridden in `map`.
+            Default: True
         """
         # Validate name input
         if name is not None and not isinstance(name, six.string_types):
@@ -797,7 +859,6 @@ class Knot(aws.NamedObject):
         if name is None:
             name = aws.get_user() + '-default'
 
-        super(Knot, self).__init__(name=name)
         self._knot_name = 'knot ' + name
 
         image_tags = image_tags if image_tags else [name]
@@ -815,7 +876,8 @@ class Knot(aws.NamedObject):
                 job_definition_name, job_def_vcpus, memory, retries,
                 compute_environment_name, instance_types, resource_type,
                 min_vcpus, max_vcpus, desired_vcpus, image_id, ec2_key_pair,
-                bid_percentage, job_queue_name, priority
+                bid_percentage, job_queue_name, priority,
+                retry_user_errors is not None
             ]):
                 mod_logger.warning(
                     "You specified configuration arguments for a knot that "
@@ -830,138 +892,17 @@ class Knot(aws.NamedObject):
 
             mod_logger.info('Found knot {name:s} in config'.format(name=name))
 
-            self._region = config.get(self._knot_name, 'region')
-            self._profile = config.get(self._knot_name, 'profile')
-            self.check_profile_and_region()
-
-            pars_name = config.get(self._knot_name, 'pars')
-            self._pars = Pars(name=pars_name)
-            mod_logger.info('Knot {name:s} adopted PARS '
-                            '{p:s}'.format(name=self.name, p=self.pars.name))
-
-            image_name = config.get(self._knot_name, 'docker-image')
-            self._docker_image = dockerimage.DockerImage(name=image_name)
-            mod_logger.info('Knot {name:s} adopted docker image {dr:s}'
-                            ''.format(name=self.name, dr=image_name))
-
-            if not self.docker_image.images:
-                self.docker_image.build(tags=image_tags)
-                mod_logger.info(
-                    'knot {name:s} built docker image {i!s}'
-                    ''.format(name=self.name, i=self.docker_image.images)
-                )
-
-            if self.docker_image.repo_uri is None:
-                repo_name = config.get(self._knot_name, 'docker-repo')
-                self._docker_repo = aws.DockerRepo(name=repo_name)
-                mod_logger.info('Knot {name:s} adopted docker repository '
-                                '{dr:s}'.format(name=self.name, dr=repo_name))
-
-                self.docker_image.push(repo=self.docker_repo)
-                mod_logger.info(
-                    'Knot {name:s} pushed docker image {dr:s}'
-                    ''.format(name=self.name, dr=self.docker_image.name)
-                )
-            else:
-                self._docker_repo = None
-
-            self._stack_id = config.get(self._knot_name, 'stack-id')
-
-            try:
-                response = aws.clients['cloudformation'].describe_stacks(
-                    StackName=self._stack_id
-                )
-            except aws.clients['cloudformation'].exceptions.ClientError as e:
-                error_code = e.response.get('Error').get('Message')
-                no_stack_code = ('Stack with id {0:s} does not exist'
-                                 ''.format(self._stack_id))
-                if error_code == no_stack_code:
-                    # Remove this section from the config file
-                    with rlock:
-                        config.read(get_config_file())
-                        config.remove_section(self._knot_name)
-                        with open(get_config_file(), 'w') as f:
-                            config.write(f)
-                    raise aws.ResourceDoesNotExistException(
-                        'The Knot cloudformation stack that you requested '
-                        'does not exist. Cloudknot has deleted this Knot from '
-                        'the config file, so you may be able to create a new '
-                        'one simply by re-running your previous command.',
-                        self._stack_id
-                    )
-                else:
-                    raise e
-
-            no_stack = (
-                len(response.get('Stacks')) == 0 or
-                response.get('Stacks')[0]['StackStatus'] in [
-                    'CREATE_FAILED', 'ROLLBACK_COMPLETE',
-                    'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED',
-                    'DELETE_IN_PROGRESS', 'DELETE_FAILED', 'DELETE_COMPLETE',
-                    'UPDATE_ROLLBACK_FAILED',
-                ]
-            )
-
-            if no_stack:
-                # Remove this section from the config file
-                with rlock:
-                    config.read(get_config_file())
-                    config.remove_section(self._knot_name)
-                    with open(get_config_file(), 'w') as f:
-                        config.write(f)
-
-                raise aws.ResourceDoesNotExistException(
-                    'The Knot cloudformation stack that you requested does '
-                    'not exist. Cloudknot has deleted this Knot from the '
-                    'config file, so you may be able to create a new one '
-                    'simply by re-running your previous command.',
-                    self._stack_id
-                )
-
-            outs = response.get('Stacks')[0]['Outputs']
-
-            job_def_arn = _stack_out('JobDefinition', outs)
-            response = aws.clients['batch'].describe_job_definitions(
-                jobDefinitions=[job_def_arn]
-            )
-            job_def = response.get('jobDefinitions')[0]
-            job_def_name = job_def['jobDefinitionName']
-            job_def_env = job_def['containerProperties']['environment']
-            bucket_env = [env for env in job_def_env
-                          if env['name'] == 'CLOUDKNOT_JOBS_S3_BUCKET']
-            output_bucket = bucket_env[0]['value'] if bucket_env else None
-            job_def_retries = job_def['retryStrategy']['attempts']
-
-            JobDef = namedtuple('JobDef',
-                                ['name', 'arn', 'output_bucket', 'retries'])
-            self._job_definition = JobDef(
-                name=job_def_name,
-                arn=job_def_arn,
-                output_bucket=output_bucket,
-                retries=job_def_retries
-            )
-
-            self._compute_environment = _stack_out('ComputeEnvironment', outs)
-            self._job_queue = _stack_out('JobQueue', outs)
-
-            conf_jd = config.get(self._knot_name, 'job-definition')
-            conf_ce = config.get(self._knot_name, 'compute-environment')
-            conf_jq = config.get(self._knot_name, 'job-queue')
-
-            if not all([
-                self._job_definition.arn == conf_jd,
-                self._compute_environment == conf_ce,
-                self._job_queue == conf_jq
-            ]):
-                raise aws.CloudknotConfigurationError(
-                    'The resources in the CloudFormation stack do not match '
-                    'the resources in the cloudknot configuration file. '
-                    'Please try a different name.'
-                )
-
-            self._job_ids = config.get(self._knot_name, 'job_ids').split()
-            self._jobs = [aws.BatchJob(job_id=jid) for jid in self.job_ids]
+            # Load the knot and its resources in the profile and region in
+            # which it was created
+            with aws.session_context(
+                    profile=config.get(self._knot_name, 'profile'),
+                    region=config.get(self._knot_name, 'region')
+            ):
+                super(Knot, self).__init__(name=name)
+                self._load_from_config(config, image_tags)
         else:
+            super(Knot, self).__init__(name=name)
+
             if pars and not isinstance(pars, Pars):
                 raise aws.CloudknotInputError('if provided, pars must be a '
                                               'Pars instance.')
@@ -1282,7 +1223,7 @@ class Knot(aws.NamedObject):
             repo_uri = self.docker_image.repo_uri
             output_bucket = aws.get_s3_params().bucket
 
-            response = aws.clients['cloudformation'].describe_stacks(
+            response = self.clients['cloudformation'].describe_stacks(
                 StackName=self.pars.stack_id,
             )
             pars_stack_name = response.get('Stacks')[0]['StackName']
@@ -1381,7 +1322,7 @@ class Knot(aws.NamedObject):
             with open(template_path, 'r') as fp:
                 template_body = fp.read()
 
-            response = aws.clients['cloudformation'].create_stack(
+            response = self.clients['cloudformation'].create_stack(
                 StackName=self.name + '-knot',
                 TemplateBody=template_body,
                 Parameters=params,
@@ -1403,20 +1344,20 @@ class Knot(aws.NamedObject):
             )
 
             self._stack_id = response['StackId']
-            waiter = aws.clients['cloudformation'].get_waiter(
+            waiter = self.clients['cloudformation'].get_waiter(
                 'stack_create_complete'
             )
             waiter.wait(StackName=self._stack_id,
                         WaiterConfig={'Delay': 10})
 
-            response = aws.clients['cloudformation'].describe_stacks(
+            response = self.clients['cloudformation'].describe_stacks(
                 StackName=self._stack_id
             )
 
             outs = response.get('Stacks')[0]['Outputs']
 
             job_def_arn = _stack_out('JobDefinition', outs)
-            response = aws.clients['batch'].describe_job_definitions(
+            response = self.clients['batch'].describe_job_definitions(
                 jobDefinitions=[job_def_arn]
             )
             job_def = response.get('jobDefinitions')[0]
@@ -1438,12 +1379,14 @@ class Knot(aws.NamedObject):
                 )
 
             JobDef = namedtuple('JobDef',
-                                ['name', 'arn', 'output_bucket', 'retries'])
+                                ['name', 'arn', 'output_bucket', 'retries',
+                                 'vcpus'])
             self._job_definition = JobDef(
                 name=job_def_name,
                 arn=job_def_arn,
                 output_bucket=output_bucket,
-                retries=retries
+                retries=retries,
+                vcpus=job_def['containerProperties'].get('vcpus')
             )
 
             self._compute_environment = _stack_out('ComputeEnvironment', outs)
@@ -1451,6 +1394,8 @@ class Knot(aws.NamedObject):
 
             self._jobs = []
             self._job_ids = []
+            self._retry_user_errors = (True if retry_user_errors is None
+                                       else bool(retry_user_errors))
 
             # Save the new Knot resources in config object
             # Use config.set() for python 2.7 compatibility
@@ -1474,11 +1419,162 @@ class Knot(aws.NamedObject):
                 config.set(self._knot_name, 'compute-environment',
                            self.compute_environment)
                 config.set(self._knot_name, 'job-queue', self.job_queue)
-                config.set(self._knot_name, 'job_ids', '')
+                config.set(self._knot_name, 'retry-user-errors',
+                           str(self.retry_user_errors))
 
                 # Save config to file
-                with open(get_config_file(), 'w') as f:
-                    config.write(f)
+                write_config(config)
+
+    def _load_from_config(self, config, image_tags):
+        """Load the resources of this knot from the config file
+
+        Parameters
+        ----------
+        config : configparser.ConfigParser
+            The parsed cloudknot config file, which has a section for this
+            knot
+
+        image_tags : list of strings
+            Tags for the docker image, if it has to be built again
+        """
+        self.check_profile_and_region()
+
+        pars_name = config.get(self._knot_name, 'pars')
+        self._pars = Pars(name=pars_name)
+        mod_logger.info('Knot {name:s} adopted PARS '
+                        '{p:s}'.format(name=self.name, p=self.pars.name))
+
+        image_name = config.get(self._knot_name, 'docker-image')
+        self._docker_image = dockerimage.DockerImage(name=image_name)
+        mod_logger.info('Knot {name:s} adopted docker image {dr:s}'
+                        ''.format(name=self.name, dr=image_name))
+
+        if not self.docker_image.images:
+            self.docker_image.build(tags=image_tags)
+            mod_logger.info(
+                'knot {name:s} built docker image {i!s}'
+                ''.format(name=self.name, i=self.docker_image.images)
+            )
+
+        if self.docker_image.repo_uri is None:
+            repo_name = config.get(self._knot_name, 'docker-repo')
+            self._docker_repo = aws.DockerRepo(name=repo_name)
+            mod_logger.info('Knot {name:s} adopted docker repository '
+                            '{dr:s}'.format(name=self.name, dr=repo_name))
+
+            self.docker_image.push(repo=self.docker_repo)
+            mod_logger.info(
+                'Knot {name:s} pushed docker image {dr:s}'
+                ''.format(name=self.name, dr=self.docker_image.name)
+            )
+        else:
+            self._docker_repo = None
+
+        self._stack_id = config.get(self._knot_name, 'stack-id')
+
+        try:
+            response = self.clients['cloudformation'].describe_stacks(
+                StackName=self._stack_id
+            )
+        except self.clients['cloudformation'].exceptions.ClientError as e:
+            error_code = e.response.get('Error').get('Message')
+            no_stack_code = ('Stack with id {0:s} does not exist'
+                             ''.format(self._stack_id))
+            if error_code == no_stack_code:
+                # Remove this section from the config file
+                with rlock:
+                    config.read(get_config_file())
+                    config.remove_section(self._knot_name)
+                    write_config(config)
+                    cloudknot_config.remove_knot_job_ids(self._knot_name)
+                raise aws.ResourceDoesNotExistException(
+                    'The Knot cloudformation stack that you requested '
+                    'does not exist. Cloudknot has deleted this Knot from '
+                    'the config file, so you may be able to create a new '
+                    'one simply by re-running your previous command.',
+                    self._stack_id
+                )
+            else:
+                raise e
+
+        no_stack = (
+            len(response.get('Stacks')) == 0 or
+            response.get('Stacks')[0]['StackStatus'] in [
+                'CREATE_FAILED', 'ROLLBACK_COMPLETE',
+                'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED',
+                'DELETE_IN_PROGRESS', 'DELETE_FAILED', 'DELETE_COMPLETE',
+                'UPDATE_ROLLBACK_FAILED',
+            ]
+        )
+
+        if no_stack:
+            # Remove this section from the config file
+            with rlock:
+                config.read(get_config_file())
+                config.remove_section(self._knot_name)
+                write_config(config)
+                cloudknot_config.remove_knot_job_ids(self._knot_name)
+
+            raise aws.ResourceDoesNotExistException(
+                'The Knot cloudformation stack that you requested does '
+                'not exist. Cloudknot has deleted this Knot from the '
+                'config file, so you may be able to create a new one '
+                'simply by re-running your previous command.',
+                self._stack_id
+            )
+
+        outs = response.get('Stacks')[0]['Outputs']
+
+        job_def_arn = _stack_out('JobDefinition', outs)
+        response = self.clients['batch'].describe_job_definitions(
+            jobDefinitions=[job_def_arn]
+        )
+        job_def = response.get('jobDefinitions')[0]
+        job_def_name = job_def['jobDefinitionName']
+        job_def_env = job_def['containerProperties']['environment']
+        bucket_env = [env for env in job_def_env
+                      if env['name'] == 'CLOUDKNOT_JOBS_S3_BUCKET']
+        output_bucket = bucket_env[0]['value'] if bucket_env else None
+        job_def_retries = job_def['retryStrategy']['attempts']
+
+        JobDef = namedtuple('JobDef',
+                            ['name', 'arn', 'output_bucket', 'retries',
+                             'vcpus'])
+        self._job_definition = JobDef(
+            name=job_def_name,
+            arn=job_def_arn,
+            output_bucket=output_bucket,
+            retries=job_def_retries,
+            vcpus=job_def['containerProperties'].get('vcpus')
+        )
+
+        self._compute_environment = _stack_out('ComputeEnvironment', outs)
+        self._job_queue = _stack_out('JobQueue', outs)
+
+        conf_jd = config.get(self._knot_name, 'job-definition')
+        conf_ce = config.get(self._knot_name, 'compute-environment')
+        conf_jq = config.get(self._knot_name, 'job-queue')
+
+        if not all([
+            self._job_definition.arn == conf_jd,
+            self._compute_environment == conf_ce,
+            self._job_queue == conf_jq
+        ]):
+            raise aws.CloudknotConfigurationError(
+                'The resources in the CloudFormation stack do not match '
+                'the resources in the cloudknot configuration file. '
+                'Please try a different name.'
+            )
+
+        self._job_ids = cloudknot_config.get_knot_job_ids(
+            self._knot_name
+        )
+        self._retry_user_errors = (
+            config.getboolean(self._knot_name, 'retry-user-errors')
+            if config.has_option(self._knot_name, 'retry-user-errors')
+            else True
+        )
+        self._jobs = [aws.BatchJob(job_id=jid) for jid in self.job_ids]
 
     # Declare read-only properties
     @property
@@ -1510,7 +1606,8 @@ class Knot(aws.NamedObject):
     def job_definition(self):
         """namedtuple describing the job definition attached to this knot
 
-        The fields are 'name', 'arn', 'output_bucket', and 'retries'
+        The fields are 'name', 'arn', 'output_bucket', 'retries', and
+        'vcpus'
         """
         return self._job_definition
 
@@ -1524,6 +1621,11 @@ class Knot(aws.NamedObject):
         """The compute environment ARN for this knot"""
         return self._compute_environment
 
+    @property
+    def retry_user_errors(self):
+        """Boolean flag to indicate whether user errors are retried"""
+        return self._retry_user_errors
+
     @property
     def jobs(self):
         """List of BatchJob instances that this knot has launched"""
@@ -1534,8 +1636,13 @@ class Knot(aws.NamedObject):
         """List of batch job IDs that this knot has launched"""
         return self._job_ids
 
+    @in_resource_session
     def map(self, iterdata, env_vars=None, max_threads=64,
-            starmap=False, job_type='array'):
+            starmap=False, job_type='array', stage_files=False,
+            sink=None, sink_format='pickle', gather=False,
+            retry_user_errors=None, speculate=None, workers=None,
+            cost=None, chunksize=None, vcpus=None, memory=None,
+            resources=None):
         """Submit batch jobs for a range of commands and environment vars
 
         Each item of `iterdata` is assumed to be a single input for the
@@ -1548,8 +1655,14 @@ class Knot(aws.NamedObject):
 
         Parameters
         ----------
-        iterdata :
-            An iteratable of input data
+        iterdata : iterable or aws.BatchJob
+            An iteratable of input data. Alternatively, an upstream array
+            job (e.g. an element of another knot's `jobs` attribute), in which
+            case the new array job has the same size and each of its child
+            jobs receives the output of the upstream child job with the same
+            index. Each child job starts as soon as its upstream child job
+            succeeds (an AWS Batch N_TO_N dependency) and reads the upstream
+            output directly from S3.
 
         env_vars : sequence of dicts
             Additional environment variables for the Batch environment
@@ -1579,15 +1692,356 @@ class Knot(aws.NamedObject):
             the results.
             Default: 'array'
 
+        stage_files : bool
+            If True, upload each local file referenced by a path-like object
+            (e.g. a pathlib.Path) in `iterdata` to this knot's S3 bucket and
+            pass the function the path to a copy of that file in the
+            container. Files are stored by content hash so that files staged
+            by previous calls are not uploaded again. Note that only path-like
+            objects are staged; plain strings are passed through unchanged.
+            Default: False
+
+        sink : string
+            S3 URL template to which each result is written directly from
+            the container, e.g. 's3://bucket/results/{input[0]}/{index}.json'.
+            The template is formatted with the fields `index` (position in
+            `iterdata` for array jobs, zero for independent jobs), `attempt`
+            (AWS Batch attempt number), `job_id`, and `input` (the element of
+            `iterdata`). If provided, the futures
+            return aws.SinkReference namedtuples with fields 'bucket' and
+            'key' instead of the results themselves, so results are never
+            downloaded to the client. The batch jobs' IAM roles must be
+            allowed to write to the sink bucket.
+            Default: None
+
+        sink_format : 'pickle', 'json', or 'bytes'
+            Serialization format for results written to `sink`
+            Default: 'pickle'
+
+        gather : bool
+            If True, submit an additional job that depends on the array job
+            and consolidates all of its outputs, in order, into a single
+            compressed S3 object. The returned future then downloads one
+            object instead of one object per element. AWS Batch only starts
+            the additional job if every element succeeded, so if any element
+            fails, the additional job fails too and the returned future
+            raises aws.BatchJobFailedError. Elements whose output is missing
+            from S3 when the additional job runs appear as aws.MissingResult
+            namedtuples in the results.
+            Only valid if `job_type` is 'array' and `sink` is None.
+            Default: False
+
+        retry_user_errors : bool
+            If False, AWS Batch does not retry job attempts that failed
+            because the python function raised an exception, and the
+            returned future fails with the remote traceback as soon as any
+            element fails.
+            Default: None means use this knot's `retry_user_errors`
+
+        speculate : float
+            If provided, once this fraction (e.g. 0.95) of the array job's
+            elements have finished, submit duplicates of the remaining
+            elements and use whichever copy finishes first. See
+            aws.BatchJob.result. Only valid if `job_type` is 'array',
+            `gather` is False, and neither `workers` nor `chunksize` are
+            provided.
+            Default: None
+
+        workers : int
+            If provided, submit an array job with this many long-lived
+            workers (at least two) instead of one child job per element.
+            Each worker repeatedly claims an unprocessed element of
+            `iterdata` from a task queue in S3 and calls the function on it,
+            until no elements are left. This avoids paying the container
+            startup cost for each element, which is worthwhile for fast
+            functions. Only valid if `job_type` is 'array'.
+            Default: None
+
+        cost : callable
+            If provided with `workers`, a function that estimates the
+            relative runtime of the function for an item of `iterdata`.
+            Workers then claim the most expensive items first, each starting
+            with its own share of them, and steal the cheapest remaining
+            items from other workers once they run out. This balances
+            workloads whose item runtimes vary widely.
+            Default: None
+
+        chunksize : int
+            If provided, each child job of the array job processes a chunk of
+            this many consecutive items of `iterdata` instead of a single
+            item. The items of a chunk run in a local process pool with one
+            process per vCPU of the job (see `vcpus` and `job_def_vcpus`), so
+            that functions that use a single CPU still keep all reserved
+            vCPUs busy. Results are still stored and returned per item. There
+            must be at least two chunks. Only valid if `job_type` is 'array'
+            and `workers` is None.
+            Default: None
+
+        vcpus : int
+            Number of vCPUs to reserve for each container of this call,
+            overriding this knot's `job_def_vcpus` without creating a new job
+            definition
+            Default: None
+
+        memory : int
+            Memory (MiB) to reserve for each container of this call,
+            overriding this knot's job definition memory
+            Default: None
+
+        resources : callable
+            If provided, a function that returns the resource class of an
+            item of `iterdata` as a dict with keys 'vcpus' and/or 'memory',
+            e.g. {'vcpus': 1, 'memory': 2048} for light items. The items of
+            each resource class are submitted in a separate batch job with
+            those resources, so that AWS Batch can pack light items densely
+            onto instances while heavy items get the memory they need. The
+            results are returned in the order of `iterdata`, as if they were
+            submitted in a single batch job. A resource class with a single
+            item is submitted as an independent job. May not be combined
+            with `vcpus` or `memory`.
+            Default: None
+
+        Returns
+        -------
+        map : future or list of futures
+            If `job_type` is 'array', a future for the list of results.
+            If `job_type` is 'independent', list of futures for each job
+        """
+        map_kwargs = dict(
+            env_vars=env_vars, max_threads=max_threads, starmap=starmap,
+            job_type=job_type, gather=gather, resolve_refs=stage_files,
+            sink=sink, sink_format=sink_format,
+            retry_user_errors=retry_user_errors, speculate=speculate,
+            workers=workers, chunksize=chunksize
+        )
+
+        costs = None
+        if cost is not None:
+            if workers is None:
+                raise aws.CloudknotInputError('`cost` requires `workers`.')
+
+            iterdata = list(iterdata)
+            costs = [cost(item) for item in iterdata]
+
+        classes = None
+        if resources is not None:
+            if vcpus is not None or memory is not None:
+                raise aws.CloudknotInputError(
+                    'You may specify either `resources` or `vcpus` and '
+                    '`memory`, not both.'
+                )
+
+            if isinstance(iterdata, aws.BatchJob):
+                raise aws.CloudknotInputError(
+                    '`resources` requires `iterdata` to be an iterable.'
+                )
+
+            iterdata = list(iterdata)
+            classes = _resource_classes(iterdata, resources)
+
+        if stage_files and not isinstance(iterdata, aws.BatchJob):
+            iterdata = aws.stage_files(
+                iterdata,
+                bucket=self.job_definition.output_bucket,
+                sse=aws.get_s3_params().sse,
+                max_threads=max_threads,
+                client=self.clients['s3']
+            )
+
+        def ranking(indices):
+            return sorted(range(len(indices)), key=lambda i: costs[indices[i]],
+                          reverse=True)
+
+        if classes is None:
+            if costs is not None:
+                map_kwargs['ranking'] = ranking(range(len(iterdata)))
+
+            return self._map(iterdata, vcpus=vcpus, memory=memory,
+                             **map_kwargs)
+
+        groups = list(classes.values())
+        futures = []
+        for (group_vcpus, group_memory), indices in classes.items():
+            group_kwargs = dict(map_kwargs, vcpus=group_vcpus,
+                                memory=group_memory)
+
+            if len(indices) == 1:
+                # Array jobs need at least two elements
+                for key in ['gather', 'speculate', 'workers', 'chunksize']:
+                    group_kwargs.pop(key)
+                group_kwargs['job_type'] = 'independent'
+            elif costs is not None:
+                group_kwargs['ranking'] = ranking(indices)
+
+            futures.append(self._map([iterdata[i] for i in indices],
+                                     **group_kwargs))
+
+        if job_type == 'independent':
+            # Return the futures of the independent jobs in item order
+            ordered = [None] * len(iterdata)
+            for indices, group_futures in zip(groups, futures):
+                for idx, future in zip(indices, group_futures):
+                    ordered[idx] = future
+            return ordered
+
+        return self._merge_futures(groups, futures)
+
+    @in_resource_session
+    def map_s3(self, prefix, bucket=None, n_chunks=None, stream=False,
+               env_vars=None, max_threads=64, job_type='array'):
+        """Submit batch jobs for each object under an S3 prefix
+
+        The S3 objects are listed on the client but never downloaded to it.
+        Each batch job downloads its input objects directly from S3 into the
+        container's scratch space, using parallel ranged GETs, and calls the
+        python function with the local file path. If `n_chunks` is given, the
+        objects are grouped into at most `n_chunks` chunks of roughly equal
+        total size and the function is called with a list of local file
+        paths for each chunk.
+
+        The batch jobs' IAM roles must be allowed to read from `bucket`,
+        e.g. by supplying an appropriate policy in the knot's
+        `pars_policies`.
+
+        Parameters
+        ----------
+        prefix : string
+            Key prefix of the input objects or an S3 URL of the form
+            's3://bucket/prefix'
+
+        bucket : string
+            Name of the S3 bucket containing the input objects. Must not be
+            specified if `prefix` is an S3 URL.
+            Default: None means use the bucket in `prefix` or, if `prefix` is
+            not an S3 URL, this knot's output bucket
+
+        n_chunks : int
+            If provided, shard the input objects by size into at most this
+            many chunks and submit one job element per chunk
+            Default: None means one job element per object
+
+        stream : bool
+            If True, pass a streaming handle to each S3 object (a
+            botocore.response.StreamingBody) instead of a local file path
+            Default: False
+
+        env_vars : sequence of dicts
+            Additional environment variables for the Batch environment
+            Each dict must have only 'name' and 'value' keys. The same
+            environment variables are applied for each job element.
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to invoke.
+            Default: 64
+
+        job_type : string, 'array' or 'independent'
+            Type of batch job to submit. See `map`.
+            Default: 'array'
+
         Returns
         -------
         map : future or list of futures
             If `job_type` is 'array', a future for the list of results.
             If `job_type` is 'independent', list of futures for each job
         """
+        if prefix.startswith('s3://'):
+            if bucket is not None:
+                raise aws.CloudknotInputError(
+                    'You may specify either an S3 URL `prefix` or `bucket`, '
+                    'not both.'
+                )
+            bucket, prefix = aws.split_s3_url(prefix)
+        elif bucket is None:
+            bucket = self.job_definition.output_bucket
+
+        objects = aws.list_s3_objects(bucket=bucket, prefix=prefix,
+                                      client=self.clients['s3'])
+
+        if n_chunks is None:
+            iterdata = [aws.s3_ref(bucket=o.bucket, key=o.key, stream=stream)
+                        for o in objects]
+        else:
+            iterdata = [
+                [aws.s3_ref(bucket=o.bucket, key=o.key, stream=stream)
+                 for o in shard]
+                for shard in aws.shard_by_size(objects, n_chunks)
+            ]
+
+        mod_logger.info(
+            'Knot {name:s} mapping over {n:d} objects in s3://{b:s}/{p:s}'
+            ''.format(name=self.name, n=len(objects), b=bucket, p=prefix)
+        )
+
+        return self._map(iterdata, env_vars=env_vars, max_threads=max_threads,
+                         starmap=False, job_type=job_type, resolve_refs=True)
+
+    def _map(self, iterdata, env_vars=None, max_threads=64, starmap=False,
+             job_type='array', gather=False, speculate=None, **job_kwargs):
+        """Submit batch jobs and return futures for their results
+
+        See `map` for a description of the parameters. Additional keyword
+        arguments are passed to each aws.BatchJob.
+        """
+        if speculate is not None and (job_type != 'array' or gather):
+            raise aws.CloudknotInputError(
+                "`speculate` requires `job_type` to be 'array' and `gather` "
+                "to be False."
+            )
+
+        if speculate is not None and (
+                job_kwargs.get('workers') is not None
+                or job_kwargs.get('chunksize') is not None):
+            raise aws.CloudknotInputError(
+                '`speculate` may not be combined with `workers` or '
+                '`chunksize`.'
+            )
+
+        these_jobs = self._submit(iterdata, env_vars=env_vars,
+                                  starmap=starmap, job_type=job_type,
+                                  gather=gather, **job_kwargs)
+
+        if not these_jobs:
+            return []
+
+        futures = self._futures(these_jobs, max_threads=max_threads,
+                                speculate=speculate)
+
+        if job_type == 'independent':
+            return futures
+        else:
+            return futures[0]
+
+    def _submit(self, iterdata, env_vars=None, starmap=False,
+                job_type='array', gather=False, **job_kwargs):
+        """Submit batch jobs and return the jobs to wait on
+
+        See `map` for a description of the parameters. Additional keyword
+        arguments are passed to each aws.BatchJob.
+        """
         if job_type not in ['array', 'independent']:
             raise ValueError("`job_type` must be 'array' or 'independent'.")
 
+        if gather and job_type != 'array':
+            raise aws.CloudknotInputError(
+                "`gather` requires `job_type` to be 'array'."
+            )
+
+        if job_kwargs.get('workers') is not None and job_type != 'array':
+            raise aws.CloudknotInputError(
+                "`workers` requires `job_type` to be 'array'."
+            )
+
+        if job_kwargs.get('chunksize') is not None and job_type != 'array':
+            raise aws.CloudknotInputError(
+                "`chunksize` requires `job_type` to be 'array'."
+            )
+
+        if gather and job_kwargs.get('sink') is not None:
+            raise aws.CloudknotInputError(
+                'You may specify either `gather` or `sink`, not both.'
+            )
+
         if self.clobbered:
             raise aws.ResourceClobberedException(
                 'This Knot has already been clobbered.',
@@ -1596,21 +2050,35 @@ class Knot(aws.NamedObject):
 
         self.check_profile_and_region()
 
+        if job_kwargs.get('retry_user_errors') is None:
+            job_kwargs['retry_user_errors'] = self.retry_user_errors
+
+        if isinstance(iterdata, aws.BatchJob):
+            # Pipeline element-wise from an upstream array job
+            upstream = iterdata
+            if (not upstream.array_job or upstream.workers
+                    or upstream.chunksize
+                    or job_kwargs.get('workers') is not None
+                    or job_kwargs.get('chunksize') is not None
+                    or job_type != 'array'):
+                raise aws.CloudknotInputError(
+                    "If iterdata is a BatchJob, it must be an array job "
+                    "without workers or chunks and `job_type` must be "
+                    "'array'."
+                )
+
+            iterdata = [upstream.output_ref(index=i)
+                        for i in range(len(upstream.input))]
+            job_kwargs.update(resolve_refs=True, depends_on=[upstream],
+                              dependency_type='N_TO_N')
+
         if not isinstance(iterdata, Iterable):
             raise TypeError('iterdata must be an iterable.')
 
-        # env_vars should be a sequence of sequences of dicts
-        if env_vars and not all(isinstance(s, dict) for s in env_vars):
-            raise aws.CloudknotInputError('env_vars must be a sequence of '
-                                          'dicts')
-
-        # and each dict should have only 'name' and 'value' keys
-        if env_vars and not all(set(d.keys()) == {'name', 'value'}
-                                for d in env_vars):
-            raise aws.CloudknotInputError('each dict in env_vars must have '
-                                          'keys "name" and "value"')
+        _check_env_vars(env_vars)
 
         these_jobs = []
+        n_saved = len(self.job_ids)
 
         if job_type == 'independent':
             for input_ in iterdata:
@@ -1623,7 +2091,8 @@ class Knot(aws.NamedObject):
                     job_queue=self.job_queue,
                     job_definition=self.job_definition,
                     environment_variables=env_vars,
-                    array_job=False
+                    array_job=False,
+                    **job_kwargs
                 )
 
                 these_jobs.append(job)
@@ -1637,44 +2106,526 @@ class Knot(aws.NamedObject):
                 job_queue=self.job_queue,
                 job_definition=self.job_definition,
                 environment_variables=env_vars,
-                array_job=True
+                array_job=True,
+                **job_kwargs
             )
 
             these_jobs.append(job)
             self._jobs.append(job)
             self._job_ids.append(job.job_id)
 
-        if not these_jobs:
-            return []
-
-        config = configparser.ConfigParser()
-
-        with rlock:
-            config.read(get_config_file())
-            config.set(self._knot_name, 'job_ids', ' '.join(self.job_ids))
-            # Save config to file
-            with open(get_config_file(), 'w') as f:
-                config.write(f)
-
-        # Increase the max_pool_connections in the boto3 clients to prevent
-        # https://github.com/boto/botocore/issues/766
-        aws.refresh_clients(max_pool=max_threads)
+            if gather:
+                # Consolidate the array job outputs in a dependent job and
+                # only wait on the consolidated result
+                gather_job = aws.BatchJob(
+                    input_=job.output_ref(),
+                    name='{n:s}-{i:d}'.format(
+                        n=self.name, i=len(self.job_ids)
+                    ),
+                    job_queue=self.job_queue,
+                    job_definition=self.job_definition,
+                    environment_variables=env_vars,
+                    array_job=False,
+                    resolve_refs=True,
+                    depends_on=[job],
+                    gather=True
+                )
+
+                these_jobs = [gather_job]
+                self._jobs.append(gather_job)
+                self._job_ids.append(gather_job.job_id)
+
+        if these_jobs:
+            self._save_job_ids(self.job_ids[n_saved:])
+
+        return these_jobs
+
+    def _submit_dependent(self, upstream, env_vars=None,
+                          skip_missing=False):
+        """Submit a job that receives all of the output of an upstream job
+
+        Parameters
+        ----------
+        upstream : aws.BatchJob
+            The job on whose output the new job depends
+
+        env_vars : sequence of dicts
+            Additional environment variables for the Batch environment
+            Default: None
+
+        skip_missing : bool
+            If True, drop the upstream elements that failed from the input
+            of the dependent job. See `aws.BatchJob.output_ref`.
+            Default: False
+
+        Returns
+        -------
+        job : aws.BatchJob
+            The dependent job
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        self.check_profile_and_region()
+
+        job = aws.BatchJob(
+            input_=upstream.output_ref(skip_missing=skip_missing),
+            name='{n:s}-{i:d}'.format(n=self.name, i=len(self.job_ids)),
+            job_queue=self.job_queue,
+            job_definition=self.job_definition,
+            environment_variables=env_vars,
+            array_job=False,
+            resolve_refs=True,
+            depends_on=[upstream],
+            retry_user_errors=self.retry_user_errors
+        )
+
+        self._jobs.append(job)
+        self._job_ids.append(job.job_id)
+        self._save_job_ids([job.job_id])
+
+        return job
+
+    def _save_job_ids(self, job_ids):
+        """Record newly submitted job IDs of this knot in one transaction
+
+        Parameters
+        ----------
+        job_ids : sequence of strings
+            The job IDs, in order of submission
+        """
+        cloudknot_config.add_knot_job_ids(self._knot_name, job_ids)
+
+    @staticmethod
+    def _futures(jobs, max_threads=64, **result_kwargs):
+        """Return a list of futures for the results of batch jobs
+
+        Additional keyword arguments are passed to aws.BatchJob.result.
+        """
+        # Grow the max_pool_connections of the jobs' boto3 clients to prevent
+        # https://github.com/boto/botocore/issues/766. Clients in use by
+        # earlier futures are never replaced under them.
+        for job in jobs:
+            job.clients.grow_pool(max_threads)
 
         executor = ThreadPoolExecutor(
-            max(min(len(these_jobs), max_threads), 2)
+            max(min(len(jobs), max_threads), 2)
         )
 
-        futures = [executor.submit(lambda j: j.result(), jb)
-                   for jb in these_jobs]
+        futures = [executor.submit(lambda j: j.result(**result_kwargs), jb)
+                   for jb in jobs]
 
         # Shutdown the executor but do not wait to return the futures
         executor.shutdown(wait=False)
 
-        if job_type == 'independent':
-            return futures
-        else:
-            return futures[0]
+        return futures
+
+    @staticmethod
+    def _merge_futures(groups, futures):
+        """Return a future for the results of several groups of items
 
+        Parameters
+        ----------
+        groups : sequence of lists of ints
+            The indices of the items of each group
+
+        futures : sequence of futures
+            For each group, a future for the list of results of its items or,
+            for groups with a single item, a list with a future for its
+            result
+
+        Returns
+        -------
+        future : future
+            A future for the list of results of all items, in index order
+        """
+        def merge():
+            results = [None] * sum(len(indices) for indices in groups)
+            for indices, future in zip(groups, futures):
+                if isinstance(future, list):
+                    group_results = [f.result() for f in future]
+                else:
+                    group_results = future.result()
+
+                for idx, result in zip(indices, group_results):
+                    results[idx] = result
+
+            return results
+
+        executor = ThreadPoolExecutor(1)
+        future = executor.submit(merge)
+
+        # Shutdown the executor but do not wait to return the future
+        executor.shutdown(wait=False)
+
+        return future
+
+    @in_resource_session
+    def pipeline(self, iterdata, stages, env_vars=None, max_threads=64,
+                 starmap=False):
+        """Submit a multi-stage pipeline of batch jobs up front
+
+        The first stage maps this knot's function over `iterdata` in an
+        array job, just like `map`. Each subsequent stage runs the function
+        of the corresponding knot in `stages` in a batch job that depends on
+        the previous stage's job, using the AWS Batch `dependsOn` job
+        parameter. By default, a stage runs in a single job that receives
+        the previous stage's result (i.e. a list of results if the previous
+        stage was an array job). An 'elementwise' stage instead runs in an
+        array job with one child job per element of the previous array job
+        stage, which starts as soon as the corresponding upstream child job
+        succeeds. The container reads each stage's input directly from S3.
+        All stages are submitted immediately, so there are no gaps between
+        stages and no intermediate results pass through the client.
+
+        The stages may belong to different knots, but all knots must share
+        an S3 bucket and their IAM roles must be allowed to read from it.
+
+        Parameters
+        ----------
+        iterdata :
+            An iteratable of input data for the first stage. Must have at
+            least two elements.
+
+        stages : sequence of Knot instances or (Knot, mode) tuples
+            The knots whose functions make up the subsequent stages, in
+            order. `mode` is either 'all' (the default for bare Knot
+            instances) or 'elementwise'.
+
+        env_vars : sequence of dicts
+            Additional environment variables for the Batch environment
+            Each dict must have only 'name' and 'value' keys. The same
+            environment variables are applied for each stage.
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to invoke.
+            Default: 64
+
+        starmap : bool
+            If True, assume argument parameters for the first stage are
+            already grouped in tuples from a single iterable. See `map`.
+            Default: False
+
+        Returns
+        -------
+        future : future
+            A future for the result of the final stage
+        """
+        stages = [s if isinstance(s, tuple) else (s, 'all') for s in stages]
+
+        if not all(len(s) == 2 and isinstance(s[0], Knot)
+                   and s[1] in ['all', 'elementwise'] for s in stages):
+            raise aws.CloudknotInputError(
+                "stages must be a sequence of Knot instances or (Knot, mode) "
+                "tuples, where mode is 'all' or 'elementwise'."
+            )
+
+        iterdata = _check_array_input(iterdata)
+        _check_env_vars(env_vars)
+
+        job = self._submit(iterdata, env_vars=env_vars, starmap=starmap,
+                           job_type='array')[0]
+
+        for knot, mode in stages:
+            if mode == 'elementwise':
+                job = knot._submit(job, env_vars=env_vars,
+                                   job_type='array')[0]
+            else:
+                job = knot._submit_dependent(job, env_vars=env_vars)
+
+        mod_logger.info(
+            'Knot {name:s} submitted a pipeline with {n:d} stages'.format(
+                name=self.name, n=len(stages) + 1
+            )
+        )
+
+        return self._futures([job], max_threads=max_threads)[0]
+
+    @in_resource_session
+    def map_reduce(self, iterdata, reducer, fanin=16, env_vars=None,
+                   max_threads=64, starmap=False):
+        """Map over input data and reduce the results in the cloud
+
+        This knot's function is mapped over `iterdata` in an array job, just
+        like `map`. The results are then combined by a tree of reduction
+        jobs, each of which calls `reducer` with a list of at most `fanin`
+        upstream results. Each level of the tree is an array job (or a single
+        job for the final level) that depends on the previous level, using
+        the AWS Batch `dependsOn` job parameter. All levels are submitted
+        immediately and only the final reduced value is downloaded to the
+        client.
+
+        `reducer` must therefore accept a list of values that are either
+        results of this knot's function or results of `reducer` itself,
+        e.g. a function that sums its input list.
+
+        AWS Batch only starts a job once all of the jobs on which it depends
+        succeeded. So if any element fails, after exhausting its retries,
+        the whole reduction fails and the returned future raises
+        aws.BatchJobFailedError. If some elements are expected to fail, use
+        `map` instead, together with aws.BatchJob.result(partial=True) or
+        aws.BatchJob.resubmit_failed. Elements whose output is missing from
+        S3 even though their job succeeded are left out of the lists passed
+        to `reducer`.
+
+        Parameters
+        ----------
+        iterdata :
+            An iteratable of input data. Must have at least two elements.
+
+        reducer : Knot
+            The knot whose function reduces a list of results
+
+        fanin : int
+            Maximum number of upstream results combined by each reduction
+            job. Must be at least 2.
+            Default: 16
+
+        env_vars : sequence of dicts
+            Additional environment variables for the Batch environment
+            Each dict must have only 'name' and 'value' keys. The same
+            environment variables are applied for each job.
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to invoke.
+            Default: 64
+
+        starmap : bool
+            If True, assume argument parameters for the mapped function are
+            already grouped in tuples from a single iterable. See `map`.
+            Default: False
+
+        Returns
+        -------
+        future : future
+            A future for the reduced result
+        """
+        fanin = int(fanin)
+        if fanin < 2:
+            raise aws.CloudknotInputError('fanin must be at least 2.')
+
+        if not isinstance(reducer, Knot):
+            raise aws.CloudknotInputError('reducer must be a Knot instance.')
+
+        iterdata = _check_array_input(iterdata)
+        _check_env_vars(env_vars)
+
+        job = self._submit(iterdata, env_vars=env_vars, starmap=starmap,
+                           job_type='array')[0]
+        n_results = len(job.input)
+        n_levels = 0
+
+        while n_results > fanin:
+            groups = [
+                job.output_ref(indices=range(i, min(i + fanin, n_results)),
+                               skip_missing=True)
+                for i in range(0, n_results, fanin)
+            ]
+
+            job = reducer._submit(groups, env_vars=env_vars,
+                                  job_type='array', resolve_refs=True,
+                                  depends_on=[job])[0]
+            n_results = len(groups)
+            n_levels += 1
+
+        # The final reduction combines all remaining results in one job
+        job = reducer._submit_dependent(job, env_vars=env_vars,
+                                        skip_missing=True)
+
+        mod_logger.info(
+            'Knot {name:s} submitted a map-reduce with {n:d} reduction '
+            'levels'.format(name=self.name, n=n_levels + 1)
+        )
+
+        return self._futures([job], max_threads=max_threads)[0]
+
+    @in_resource_session
+    def recommend_resources(self, headroom=0.25, quantile=0.9, apply=False,
+                            n_jobs=10, max_threads=64):
+        """Recommend vCPUs and memory for this knot's job definition
+
+        The batch job container measures the CPU time and peak memory (RSS)
+        of each element that it runs and stores them in the element's status
+        manifest. This method aggregates these measurements across this
+        knot's most recent jobs on its current job definition and recommends
+        the smallest job definition resources that cover them, so that AWS
+        Batch can pack as many containers as possible onto each instance.
+        Gather jobs are skipped, since they do not run this knot's function,
+        and so are chunked jobs, whose containers run several elements at
+        the same time in a process pool.
+
+        Elements killed for running out of memory leave no measurements, so
+        if any attempts were killed, increase the memory instead of
+        applying a recommendation based on the survivors.
+
+        Parameters
+        ----------
+        headroom : float
+            Fraction of the highest measured peak memory to add to the
+            recommended memory as a safety margin against running out of
+            memory
+            Default: 0.25
+
+        quantile : float
+            Quantile of the elements' CPU utilization (CPU time divided by
+            wall time) from which to recommend the number of vCPUs
+            Default: 0.9
+
+        apply : bool
+            If True, update this knot's CloudFormation stack with the
+            recommended resources, which registers a new revision of its job
+            definition that subsequent jobs use
+            Default: False
+
+        n_jobs : int
+            Number of this knot's most recent jobs on its current job
+            definition from which to use the measurements
+            Default: 10
+
+        max_threads : int
+            Maximum number of threads used to download the measurements
+            Default: 64
+
+        Returns
+        -------
+        recommendation : ResourceRecommendation namedtuple or None
+            namedtuple with fields 'vcpus', 'memory' (MiB), 'peak_memory'
+            (highest measured peak RSS in MiB), 'cpu_utilization' (the
+            `quantile` of the measured CPU utilization), and 'n_samples'
+            (number of measured attempts). None if there are no
+            measurements yet.
+        """
+        if headroom < 0:
+            raise aws.CloudknotInputError('headroom must be non-negative.')
+
+        if not 0 <= quantile <= 1:
+            raise aws.CloudknotInputError('quantile must be between 0 and 1.')
+
+        if n_jobs < 1:
+            raise aws.CloudknotInputError('n_jobs must be at least 1.')
+
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        self.check_profile_and_region()
+
+        # Resubmissions and speculative duplicates store their manifests
+        # with the job whose elements they run again. Measurements of
+        # earlier job definitions do not describe the current one.
+        jobs = [job for job in self.jobs
+                if not job.gather and job.retry_of is None
+                and not job.chunksize
+                and job.job_definition.arn == self.job_definition.arn]
+        jobs = jobs[-n_jobs:]
+
+        samples = []
+        for job in jobs:
+            samples += [m for m in job.manifests(max_threads=max_threads)
+                        if 'peak_rss_mib' in m]
+
+        if not samples:
+            mod_logger.warning(
+                'There are no resource measurements for knot {name:s} '
+                'yet.'.format(name=self.name)
+            )
+            return None
+
+        peak_memory = max(m['peak_rss_mib'] for m in samples)
+
+        utilization = sorted(m['cpu_time'] / m['duration'] for m in samples
+                             if m['duration'] > 0) or [0]
+        cpu_utilization = utilization[
+            int(round(quantile * (len(utilization) - 1)))
+        ]
+
+        # Round the memory up to a multiple of 128 MiB
+        recommendation = ResourceRecommendation(
+            vcpus=max(int(round(cpu_utilization)), 1),
+            memory=int(math.ceil(peak_memory * (1 + headroom) / 128)) * 128,
+            peak_memory=peak_memory,
+            cpu_utilization=cpu_utilization,
+            n_samples=len(samples)
+        )
+
+        mod_logger.info(
+            'Recommended {v:d} vCPUs and {m:d} MiB for knot {name:s} from '
+            '{n:d} measurements'.format(
+                v=recommendation.vcpus, m=recommendation.memory,
+                name=self.name, n=recommendation.n_samples
+            )
+        )
+
+        if apply:
+            self._update_job_definition(vcpus=recommendation.vcpus,
+                                        memory=recommendation.memory)
+
+        return recommendation
+
+    def _update_job_definition(self, vcpus, memory):
+        """Update the job definition resources in this knot's stack
+
+        CloudFormation registers a new revision of the job definition, which
+        replaces the current one in this knot and in the config file.
+        """
+        response = self.clients['cloudformation'].describe_stacks(
+            StackName=self.stack_id
+        )
+        stack = response.get('Stacks')[0]
+
+        new_values = {'JdvCpus': str(vcpus), 'JdMemory': str(memory)}
+        params = [
+            {'ParameterKey': p['ParameterKey'],
+             'ParameterValue': new_values[p['ParameterKey']]}
+            if p['ParameterKey'] in new_values
+            else {'ParameterKey': p['ParameterKey'], 'UsePreviousValue': True}
+            for p in stack['Parameters']
+        ]
+
+        self.clients['cloudformation'].update_stack(
+            StackName=self.stack_id,
+            UsePreviousTemplate=True,
+            Parameters=params,
+            Capabilities=['CAPABILITY_NAMED_IAM']
+        )
+
+        waiter = self.clients['cloudformation'].get_waiter(
+            'stack_update_complete'
+        )
+        waiter.wait(StackName=self.stack_id, WaiterConfig={'Delay': 10})
+
+        response = self.clients['cloudformation'].describe_stacks(
+            StackName=self.stack_id
+        )
+        outs = response.get('Stacks')[0]['Outputs']
+
+        job_def_arn = _stack_out('JobDefinition', outs)
+        self._job_definition = self._job_definition._replace(
+            arn=job_def_arn, vcpus=int(vcpus)
+        )
+
+        config = configparser.ConfigParser()
+
+        with rlock:
+            config.read(get_config_file())
+            config.set(self._knot_name, 'job-definition', job_def_arn)
+            write_config(config)
+
+        mod_logger.info(
+            'Updated the job definition of knot {name:s} to {arn:s} with '
+            '{v:d} vCPUs and {m:d} MiB'.format(name=self.name,
+                                               arn=job_def_arn,
+                                               v=int(vcpus), m=int(memory))
+        )
+
+    @in_resource_session
     def view_jobs(self):
         """Print the job_id, name, and status of all jobs in self.jobs"""
         if self.clobbered:
@@ -1688,7 +2639,7 @@ class Knot(aws.NamedObject):
         order = {'SUBMITTED': 0, 'PENDING': 1, 'RUNNABLE': 2, 'STARTING': 3,
                  'RUNNING': 4, 'FAILED': 5, 'SUCCEEDED': 6}
 
-        response = aws.clients['batch'].describe_jobs(jobs=self.job_ids)
+        response = self.clients['batch'].describe_jobs(jobs=self.job_ids)
         sorted_jobs = sorted(response.get('jobs'),
                              key=lambda j: order[j['status']])
 
@@ -1700,6 +2651,7 @@ class Knot(aws.NamedObject):
         for job in sorted_jobs:
             print(fmt.format(**job))
 
+    @in_resource_session
     def clobber(self, clobber_pars=False, clobber_repo=False,
                 clobber_image=False):
         """Delete associated AWS resources and remove section from config
@@ -1731,7 +2683,7 @@ class Knot(aws.NamedObject):
                 e.submit(job.clobber)
                 self._jobs.remove(job)
 
-        aws.clients['cloudformation'].delete_stack(StackName=self._stack_id)
+        self.clients['cloudformation'].delete_stack(StackName=self._stack_id)
 
         if clobber_repo:
             dr = self.docker_repo
@@ -1751,7 +2703,7 @@ class Knot(aws.NamedObject):
                     registry_id = uri.split('.')[0]
                     tag = uri.split(':')[-1]
 
-                    aws.clients['ecr'].batch_delete_image(
+                    self.clients['ecr'].batch_delete_image(
                         registryId=registry_id,
                         repositoryName=repo_name,
                         imageIds=[{'imageTag': tag}]
@@ -1765,7 +2717,7 @@ class Knot(aws.NamedObject):
             self.docker_image.clobber()
 
         if clobber_pars:
-            waiter = aws.clients['cloudformation'].get_waiter(
+            waiter = self.clients['cloudformation'].get_waiter(
                 'stack_delete_complete'
             )
             waiter.wait(StackName=self.stack_id, WaiterConfig={'Delay': 10})
@@ -1777,11 +2729,376 @@ class Knot(aws.NamedObject):
         with rlock:
             config.read(get_config_file())
             config.remove_section(self._knot_name)
-            with open(get_config_file(), 'w') as f:
-                config.write(f)
+            write_config(config)
+            cloudknot_config.remove_knot_job_ids(self._knot_name)
 
         # Set the clobbered parameter to True,
         # preventing subsequent method calls
         self._clobbered = True
 
         mod_logger.info('Clobbered Knot {name:s}'.format(name=self.name))
+
+
+def _shard_sizes(n_items, weights):
+    """Split `n_items` into shards in proportion to `weights`
+
+    Uses the largest remainder method, so that the shard sizes add up to
+    `n_items`.
+    """
+    total = float(sum(weights))
+    exact = [n_items * w / total for w in weights]
+    sizes = [int(math.floor(e)) for e in exact]
+    by_remainder = sorted(range(len(weights)),
+                          key=lambda i: exact[i] - sizes[i], reverse=True)
+    for i in by_remainder[:n_items - sum(sizes)]:
+        sizes[i] += 1
+
+    return sizes
+
+
+# noinspection PyPropertyAccess,PyAttributeOutsideInit
+@registered
+class KnotGroup(object):
+    """Group of knots that share one docker image and split maps among them
+
+    A single knot is limited by the max_vcpus of its compute environment and
+    by the scheduling of its job queue. A KnotGroup splits one map across
+    several knots, e.g. in different regions (see aws.session_context), in
+    proportion to their weights or their free capacity. It routes the
+    elements that fail to the knot whose queue drains fastest and returns
+    one future for all results, in order.
+    """
+    def __init__(self, knots, weights=None):
+        """Initialize a KnotGroup instance
+
+        Parameters
+        ----------
+        knots : sequence of Knot
+            The knots in the group. They must share the same docker image.
+
+        weights : sequence of positive numbers
+            Relative share of each map for each knot
+            Default: None means in proportion to the knots' free vCPUs
+        """
+        knots = list(knots)
+        if not knots or not all(isinstance(k, Knot) for k in knots):
+            raise aws.CloudknotInputError(
+                '`knots` must be a non-empty sequence of Knot instances.'
+            )
+
+        if len(set(k.docker_image.name for k in knots)) > 1:
+            raise aws.CloudknotInputError(
+                'The knots in a KnotGroup must share the same docker image.'
+            )
+
+        if weights is not None:
+            weights = list(weights)
+            if len(weights) != len(knots) or any(w <= 0 for w in weights):
+                raise aws.CloudknotInputError(
+                    '`weights` must have one positive number for each knot.'
+                )
+
+        self._knots = knots
+        self._weights = weights
+
+    @property
+    def knots(self):
+        """List of the Knot instances in this group"""
+        return self._knots
+
+    @property
+    def weights(self):
+        """Relative share of each map for each knot, or None to split maps
+        by free capacity"""
+        return self._weights
+
+    @staticmethod
+    def _vcpus(knot):
+        """Return the max and desired vCPUs of a knot's compute environment"""
+        response = knot.clients['batch'].describe_compute_environments(
+            computeEnvironments=[knot.compute_environment]
+        )
+        resources = response.get('computeEnvironments')[0].get(
+            'computeResources', {}
+        )
+        return resources.get('maxvCpus', 0), resources.get('desiredvCpus', 0)
+
+    def capacity(self):
+        """Return the number of free vCPUs of each knot's compute environment
+
+        Free vCPUs are the compute environment's max_vcpus minus the vCPUs
+        that AWS Batch currently wants to run.
+        """
+        return [max(max_vcpus - desired, 0)
+                for max_vcpus, desired in map(self._vcpus, self.knots)]
+
+    def shares(self):
+        """Return the relative share of a map for each knot
+
+        These are the weights, if given. Otherwise, they are the knots' free
+        vCPUs or, if no knot has any free vCPUs, their max_vcpus.
+        """
+        if self.weights is not None:
+            return self.weights
+
+        free = self.capacity()
+        if any(free):
+            return free
+
+        return [max(max_vcpus, 1)
+                for max_vcpus, _ in map(self._vcpus, self.knots)]
+
+    def _backlog(self, knot):
+        """Return the number of runnable jobs per vCPU in a knot's queue
+
+        Each child of a runnable array job counts as one job.
+        """
+        paginator = knot.clients['batch'].get_paginator('list_jobs')
+        n_runnable = sum(
+            summary.get('arrayProperties', {}).get('size', 1)
+            for page in paginator.paginate(jobQueue=knot.job_queue,
+                                           jobStatus='RUNNABLE')
+            for summary in page.get('jobSummaryList', [])
+        )
+        return n_runnable / float(max(self._vcpus(knot)[0], 1))
+
+    def fastest_knot(self):
+        """Return the knot whose job queue drains fastest
+
+        That is the knot with the fewest runnable jobs per vCPU of its
+        compute environment.
+        """
+        backlogs = [self._backlog(k) for k in self.knots]
+        return self.knots[backlogs.index(min(backlogs))]
+
+    @staticmethod
+    def _submit_shard(knot, iterdata, indices, job_type, map_kwargs):
+        """Map the items at `indices` with `knot`
+
+        Returns
+        -------
+        shard : tuple
+            The indices, the future (or list of futures) returned by
+            Knot.map, the batch jobs that it submitted, and the positions
+            within the shard of the items of each of these jobs (see
+            `_outcomes`)
+        """
+        shard_kwargs = dict(map_kwargs, job_type=job_type)
+        if len(indices) == 1 and job_type == 'array':
+            # Array jobs need at least two elements
+            for key in ['gather', 'speculate', 'workers', 'cost',
+                        'chunksize']:
+                shard_kwargs.pop(key, None)
+            shard_kwargs['job_type'] = 'independent'
+
+        items = [iterdata[i] for i in indices]
+
+        # Knot.map submits one job for each resource class
+        resources = shard_kwargs.get('resources')
+        if resources is not None and shard_kwargs['job_type'] == 'array':
+            groups = list(_resource_classes(items, resources).values())
+        else:
+            groups = [list(range(len(items)))]
+
+        n_jobs = len(knot.jobs)
+        future = knot.map(items, **shard_kwargs)
+        return indices, future, knot.jobs[n_jobs:], groups
+
+    @staticmethod
+    def _outcomes(future, jobs, groups):
+        """Return the result or the error of each item of a shard
+
+        Parameters
+        ----------
+        future : future or list of futures
+            The future (or list of futures) returned by Knot.map
+
+        jobs : list of aws.BatchJob
+            The batch jobs submitted by Knot.map
+
+        groups : list of lists of ints
+            For each array job or single-item independent job in `jobs`,
+            the positions of its items within the shard
+        """
+        errors = (aws.BatchJobFailedError, aws.CKTimeoutError)
+
+        if isinstance(future, list):
+            outcomes = []
+            for f in future:
+                try:
+                    outcomes.append(f.result())
+                except errors as e:
+                    outcomes.append(e)
+            return outcomes
+
+        try:
+            return future.result()
+        except errors as e:
+            n_items = sum(len(indices) for indices in groups)
+
+            # Gather jobs only consolidate the outputs of their array job
+            jobs = [job for job in jobs if job is not None and not job.gather]
+            if len(jobs) != len(groups):
+                return [e] * n_items
+
+            # Find out which elements failed, job by job
+            outcomes = [e] * n_items
+            for job, indices in zip(jobs, groups):
+                if job.array_job:
+                    job_outcomes = job.result(partial=True)
+                else:
+                    try:
+                        job_outcomes = [job.result()]
+                    except errors as job_error:
+                        job_outcomes = [job_error]
+
+                for idx, outcome in zip(indices, job_outcomes):
+                    outcomes[idx] = outcome
+
+            return outcomes
+
+    def map(self, iterdata, job_type='array', max_threads=64, retries=1,
+            **map_kwargs):
+        """Split one map across the knots of this group
+
+        Each knot receives a contiguous shard of `iterdata` in proportion to
+        its share (see `shares`), and all knots submit their batch jobs at
+        the same time, each with its own profile and region. Elements that
+        fail are submitted again, up to `retries` times, to the knot whose
+        queue drains fastest.
+
+        Parameters
+        ----------
+        iterdata : iterable
+            An iterable of input data
+
+        job_type : string, 'array' or 'independent'
+            Type of batch jobs to submit. See Knot.map. Shards with a single
+            item are submitted as independent jobs.
+            Default: 'array'
+
+        max_threads : int
+            Maximum number of threads used by each knot. See Knot.map.
+            Default: 64
+
+        retries : int
+            Number of times to submit failed elements again
+            Default: 1
+
+        Additional keyword arguments are passed to Knot.map.
+
+        Returns
+        -------
+        future : future
+            A future for the list of results, in the order of `iterdata`
+        """
+        if isinstance(iterdata, aws.BatchJob):
+            raise aws.CloudknotInputError(
+                'KnotGroup.map requires `iterdata` to be an iterable.'
+            )
+
+        if not isinstance(retries, int) or retries < 0:
+            raise aws.CloudknotInputError(
+                '`retries` must be a non-negative integer.'
+            )
+
+        iterdata = list(iterdata)
+        map_kwargs = dict(map_kwargs, max_threads=max_threads)
+
+        shards = []
+        start = 0
+        for knot, size in zip(self.knots,
+                              _shard_sizes(len(iterdata), self.shares())):
+            if size:
+                shards.append((knot, list(range(start, start + size))))
+            start += size
+
+        def submit(shard):
+            knot, indices = shard
+            return self._submit_shard(knot, iterdata, indices, job_type,
+                                      map_kwargs)
+
+        # Submit to all knots concurrently. Each knot submits in its own
+        # profile and region.
+        executor = ThreadPoolExecutor(max(len(shards), 1))
+        try:
+            pending = list(executor.map(submit, shards))
+        finally:
+            executor.shutdown(wait=True)
+
+        def collect():
+            results = [None] * len(iterdata)
+            for attempt in range(retries + 1):
+                failed = []
+                error = None
+                for indices, future, jobs, groups in pending:
+                    outcomes = self._outcomes(future, jobs, groups)
+                    for idx, outcome in zip(indices, outcomes):
+                        if isinstance(outcome, Exception):
+                            failed.append(idx)
+                            error = outcome
+                        else:
+                            results[idx] = outcome
+
+                if not failed:
+                    return results
+
+                if attempt == retries:
+                    raise error
+
+                knot = self.fastest_knot()
+                mod_logger.info(
+                    'Retrying {n:d} elements with knot {name:s}'.format(
+                        n=len(failed), name=knot.name
+                    )
+                )
+                pending[:] = [self._submit_shard(knot, iterdata, failed,
+                                                 job_type, map_kwargs)]
+
+        executor = ThreadPoolExecutor(1)
+        future = executor.submit(collect)
+
+        # Shutdown the executor but do not wait to return the future
+        executor.shutdown(wait=False)
+
+        return future
+
+
+@registered
+def map_knots(knots, iterdata, weights=None, **map_kwargs):
+    """Shard one map across several knots and merge the results
+
+    This is shorthand for ``KnotGroup(knots, weights).map(iterdata)``. Each
+    knot receives a contiguous shard of `iterdata` and submits its batch
+    jobs with its own profile and region, so that one input can be
+    processed, e.g., with spot capacity in several regions at the same time.
+    To create knots in other regions, use aws.session_context::
+
+        knots = []
+        for region in ['us-east-1', 'us-west-2']:
+            with cloudknot.aws.session_context(region=region):
+                knots.append(cloudknot.Knot(name='sim-' + region, func=sim))
+
+        future = cloudknot.map_knots(knots, range(1000))
+
+    Parameters
+    ----------
+    knots : sequence of Knot
+        The knots across which to shard `iterdata`. They must share the same
+        docker image.
+
+    iterdata : iterable
+        An iterable of input data
+
+    weights : sequence of positive numbers
+        Relative share of `iterdata` for each knot, e.g. the knots' max_vcpus
+        Default: None means in proportion to the knots' free vCPUs
+
+    Additional keyword arguments are passed to KnotGroup.map.
+
+    Returns
+    -------
+    future : future
+        A future for the list of results, in the order of `iterdata`
+    """
+    return KnotGroup(knots, weights=weights).map(iterdata, **map_kwargs)
@@ -1,25 +1,25 @@
 from __future__ import absolute_import, division, print_function
 
-import docker
 import logging
 import os
 import six
 import subprocess
-from awscli.customizations.configure.configure import InteractivePrompter
 
 from .base import Base
 from ..aws import DockerRepo, get_profile, get_region, get_ecr_repo, \
     set_profile, set_region, set_ecr_repo
 from ..config import add_resource
+from ..dockerimage import _docker_client
 
 module_logger = logging.getLogger(__name__)
 
 
 def pull_and_push_base_images(region, profile, ecr_repo):
     # Use docker low-level APIClient for tagging
-    c = docker.from_env().api
+    client = _docker_client()
+    c = client.api
     # And the image client for pulling and pushing
-    cli = docker.from_env().images
+    cli = client.images
 
     # Build the python base image so that later build commands are faster
     v = '3' if six.PY3 else '2'
@@ -90,6 +90,9 @@ class Configure(Base):
             ),
         ]
 
+        from awscli.customizations.configure.configure import \
+            InteractivePrompter
+
         values = {}
         for config_name, prompt_text, getter, setter in values_to_prompt:
             prompter = InteractivePrompter()
@@ -7,15 +7,43 @@ verifying the section headers.
 Ideally, the cloudknot user should never have to use these functions to
 interact with the cloudknot config file. Each cloudknot object maintains
 references to its state in the config file.
+
+Several threads and processes, e.g. several notebooks or submitter
+processes, may use the same config file. Every read-modify-write of the
+config file must therefore hold `rlock`, which serializes access across
+threads and, through an advisory lock on '<config file>.lock', across
+processes. `write_config` replaces the config file atomically, so readers
+never see a partially written file. Frequent lookups, e.g. of the region
+and profile, use `read_config`, which only parses the config file again
+after it changed.
+
+The config file holds settings and long-lived resources, which users may
+edit by hand. The bookkeeping of batch jobs, which grows with every
+submission, lives in an indexed SQLite database next to the config file
+instead (see `get_state_file`), so that submitting a job does not rewrite
+the config file. Batch jobs recorded in config files written by earlier
+versions of cloudknot are migrated to the database automatically.
 """
 from __future__ import absolute_import, division, print_function
 
+import atexit
 import configparser
 import errno
 import logging
 import os
+import shutil
+import sqlite3
+import tempfile
+import threading
 from threading import RLock
 
+try:
+    import fcntl
+except ImportError:  # pragma: nocover
+    # Windows
+    fcntl = None
+    import msvcrt
+
 __all__ = ["rlock"]
 
 
@@ -25,7 +53,150 @@ def registered(fn):
 
 
 mod_logger = logging.getLogger(__name__)
-rlock = RLock()
+
+# os.replace is atomic on all platforms, but python 2 only has os.rename,
+# which is atomic on POSIX
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _config_file_path():
+    """Return the path to the cloudknot config file without creating it"""
+    try:
+        # Get config file from environment variable
+        env_file = os.environ['CLOUDKNOT_CONFIG_FILE']
+        return os.path.abspath(env_file)
+    except KeyError:
+        # Fallback on default config file path
+        home = os.path.expanduser('~')
+        return os.path.join(home, '.aws', 'cloudknot')
+
+
+def _makedirs(path):
+    """Create directory `path` and its parents unless it already exists"""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        pre_existing = (e.errno == errno.EEXIST and os.path.isdir(path))
+        if not pre_existing:
+            raise e
+
+
+def _lock_file(f):
+    """Block until this process holds an exclusive lock on open file `f`"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:  # pragma: nocover
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except (IOError, OSError):
+                # LK_LOCK gives up after ten seconds, so keep trying
+                pass
+
+
+def _unlock_file(f):
+    """Release the lock on open file `f`"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:  # pragma: nocover
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ConfigLock(object):
+    """Reentrant lock on the cloudknot config file
+
+    The lock serializes access to the config file across the threads of
+    this process with a reentrant thread lock, and across processes with an
+    OS-level advisory lock on the file '<config file>.lock', which is held
+    while any thread of this process holds the lock. Use it as a context
+    manager.
+    """
+    def __init__(self):
+        self._rlock = RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self):
+        """Block until the calling thread holds the lock"""
+        self._rlock.acquire()
+
+        if self._depth == 0:
+            try:
+                lock_path = _config_file_path() + '.lock'
+                _makedirs(os.path.dirname(lock_path))
+                f = open(lock_path, 'a+')
+                try:
+                    _lock_file(f)
+                except Exception:
+                    f.close()
+                    raise
+                self._file = f
+            except Exception:
+                self._rlock.release()
+                raise
+
+        self._depth += 1
+        return True
+
+    def release(self):
+        """Release the lock held by the calling thread"""
+        self._depth -= 1
+
+        if self._depth == 0:
+            f, self._file = self._file, None
+            try:
+                _unlock_file(f)
+            finally:
+                f.close()
+
+        self._rlock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+rlock = ConfigLock()
+
+# Connections to the state database, per thread, keyed by process ID and
+# database path, so that a forked process never uses a connection that it
+# inherited from its parent
+_state = threading.local()
+
+# All connections opened by this process and its ancestors, as
+# (process ID, connection), and the (process ID, database path) pairs for
+# which the config file was migrated
+_connections = []
+_migrated = set()
+_connections_lock = RLock()
+
+_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    section TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    name TEXT,
+    PRIMARY KEY (section, job_id)
+);
+CREATE TABLE IF NOT EXISTS knot_jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    knot TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    UNIQUE (knot, job_id)
+);
+CREATE INDEX IF NOT EXISTS knot_jobs_by_knot ON knot_jobs (knot, seq);
+"""
+
+# Config file paths that this process already found or created
+_known_config_files = set()
+
+# The most recently parsed config file and the stat key it was parsed at
+_config_cache_lock = RLock()
+_config_cache = {'path': None, 'key': None, 'config': None}
 
 
 @registered
@@ -41,28 +212,15 @@ def get_config_file():
     config_file : string
         Path to cloudknot config file
     """
-    try:
-        # Get config file from environment variable
-        env_file = os.environ['CLOUDKNOT_CONFIG_FILE']
-        config_file = os.path.abspath(env_file)
-    except KeyError:
-        # Fallback on default config file path
-        home = os.path.expanduser('~')
-        config_file = os.path.join(home, '.aws', 'cloudknot')
+    config_file = _config_file_path()
+
+    if config_file in _known_config_files:
+        return config_file
 
     with rlock:
         if not os.path.isfile(config_file):
             # If the config directory does not exist, create it
-            configdir = os.path.dirname(config_file)
-            try:
-                os.makedirs(configdir)
-            except OSError as e:
-                pre_existing = (e.errno == errno.EEXIST
-                                and os.path.isdir(configdir))
-                if pre_existing:
-                    pass
-                else:
-                    raise e
+            _makedirs(os.path.dirname(config_file))
 
             # If the config file does not exist, create it
             with open(config_file, 'w') as f:
@@ -74,6 +232,8 @@ def get_config_file():
                 )
             )
 
+    _known_config_files.add(config_file)
+
     mod_logger.debug('Using cloudknot config file {path:s}'.format(
         path=config_file
     ))
@@ -81,6 +241,123 @@ def get_config_file():
     return config_file
 
 
+def _stat_key(path):
+    """Return a key that changes whenever the file at `path` changes
+
+    write_config replaces the file, which changes its inode, so the key
+    changes even if the modification time is too coarse to tell two writes
+    apart.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime)
+
+
+@registered
+def read_config(config_file=None):
+    """Return the parsed cloudknot config file
+
+    The parsed config is cached and only parsed again after the config file
+    changed, as detected by its inode, size, and modification time, or after
+    `invalidate_config_cache` was called. Do not modify the returned config.
+    To change the config file, read it into a new ConfigParser while holding
+    `rlock` and save it with `write_config`.
+
+    Parameters
+    ----------
+    config_file : string
+        Path to the config file
+        Default: None means use get_config_file()
+
+    Returns
+    -------
+    config : configparser.ConfigParser
+        The parsed config file
+    """
+    if config_file is None:
+        config_file = get_config_file()
+
+    key = _stat_key(config_file)
+
+    with _config_cache_lock:
+        if (key is not None and _config_cache['path'] == config_file
+                and _config_cache['key'] == key):
+            return _config_cache['config']
+
+    # Stat before reading, so that a concurrent change is detected by the
+    # next call at the latest
+    config = configparser.ConfigParser()
+    config.read(config_file)
+
+    with _config_cache_lock:
+        _config_cache.update(path=config_file, key=key, config=config)
+
+    return config
+
+
+@registered
+def invalidate_config_cache():
+    """Make the next call to `read_config` parse the config file again"""
+    with _config_cache_lock:
+        _config_cache.update(path=None, key=None, config=None)
+
+
+@registered
+def write_config(config, config_file=None):
+    """Atomically replace the cloudknot config file
+
+    The config is written to a temporary file in the same directory, which
+    then replaces the config file, so that other processes never read a
+    partially written config file. Callers should hold `rlock` from reading
+    the config file until after writing it. Writing invalidates the cache of
+    `read_config`, so the set_* functions of cloudknot take effect
+    immediately.
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        The config to write
+
+    config_file : string
+        Path to the config file
+        Default: None means use get_config_file()
+    """
+    if config_file is None:
+        config_file = get_config_file()
+
+    # get_config_file does not check again whether the directory exists
+    _makedirs(os.path.dirname(config_file))
+
+    fd, tmp_file = tempfile.mkstemp(
+        dir=os.path.dirname(config_file),
+        prefix='.' + os.path.basename(config_file) + '-',
+        suffix='.tmp'
+    )
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            config.write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # mkstemp creates files that only the owner can read
+        if os.path.isfile(config_file):
+            shutil.copymode(config_file, tmp_file)
+
+        _replace(tmp_file, config_file)
+    except Exception:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+    finally:
+        invalidate_config_cache()
+
+
 @registered
 def add_resource(section, option, value):
     """Add a resource to the cloudknot config file
@@ -104,8 +381,7 @@ def add_resource(section, option, value):
         if section not in config.sections():
             config.add_section(section)
         config.set(section=section, option=option, value=value)
-        with open(config_file, 'w') as f:
-            config.write(f)
+        write_config(config, config_file)
 
 
 @registered
@@ -129,8 +405,7 @@ def remove_resource(section, option):
             config.remove_option(section, option)
         except configparser.NoSectionError:
             pass
-        with open(config_file, 'w') as f:
-            config.write(f)
+        write_config(config, config_file)
 
 
 @registered
@@ -157,5 +432,222 @@ def verify_sections():
             if not section_approved(section):
                 config.remove_section(section)
 
-        with open(config_file, 'w') as f:
-            config.write(f)
+        write_config(config, config_file)
+
+
+@registered
+def get_state_file():
+    """Get the path to the cloudknot state database
+
+    The SQLite database that records batch jobs lives next to the cloudknot
+    config file, at '<config file>.db'.
+
+    Returns
+    -------
+    state_file : string
+        Path to the cloudknot state database
+    """
+    return get_config_file() + '.db'
+
+
+def _connect():
+    """Return this thread's connection to the state database
+
+    On the first connection of each process, the database is created if
+    necessary and batch jobs recorded in the config file are migrated into
+    it.
+    """
+    state_file = get_state_file()
+    key = (os.getpid(), state_file)
+
+    connections = getattr(_state, 'connections', None)
+    if connections is None:
+        connections = _state.connections = {}
+
+    if key not in connections:
+        # Connections are only used by the thread that opened them, but
+        # are closed by the main thread on exit
+        connection = sqlite3.connect(state_file, timeout=60,
+                                     check_same_thread=False)
+        # Write-ahead logging lets readers proceed while another process
+        # writes
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(_STATE_SCHEMA)
+
+        with rlock:
+            if key not in _migrated:
+                _migrate_config(connection)
+                _migrated.add(key)
+
+        with _connections_lock:
+            # Connections inherited from a parent process stay referenced,
+            # so that they are neither used nor closed in this process
+            _connections.append((key[0], connection))
+
+        connections[key] = connection
+
+    return connections[key]
+
+
+@atexit.register
+def _close_connections():
+    """Close the connections that this process opened"""
+    pid = os.getpid()
+    with _connections_lock:
+        for owner, connection in _connections:
+            if owner == pid:
+                try:
+                    connection.close()
+                except sqlite3.Error:  # pragma: nocover
+                    pass
+
+
+def _migrate_config(connection):
+    """Move batch jobs recorded in the config file to the state database
+
+    Earlier versions of cloudknot recorded batch jobs in 'batch-jobs'
+    sections and in the 'job_ids' options of 'knot' sections of the config
+    file.
+    """
+    config_file = get_config_file()
+    config = configparser.ConfigParser()
+
+    with rlock:
+        config.read(config_file)
+
+        jobs = []
+        knot_jobs = []
+        for section in config.sections():
+            resource_type = section.split(' ', 1)[0]
+            if resource_type == 'batch-jobs':
+                jobs += [(section, job_id, name)
+                         for job_id, name in config.items(section)]
+                config.remove_section(section)
+            elif (resource_type == 'knot'
+                    and config.has_option(section, 'job_ids')):
+                knot_jobs += [(section, job_id) for job_id
+                              in config.get(section, 'job_ids').split()]
+                config.remove_option(section, 'job_ids')
+
+        if not (jobs or knot_jobs):
+            return
+
+        # Commit to the database before removing the jobs from the config
+        # file. Repeating an interrupted migration inserts nothing twice.
+        with connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO batch_jobs (section, job_id, name) '
+                'VALUES (?, ?, ?)', jobs
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO knot_jobs (knot, job_id) '
+                'VALUES (?, ?)', knot_jobs
+            )
+
+        write_config(config, config_file)
+
+    mod_logger.info(
+        'Migrated {n:d} batch jobs from {config:s} to {state:s}'.format(
+            n=len(jobs) + len(knot_jobs), config=config_file,
+            state=get_state_file()
+        )
+    )
+
+
+@registered
+def add_job(section, job_id, name):
+    """Record a batch job in the state database
+
+    Parameters
+    ----------
+    section : string
+        Section of the batch job, e.g. 'batch-jobs <profile> <region>'
+
+    job_id : string
+        AWS jobID of the batch job
+
+    name : string
+        Name of the batch job
+    """
+    connection = _connect()
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO batch_jobs (section, job_id, name) '
+            'VALUES (?, ?, ?)', (section, job_id, name)
+        )
+
+
+@registered
+def remove_job(section, job_id):
+    """Remove a batch job from the state database
+
+    Parameters
+    ----------
+    section : string
+        Section of the batch job
+
+    job_id : string
+        AWS jobID of the batch job
+    """
+    connection = _connect()
+    with connection:
+        connection.execute(
+            'DELETE FROM batch_jobs WHERE section = ? AND job_id = ?',
+            (section, job_id)
+        )
+
+
+@registered
+def add_knot_job_ids(knot, job_ids):
+    """Record batch jobs submitted by a knot, in one transaction
+
+    Job IDs that were already recorded for the knot are ignored.
+
+    Parameters
+    ----------
+    knot : string
+        Config section of the knot, i.e. 'knot <name>'
+
+    job_ids : sequence of strings
+        AWS jobIDs of the batch jobs, in order of submission
+    """
+    connection = _connect()
+    with connection:
+        connection.executemany(
+            'INSERT OR IGNORE INTO knot_jobs (knot, job_id) VALUES (?, ?)',
+            [(knot, job_id) for job_id in job_ids]
+        )
+
+
+@registered
+def get_knot_job_ids(knot):
+    """Return the IDs of the batch jobs submitted by a knot
+
+    Parameters
+    ----------
+    knot : string
+        Config section of the knot, i.e. 'knot <name>'
+
+    Returns
+    -------
+    job_ids : list of strings
+        AWS jobIDs of the batch jobs, in order of submission
+    """
+    cursor = _connect().execute(
+        'SELECT job_id FROM knot_jobs WHERE knot = ? ORDER BY seq', (knot,)
+    )
+    return [row[0] for row in cursor]
+
+
+@registered
+def remove_knot_job_ids(knot):
+    """Forget the batch jobs submitted by a knot
+
+    Parameters
+    ----------
+    knot : string
+        Config section of the knot, i.e. 'knot <name>'
+    """
+    connection = _connect()
+    with connection:
+        connection.execute('DELETE FROM knot_jobs WHERE knot = ?', (knot,))
@@ -1,7 +1,6 @@
 from __future__ import absolute_import, division, print_function
 
 import configparser
-import docker
 import inspect
 import logging
 import os
@@ -9,15 +8,15 @@ import re
 import six
 import subprocess
 import tempfile
-from pipreqs import pipreqs
 from string import Template
+from threading import Lock
 
 from . import aws
 from . import config as ckconfig
 from .aws.base_classes import get_region, get_profile, \
     ResourceDoesNotExistException, ResourceClobberedException, \
     CloudknotInputError, CloudknotConfigurationError
-from .config import get_config_file, rlock
+from .config import get_config_file, rlock, write_config
 
 __all__ = []
 
@@ -29,6 +28,38 @@ def registered(fn):
 
 mod_logger = logging.getLogger(__name__)
 
+_docker_lock = Lock()
+_docker_running = []
+
+
+def _docker_client():
+    """Return a docker client, checking on first use that Docker is running
+
+    Docker is only needed to build and push images, so neither importing
+    cloudknot nor submitting jobs requires it.
+    """
+    import docker
+
+    with _docker_lock:
+        if not _docker_running:
+            try:
+                with open(os.devnull, 'w') as fnull:
+                    subprocess.check_call('docker version', shell=True,
+                                          stdout=fnull,
+                                          stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError:
+                raise CloudknotConfigurationError(
+                    "It looks like you don't have Docker installed or "
+                    "running. Please go to "
+                    "https://docs.docker.com/engine/installation/ to install "
+                    "it. Once installed, make sure that the Docker daemon is "
+                    "running before using cloudknot."
+                )
+
+            _docker_running.append(True)
+
+    return docker.from_env()
+
 
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 @registered
@@ -277,6 +308,7 @@ class DockerImage(aws.NamedObject):
             self._set_imports()
 
             # Write the requirements.txt file and Dockerfile
+            from pipreqs import pipreqs
             pipreqs.generate_requirements_file(self.req_path, self.pip_imports)
 
             self._write_dockerfile()
@@ -381,11 +413,25 @@ class DockerImage(aws.NamedObject):
                 'script.template'
             ))
 
+            # cloudknot is not installed in the container, so inject the
+            # source of the modules that the container uses
+            module_sources = {}
+            for module in ['checkpoint', 'taskqueue']:
+                module_path = os.path.abspath(os.path.join(
+                    os.path.dirname(__file__), module + '.py'
+                ))
+
+                with open(module_path, 'r') as module_file:
+                    module_sources[module + '_source'] = repr(
+                        module_file.read()
+                    )
+
             with open(template_path, 'r') as template:
                 s = Template(template.read())
                 f.write(s.substitute(
                     func_source=inspect.getsource(self.func),
-                    func_name=self.func.__name__
+                    func_name=self.func.__name__,
+                    **module_sources
                 ))
 
         mod_logger.info(
@@ -428,11 +474,18 @@ class DockerImage(aws.NamedObject):
 
     def _set_imports(self):
         """Set required imports for the python script at self.script_path"""
+        from pipreqs import pipreqs
+
         # Get the names of packages imported in the script
         import_names = pipreqs.get_all_imports(os.path.dirname(
             self.script_path
         ))
 
+        if self._clobber_script:
+            # The script that cloudknot wrote provides the cloudknot modules
+            # that the function may import, e.g. cloudknot.checkpoint
+            import_names = [n for n in import_names if n != 'cloudknot']
+
         # Of those names, store that ones that are available via pip
         self._pip_imports = pipreqs.get_imports_info(import_names)
 
@@ -488,7 +541,7 @@ class DockerImage(aws.NamedObject):
         self._images += [im for im in images if im not in self.images]
 
         # Use docker low-level APIClient
-        c = docker.from_env()
+        c = _docker_client()
         for im in images:
             mod_logger.info('Building image {name:s} with tag {tag:s}'.format(
                 name=im['name'], tag=im['tag']
@@ -601,9 +654,10 @@ class DockerImage(aws.NamedObject):
             self._repo_uri = repo_uri
 
         # Use docker low-level APIClient for tagging
-        c = docker.from_env().api
+        client = _docker_client()
+        c = client.api
         # And the image client for pushing
-        cli = docker.from_env().images
+        cli = client.images
         for im in self.images:
             # Log tagging info
             mod_logger.info('Tagging image {name:s} with tag {tag:s}'.format(
@@ -658,7 +712,7 @@ class DockerImage(aws.NamedObject):
             # that we shouldn't mess with.
             pass
 
-        cli = docker.from_env().images
+        cli = _docker_client().images
         # Get local images first (lol stands for list_of_lists
         local_image_lol = [im.tags for im in cli.list()]
         # Flatten the list of lists
@@ -692,8 +746,7 @@ class DockerImage(aws.NamedObject):
         with rlock:
             config.read(config_file)
             config.remove_section('docker-image ' + self.name)
-            with open(config_file, 'w') as f:
-                config.write(f)
+            write_config(config, config_file)
 
         self._clobbered = True
 
@@ -0,0 +1,318 @@
+"""Task queues from which worker-pool batch jobs claim work items
+
+In worker-pool mode (see `Knot.map`), each child of an array job is a
+long-lived worker that repeatedly claims the index of an unprocessed item
+from a shared task queue and processes it, until no unclaimed items remain.
+Claims are atomic, so that each item is claimed by exactly one worker.
+
+The items are ranked, e.g. by decreasing estimated cost, and dealt
+round-robin into one slice per worker, so that each slice starts with its
+share of the most expensive items. Each worker claims the items of its own
+slice from the front. Once its slice is exhausted, it steals the remaining
+items of the other workers' slices from the back, i.e. the cheapest ones
+first, so that fast workers keep pulling work until everything is done
+while rarely contending with the owners of the slices. A worker that is
+restarted, e.g. after a spot instance interruption, first recovers the items
+that it had already claimed.
+
+The cloudknot script template injects this module into the batch job
+container, so that it must depend only on the standard library and on
+boto3.
+"""
+from __future__ import absolute_import, division, print_function
+
+import abc
+import errno
+import os
+
+__all__ = ['TaskQueue', 'S3TaskQueue', 'LocalTaskQueue']
+
+
+# Python 2 and 3 compatible abstract base class, without depending on six
+class TaskQueue(abc.ABCMeta('ABC', (object,), {})):
+    """Base class for queues of item indices that workers claim atomically
+
+    Subclasses implement `_try_claim`, `claimed_by`, and `claimed`.
+    """
+    def __init__(self, n_tasks, ranking=None):
+        """Initialize a TaskQueue instance
+
+        Parameters
+        ----------
+        n_tasks : int
+            Number of items in the queue. Items are identified by their
+            indices in range(n_tasks).
+
+        ranking : sequence of ints
+            Item indices in the order in which they should be processed,
+            e.g. sorted by decreasing estimated cost
+            Default: None means in order of their indices
+        """
+        self._n_tasks = int(n_tasks)
+
+        if ranking is None:
+            self._ranking = list(range(self._n_tasks))
+        else:
+            self._ranking = [int(t) for t in ranking]
+            if sorted(self._ranking) != list(range(self._n_tasks)):
+                raise ValueError('ranking must be a permutation of '
+                                 'range(n_tasks)')
+
+    @property
+    def n_tasks(self):
+        """Number of items in the queue"""
+        return self._n_tasks
+
+    @property
+    def ranking(self):
+        """Item indices in the order in which they should be processed"""
+        return self._ranking
+
+    @abc.abstractmethod
+    def _try_claim(self, task, worker):
+        """Atomically claim item `task` for `worker`
+
+        Returns
+        -------
+        claimed : bool
+            True if `worker` claimed the item, False if it was already
+            claimed
+        """
+
+    @abc.abstractmethod
+    def claimed_by(self, worker):
+        """Return the sorted list of items claimed by `worker`"""
+
+    @abc.abstractmethod
+    def claimed(self):
+        """Return the set of items claimed by any worker
+
+        This reads all claim markers at once, which is much cheaper than
+        trying to claim each item that was already claimed.
+        """
+
+    def order(self, worker, n_workers):
+        """Return the order in which `worker` tries to claim items
+
+        Each worker first tries its own round-robin slice of the ranked
+        items, from the front, and then steals from the back of the other
+        workers' slices, visiting the following workers in turn.
+
+        Parameters
+        ----------
+        worker : int
+            Index of the worker
+
+        n_workers : int
+            Total number of workers
+        """
+        slices = [self.ranking[w::n_workers] for w in range(n_workers)]
+        victims = [slices[(worker + k) % n_workers]
+                   for k in range(1, n_workers)]
+
+        stolen = []
+        for depth in range(max([len(v) for v in victims] + [0])):
+            stolen += [v[-1 - depth] for v in victims if depth < len(v)]
+
+        return slices[worker] + stolen
+
+    def claims(self, worker, n_workers):
+        """Generate the items that `worker` claims, until none are left
+
+        When a claim fails, and before it starts stealing, the worker reads
+        all claim markers (see `claimed`) and skips the items that other
+        workers already claimed, so that a pass over the queue costs one
+        claim attempt per item plus one for each lost race, instead of one
+        per item and worker.
+
+        Parameters
+        ----------
+        worker : int
+            Index of the worker
+
+        n_workers : int
+            Total number of workers
+        """
+        n_own = len(self.ranking[worker::n_workers])
+
+        claimed = set()
+        for position, task in enumerate(self.order(worker, n_workers)):
+            if position == n_own:
+                # The owners have claimed the fronts of their slices and
+                # other thieves may have claimed their backs, so look up
+                # the claims before stealing from them
+                claimed = self.claimed()
+
+            if task in claimed:
+                continue
+
+            if self._try_claim(task, worker):
+                yield task
+            else:
+                # Another worker claimed the item. Look up all claims
+                # instead of discovering them one failed claim at a time.
+                claimed = self.claimed()
+
+
+class S3TaskQueue(TaskQueue):
+    """Task queue with claim markers in S3
+
+    A worker claims an item by creating the object '<prefix>claims/<item>'
+    with a conditional write that fails if the object already exists. It
+    then records the claim in '<prefix>workers/<worker>/<item>', so that it
+    can recover its claims after a restart.
+    """
+    def __init__(self, n_tasks, bucket, prefix, ranking=None, sse=None,
+                 client=None):
+        """Initialize an S3TaskQueue instance
+
+        Parameters
+        ----------
+        n_tasks : int
+            Number of items in the queue
+
+        bucket : string
+            Name of the S3 bucket for the claim markers
+
+        prefix : string
+            Key prefix for the claim markers
+
+        ranking : sequence of ints
+            Item indices in the order in which they should be processed
+            Default: None means in order of their indices
+
+        sse : string
+            S3 server side encryption method, one of ['AES256', 'aws:kms']
+            Default: None
+
+        client : boto3 S3 client
+            Default: None means create a new client
+        """
+        super(S3TaskQueue, self).__init__(n_tasks=n_tasks, ranking=ranking)
+
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+
+        self._s3 = client
+        self._bucket = bucket
+        self._prefix = prefix
+        self._put_kwargs = {'ServerSideEncryption': sse} if sse else {}
+
+    def _try_claim(self, task, worker):
+        try:
+            self._s3.put_object(
+                Bucket=self._bucket,
+                Key='{p:s}claims/{t:d}'.format(p=self._prefix, t=task),
+                Body=str(worker).encode('utf-8'),
+                IfNoneMatch='*',
+                **self._put_kwargs
+            )
+        except self._s3.exceptions.ClientError as e:
+            # A concurrent or previous claim won
+            if e.response['Error']['Code'] in ['PreconditionFailed',
+                                               'ConditionalRequestConflict']:
+                return False
+            raise
+
+        self._s3.put_object(
+            Bucket=self._bucket,
+            Key='{p:s}workers/{w:d}/{t:d}'.format(
+                p=self._prefix, w=worker, t=task
+            ),
+            Body=b'',
+            **self._put_kwargs
+        )
+
+        return True
+
+    def claimed_by(self, worker):
+        prefix = '{p:s}workers/{w:d}/'.format(p=self._prefix, w=worker)
+        paginator = self._s3.get_paginator('list_objects_v2')
+
+        tasks = []
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix):
+            tasks += [int(o['Key'][len(prefix):])
+                      for o in page.get('Contents', [])]
+
+        return sorted(tasks)
+
+    def claimed(self):
+        prefix = '{p:s}claims/'.format(p=self._prefix)
+        paginator = self._s3.get_paginator('list_objects_v2')
+
+        tasks = set()
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix):
+            tasks.update(int(o['Key'][len(prefix):])
+                         for o in page.get('Contents', []))
+
+        return tasks
+
+
+class LocalTaskQueue(TaskQueue):
+    """Task queue with claim marker files in a local directory
+
+    This is a stand-in for S3TaskQueue when running workers locally, e.g. in
+    tests. Claims are atomic across threads and processes that share the
+    directory.
+    """
+    def __init__(self, n_tasks, directory, ranking=None):
+        """Initialize a LocalTaskQueue instance
+
+        Parameters
+        ----------
+        n_tasks : int
+            Number of items in the queue
+
+        directory : string
+            Directory for the claim marker files
+
+        ranking : sequence of ints
+            Item indices in the order in which they should be processed
+            Default: None means in order of their indices
+        """
+        super(LocalTaskQueue, self).__init__(n_tasks=n_tasks,
+                                             ranking=ranking)
+        self._directory = directory
+
+        for subdir in ['claims', 'workers']:
+            path = os.path.join(directory, subdir)
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST or not os.path.isdir(path):
+                    raise
+
+    def _try_claim(self, task, worker):
+        path = os.path.join(self._directory, 'claims', str(task))
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+
+        os.write(fd, str(worker).encode('utf-8'))
+        os.close(fd)
+
+        worker_dir = os.path.join(self._directory, 'workers', str(worker))
+        try:
+            os.makedirs(worker_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST or not os.path.isdir(worker_dir):
+                raise
+
+        open(os.path.join(worker_dir, str(task)), 'w').close()
+
+        return True
+
+    def claimed_by(self, worker):
+        worker_dir = os.path.join(self._directory, 'workers', str(worker))
+        if not os.path.isdir(worker_dir):
+            return []
+
+        return sorted(int(t) for t in os.listdir(worker_dir))
+
+    def claimed(self):
+        claims_dir = os.path.join(self._directory, 'claims')
+        return set(int(t) for t in os.listdir(claims_dir))
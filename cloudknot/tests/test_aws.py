@@ -23,16 +23,21 @@ The tests for each resource all follow the same pattern:
 """
 from __future__ import absolute_import, division, print_function
 
+import botocore.exceptions
 import cloudknot as ck
 import configparser
 import errno
+import io
+import json
 import os
 import os.path as op
+import pickle
 import pytest
 import shutil
 import tempfile
 import tenacity
 import uuid
+from collections import namedtuple
 
 UNIT_TEST_PREFIX = 'cloudknot-unit-test'
 data_path = op.join(ck.__path__[0], 'data')
@@ -133,6 +138,476 @@ def pars(bucket_cleanup):
     p.clobber()
 
 
+def test_client_registry():
+    registry = ck.aws.base_classes._ClientRegistry()
+
+    # Clients are long-lived and shared
+    s3 = registry.client('s3', None, 'us-east-1')
+    assert registry.client('s3', None, 'us-east-1') is s3
+    assert s3.meta.config.max_pool_connections == 10
+
+    # Requesting more concurrency replaces the client for later callers
+    big = registry.client('s3', None, 'us-east-1', max_pool=32)
+    assert big is not s3
+    assert big.meta.config.max_pool_connections == 32
+
+    # The pool never shrinks
+    assert registry.client('s3', None, 'us-east-1', max_pool=4) is big
+    assert registry.pool(None, 'us-east-1') == 32
+
+    # Each region has its own clients and pool
+    west = registry.client('s3', None, 'us-west-2')
+    assert west.meta.region_name == 'us-west-2'
+    assert west.meta.config.max_pool_connections == 10
+
+
+def test_session_context():
+    region = ck.get_region()
+    other = 'eu-west-1' if region != 'eu-west-1' else 'eu-west-2'
+
+    with ck.aws.session_context(region=other):
+        assert ck.get_region() == other
+        assert ck.aws.clients['s3'].meta.region_name == other
+
+    # The config file and the module-level clients are unchanged
+    assert ck.get_region() == region
+    assert ck.aws.clients['s3'].meta.region_name == region
+
+
+StubJobDefinition = namedtuple('StubJobDefinition', ['name', 'output_bucket'])
+
+
+class StubS3(object):
+    """In-memory stand-in for the parts of a boto3 S3 client used by
+    BatchJob, which lists at most `page_size` keys per page"""
+    def __init__(self, objects, page_size=1000):
+        self.objects = dict(objects)
+        self.uploads = []
+        self.page_size = page_size
+
+    def get_paginator(self, operation):
+        return self
+
+    def _contents(self, Prefix):
+        return [{'Key': k, 'Size': len(self.objects[k])}
+                for k in sorted(self.objects) if k.startswith(Prefix)]
+
+    def paginate(self, Bucket, Prefix):
+        contents = self._contents(Prefix)
+        for start in range(0, max(len(contents), 1), self.page_size):
+            yield {'Contents': contents[start:start + self.page_size]}
+
+    def list_objects_v2(self, Bucket, Prefix):
+        return {'Contents': self._contents(Prefix)[:self.page_size]}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    exceptions = botocore.exceptions
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': '404'}}, 'HeadObject'
+            )
+        return {'ContentLength': len(self.objects[Key])}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        self.uploads.append(Key)
+        with open(Filename, 'rb') as f:
+            self.objects[Key] = f.read()
+
+
+class StubBatch(object):
+    """In-memory stand-in for the parts of a boto3 Batch client used by
+    BatchJob"""
+    def __init__(self):
+        # Maps array job IDs to dicts that map statuses to child indices
+        self.children = {}
+        self.terminated = []
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, arrayJobId, jobStatus):
+        indices = self.children.get(arrayJobId, {}).get(jobStatus, ())
+        yield {'jobSummaryList': [
+            {'jobId': '{id:s}:{idx:d}'.format(id=arrayJobId, idx=idx)}
+            for idx in sorted(indices)
+        ]}
+
+    def terminate_job(self, jobId, reason):
+        self.terminated.append(jobId)
+
+
+class StubBatchJob(ck.aws.BatchJob):
+    """BatchJob with the given attributes that never calls AWS"""
+    clients = None
+
+    def __init__(self, objects=(), clients=None, **attrs):
+        self.clients = clients or {'s3': StubS3(objects),
+                                   'batch': StubBatch()}
+        self._name = 'job'
+        self._status = 'RUNNING'
+        self._job_id = 'job-id'
+        self._job_definition = StubJobDefinition(name='jobdef',
+                                                 output_bucket='bucket')
+        self._input = []
+        self._array_job = True
+        self._gather = False
+        self._sink = None
+        self._retry_of = None
+        self._workers = None
+        self._chunksize = None
+        self._speculations = []
+        self._resubmissions = []
+        for key, value in attrs.items():
+            setattr(self, '_' + key, value)
+
+    @property
+    def status(self):
+        children = self.clients['batch'].children.get(self.job_id, {})
+        return {'status': self._status, 'arrayProperties': {
+            'statusSummary': dict((s, len(c)) for s, c in children.items())
+        }}
+
+
+def test_split_s3_url():
+    split = ck.aws.split_s3_url
+    assert split('s3://bucket/data/a.csv') == ('bucket', 'data/a.csv')
+    assert split('s3://bucket/data/') == ('bucket', 'data/')
+
+    # URLs without a key have an empty prefix
+    assert split('s3://bucket') == ('bucket', '')
+    assert split('s3://bucket/') == ('bucket', '')
+
+    # Assert ck.aws.CloudknotInputError on URLs without a bucket or scheme
+    for url in ['s3://', 's3:///data', 'bucket/data', 'https://bucket/data']:
+        with pytest.raises(ck.aws.CloudknotInputError):
+            split(url)
+
+
+def test_list_s3_objects(monkeypatch):
+    s3 = StubS3({'data/b.csv': b'12', 'data/a.csv': b'1', 'data/sub/': b'',
+                 'other/c.csv': b'123'})
+    monkeypatch.setattr(ck.aws.s3, 'clients', {'s3': s3})
+
+    # Directory placeholders are skipped and objects are sorted by key
+    expected = [
+        ck.aws.s3.S3Object(bucket='bucket', key='data/a.csv', size=1),
+        ck.aws.s3.S3Object(bucket='bucket', key='data/b.csv', size=2),
+    ]
+    assert ck.aws.list_s3_objects('bucket', 'data/') == expected
+
+    # A client passed by the caller is used instead of the session's client
+    monkeypatch.setattr(ck.aws.s3, 'clients', {'s3': StubS3({})})
+    assert ck.aws.list_s3_objects('bucket', 'data/', client=s3) == expected
+
+
+def test_shard_by_size():
+    def objects(*sizes):
+        return [ck.aws.s3.S3Object(bucket='bucket', key=str(i), size=size)
+                for i, size in enumerate(sizes)]
+
+    def totals(shards):
+        return sorted(sum(o.size for o in shard) for shard in shards)
+
+    # Large objects are spread first and small ones fill up the gaps
+    shards = ck.aws.shard_by_size(objects(8, 1, 5, 4, 1, 3), n_shards=2)
+    assert totals(shards) == [11, 11]
+    assert sorted(o.key for s in shards for o in s) == list('012345')
+
+    # Objects within each shard are sorted by key
+    assert all([o.key for o in s] == sorted(o.key for o in s)
+               for s in shards)
+
+    # There are never more shards than objects and no empty shards
+    assert totals(ck.aws.shard_by_size(objects(2, 1), n_shards=4)) == [1, 2]
+    assert ck.aws.shard_by_size([], n_shards=4) == []
+
+    # Assert ck.aws.CloudknotInputError on invalid number of shards
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.aws.shard_by_size(objects(1), n_shards=0)
+
+
+def test_stage_files(monkeypatch):
+    pathlib = pytest.importorskip('pathlib')
+    s3 = StubS3({})
+    session_s3 = StubS3({})
+    monkeypatch.setattr(ck.aws.s3, 'clients', {'s3': session_s3})
+
+    directory = tempfile.mkdtemp()
+    paths = []
+    for name, content in [('a.txt', b'a'), ('b.txt', b'b')]:
+        path = pathlib.Path(op.join(directory, name))
+        with open(str(path), 'wb') as f:
+            f.write(content)
+        paths.append(path)
+
+    a, b = paths
+    keys = dict(
+        (p, 'cloudknot.staging/{digest:s}/{name:s}'.format(
+            digest=ck.aws.s3._file_sha256(str(p)), name=p.name
+        )) for p in paths
+    )
+
+    def ref(p):
+        return ck.aws.s3_ref('bucket', keys[p], path=op.join(
+            'cloudknot-staged', keys[p]
+        ))
+
+    # Paths are replaced in nested elements and each file is uploaded once
+    staged = ck.aws.stage_files(
+        [a, {'x': a, 'y': [b]}, (a, 42)], bucket='bucket', client=s3
+    )
+    assert staged == [ref(a), {'x': ref(a), 'y': [ref(b)]}, (ref(a), 42)]
+    assert sorted(s3.uploads) == sorted(keys.values())
+
+    # Files that were already staged are not uploaded again
+    s3.uploads = []
+    assert ck.aws.stage_files(
+        [b, a], bucket='bucket', client=s3
+    ) == [ref(b), ref(a)]
+    assert s3.uploads == []
+
+    # The session's client is used if the caller passes no client
+    ck.aws.stage_files([a], bucket='bucket')
+    assert session_s3.uploads == [keys[a]]
+
+    # Inputs without paths are returned unchanged
+    assert ck.aws.stage_files(iter([1, 'a.txt']), bucket='b') == [1, 'a.txt']
+
+    # Assert ck.aws.CloudknotInputError on paths that are not files
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.aws.stage_files([pathlib.Path(directory)], bucket='bucket')
+
+    shutil.rmtree(directory)
+
+
+def test_sink_references():
+    # Sink options are recovered from the commands of existing jobs
+    command = ['--sink', 's3://bucket/{index}.json', '--sink-format', 'json',
+               '--arrayjob']
+    option = ck.aws.batch._command_option
+    assert option(command, '--sink') == 's3://bucket/{index}.json'
+    assert option(command, '--sink-format') == 'json'
+    assert option(command, '--gather') is None
+    assert option(['--sink'], '--sink') is None
+
+    # The container stores a reference to the sink object as the output
+    prefix = 'cloudknot.jobs/jobdef/job-id/3/000/'
+    job = StubBatchJob(sink='s3://sink/{index}.json', objects={
+        prefix + 'output.pickle': pickle.dumps({'bucket': 'sink',
+                                                'key': '3.json'}),
+        prefix + 'manifest-ok.json': b'{}',
+    })
+    assert job._collect_array_job_result(3) == ck.aws.SinkReference(
+        bucket='sink', key='3.json'
+    )
+
+
+def test_output_ref():
+    job = StubBatchJob(input=['a', 'b', 'c'])
+    ref = {ck.aws.REF_KEY: 'outputs', 'bucket': 'bucket',
+           'jobdef': 'jobdef', 'job_id': 'job-id'}
+
+    # By default, the reference resolves to all outputs of an array job
+    assert job.output_ref() == dict(ref, indices=[0, 1, 2])
+
+    # References to some or one of the elements, e.g. for N_TO_N pipelines
+    assert job.output_ref(indices=range(1, 3)) == dict(ref, indices=[1, 2])
+    assert job.output_ref(index=2) == dict(ref, index=2)
+
+    # Failed elements are only skipped in lists of outputs
+    assert job.output_ref(indices=[0, 1], skip_missing=True) == dict(
+        ref, indices=[0, 1], skip_missing=True
+    )
+    assert job.output_ref(index=1, skip_missing=True) == dict(ref, index=1)
+
+    # The output of a non-array job is stored at index 0
+    job = StubBatchJob(input='a', array_job=False)
+    assert job.output_ref() == dict(ref, index=0)
+
+    # Assert ck.aws.CloudknotInputError on both indices and index
+    with pytest.raises(ck.aws.CloudknotInputError):
+        job.output_ref(indices=[0], index=0)
+
+
+def test_gathered_missing_results():
+    prefix = 'cloudknot.jobs/jobdef/job-id/0/000/'
+    missing = {ck.aws.batch.MISSING_KEY: 1}
+    job = StubBatchJob(array_job=False, gather=True, objects={
+        prefix + 'output.pickle': pickle.dumps([42, missing, None]),
+        prefix + 'manifest-ok.json': b'{}',
+    })
+
+    # The container's markers are replaced with MissingResult namedtuples
+    assert job._collect_array_job_result() == [
+        42, ck.aws.MissingResult(index=1), None
+    ]
+
+
+def test_latest_attempts():
+    prefix = 'cloudknot.jobs/jobdef/job-id/'
+    job = StubBatchJob(objects=dict((prefix + key, b'') for key in [
+        # Element 0 failed and then succeeded on retry
+        '0/000/manifest-exception.json',
+        '0/001/output.pickle',
+        '0/001/manifest-ok.json',
+        # A speculative duplicate of element 1 failed after the original
+        # succeeded
+        '1/000/output.pickle',
+        '1/000/manifest-ok.json',
+        '1/002/manifest-exception.json',
+        # Element 2 returned None
+        '2/000/manifest-none.json',
+        # Element 3 failed on every attempt
+        '3/000/manifest-exception.json',
+        '3/001/manifest-exception.json',
+        # Keys that are not element outputs are ignored
+        'input.pickle',
+        '4/checkpoint',
+    ]))
+
+    assert job._latest_attempts() == {
+        0: (1, {'output.pickle', 'manifest-ok.json'}),
+        1: (0, {'output.pickle', 'manifest-ok.json'}),
+        2: (0, {'manifest-none.json'}),
+        3: (1, {'manifest-exception.json'}),
+    }
+
+    # Listing a single element only returns its attempts
+    assert job._latest_attempts(idx=1) == {
+        1: (0, {'output.pickle', 'manifest-ok.json'}),
+    }
+
+
+def test_remote_traceback():
+    prefix = 'cloudknot.jobs/jobdef/job-id/1/'
+    objects = dict((prefix + '{a:03d}/manifest-exception.json'.format(a=a),
+                    json.dumps({'traceback': str(a)}).encode('utf-8'))
+                   for a in range(5))
+    objects[prefix + '005/output.pickle'] = b''
+    objects[prefix + '005/manifest-ok.json'] = b''
+    job = StubBatchJob(objects=objects)
+
+    # The latest failed attempt is found across pages
+    job.clients['s3'].page_size = 2
+    assert job._remote_traceback(1) == '4'
+    assert job._remote_traceback(0) is None
+
+
+def test_list_children():
+    class StubBatch(object):
+        def get_paginator(self, operation):
+            assert operation == 'list_jobs'
+            return self
+
+        def paginate(self, arrayJobId, jobStatus):
+            assert (arrayJobId, jobStatus) == ('job-id', 'FAILED')
+            yield {'jobSummaryList': [
+                {'jobId': 'job-id:3', 'statusReason': 'Essential container '
+                                                      'in task exited'},
+            ]}
+            yield {'jobSummaryList': [{'jobId': 'job-id:12'}]}
+            yield {}
+
+    children = ck.aws.batch._list_children('job-id', 'FAILED',
+                                           batch=StubBatch())
+    assert children == {3: 'Essential container in task exited', 12: None}
+
+
+def test_speculation():
+    class SpeculatingJob(StubBatchJob):
+        def _rerun(self, indices, name):
+            return StubBatchJob(clients=self.clients, job_id='spec',
+                                input=indices, retry_of=self.job_id)
+
+    prefix = 'cloudknot.jobs/jobdef/job-id/'
+    job = SpeculatingJob(input=list(range(4)), objects=dict(
+        (prefix + '{i:d}/000/output.pickle'.format(i=i), pickle.dumps(i))
+        for i in range(2)
+    ))
+    s3, batch = job.clients['s3'], job.clients['batch']
+    batch.children['job-id'] = {'SUCCEEDED': {0, 1}}
+
+    def finish(seconds):
+        # Element 2 succeeds in the original job and element 3 in its
+        # duplicate, which writes with a higher attempt number
+        batch.children['job-id']['SUCCEEDED'].add(2)
+        batch.children['spec'] = {'SUCCEEDED': {1}}
+        s3.objects[prefix + '2/000/output.pickle'] = pickle.dumps(2)
+        s3.objects[prefix + '3/003/output.pickle'] = pickle.dumps(3)
+
+    original_sleep = ck.aws.batch.time.sleep
+    ck.aws.batch.time.sleep = finish
+    try:
+        results = job.result(speculate=0.5)
+    finally:
+        ck.aws.batch.time.sleep = original_sleep
+
+    # The result is ready although the original copy of element 3 is still
+    # running. Only the duplicate of element 2 was terminated.
+    assert results == [0, 1, 2, 3]
+    assert batch.terminated == ['spec:0']
+
+    # An original that failed while its duplicate is still running does not
+    # fail the element
+    batch.children['job-id']['FAILED'] = {3}
+    batch.children['spec'] = {}
+    assert job._failed_children() == {}
+
+    # The element fails if the duplicate fails too
+    batch.children['spec'] = {'FAILED': {1}}
+    assert list(job._failed_children()) == [3]
+
+
+def test_speculate_errors():
+    # Assert ck.aws.CloudknotInputError on speculation without one child
+    # job per element
+    for attrs in [{'workers': 2}, {'chunksize': 4}]:
+        with pytest.raises(ck.aws.CloudknotInputError):
+            StubBatchJob(input=range(8), **attrs).result(speculate=0.5)
+
+
+def test_get_profile_fallback(monkeypatch):
+    directory = tempfile.mkdtemp()
+    credentials_file = op.join(directory, 'credentials')
+    for name in ['cloudknot', 'credentials', 'config']:
+        with open(op.join(directory, name), 'w') as f:
+            f.write('')
+
+    monkeypatch.setenv('CLOUDKNOT_CONFIG_FILE', op.join(directory,
+                                                        'cloudknot'))
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', credentials_file)
+    monkeypatch.setenv('AWS_CONFIG_FILE', op.join(directory, 'config'))
+    monkeypatch.delenv('AWS_PROFILE', raising=False)
+
+    calls = []
+    list_profiles = ck.aws.base_classes.list_profiles
+
+    def counting_list_profiles():
+        calls.append(None)
+        return list_profiles()
+
+    monkeypatch.setattr(ck.aws.base_classes, 'list_profiles',
+                        counting_list_profiles)
+
+    # Without any profile, the profiles are only listed once
+    assert ck.aws.get_profile() == 'from-env'
+    assert ck.aws.get_profile(fallback=None) is None
+    assert len(calls) == 1
+
+    # A new default profile is found once the credentials file changed
+    with open(credentials_file, 'w') as f:
+        f.write('[default]\n')
+
+    assert ck.aws.get_profile() == 'default'
+    assert len(calls) == 2
+
+    shutil.rmtree(directory)
+
+
 def test_get_region(bucket_cleanup):
     # Save environment variables for restoration later
     try:
@@ -0,0 +1,24 @@
+from __future__ import absolute_import, division, print_function
+
+import cloudknot.checkpoint as checkpoint
+
+
+def test_checkpoint_local():
+    checkpoint.clear()
+
+    # Without a saved state, load returns the default
+    assert checkpoint.load() is None
+    assert checkpoint.load(default={'step': 0}) == {'step': 0}
+
+    # Outside of a batch job, states are kept in memory only
+    state = {'step': 3, 'total': 42}
+    checkpoint.save(state)
+    state['step'] = 4
+    assert checkpoint.load(default={'step': 0}) == {'step': 3, 'total': 42}
+    assert not checkpoint.flush()
+
+    checkpoint.save(state, flush_now=True)
+    assert checkpoint.load() == {'step': 4, 'total': 42}
+
+    checkpoint.clear()
+    assert checkpoint.load() is None
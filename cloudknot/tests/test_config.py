@@ -0,0 +1,164 @@
+from __future__ import absolute_import, division, print_function
+
+import cloudknot as ck
+import configparser
+import multiprocessing
+import os
+import os.path as op
+import tempfile
+import threading
+
+
+def _increment(config_file, n):
+    os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+    for _ in range(n):
+        ck.config.add_resource('counter', 'dummy', 'dummy')
+        config = configparser.ConfigParser()
+        with ck.config.rlock:
+            config.read(config_file)
+            count = config.getint('counter', 'count')
+            config.set('counter', 'count', str(count + 1))
+            ck.config.write_config(config, config_file)
+
+
+def _add_knot_job_ids(config_file, job_ids, parent_connection_id):
+    os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+    # A forked process opens its own connection to the state database
+    assert id(ck.config._connect()) != parent_connection_id
+    ck.config.add_knot_job_ids('knot test', job_ids)
+
+
+def test_config_lock():
+    old_config_file = os.environ.get('CLOUDKNOT_CONFIG_FILE')
+    config_file = op.join(tempfile.mkdtemp(), 'cloudknot')
+    os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+
+    try:
+        config = configparser.ConfigParser()
+        config.add_section('counter')
+        config.set('counter', 'count', '0')
+        ck.config.write_config(config, ck.config.get_config_file())
+
+        # The lock is reentrant
+        with ck.config.rlock:
+            with ck.config.rlock:
+                assert op.isfile(config_file + '.lock')
+
+        # Read-modify-writes from several processes and threads do not
+        # overwrite each other
+        n_increments = 20
+        processes = [
+            multiprocessing.Process(target=_increment,
+                                    args=(config_file, n_increments))
+            for _ in range(3)
+        ]
+        threads = [
+            threading.Thread(target=_increment,
+                             args=(config_file, n_increments))
+            for _ in range(3)
+        ]
+
+        for worker in processes + threads:
+            worker.start()
+        for worker in processes + threads:
+            worker.join()
+
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        assert config.getint('counter', 'count') == 6 * n_increments
+
+        # Atomic writes leave no temporary files behind
+        assert sorted(os.listdir(op.dirname(config_file))) == [
+            'cloudknot', 'cloudknot.lock'
+        ]
+    finally:
+        if old_config_file is None:
+            del os.environ['CLOUDKNOT_CONFIG_FILE']
+        else:
+            os.environ['CLOUDKNOT_CONFIG_FILE'] = old_config_file
+
+
+def test_state_store():
+    old_config_file = os.environ.get('CLOUDKNOT_CONFIG_FILE')
+    config_file = op.join(tempfile.mkdtemp(), 'cloudknot')
+    os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+
+    try:
+        # Write a config file in the format of earlier versions
+        config = configparser.ConfigParser()
+        config.add_section('batch-jobs default us-east-1')
+        config.set('batch-jobs default us-east-1', 'job-1', 'name-1')
+        config.add_section('knot test')
+        config.set('knot test', 'region', 'us-east-1')
+        config.set('knot test', 'job_ids', 'job-1 job-2')
+        ck.config.write_config(config, ck.config.get_config_file())
+
+        # Batch jobs are migrated out of the config file
+        assert ck.config.get_knot_job_ids('knot test') == ['job-1', 'job-2']
+
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        assert config.sections() == ['knot test']
+        assert config.options('knot test') == ['region']
+
+        # Job IDs are kept in order of submission, without duplicates
+        ck.config.add_knot_job_ids('knot test', ['job-3', 'job-1', 'job-4'])
+        assert ck.config.get_knot_job_ids('knot test') == [
+            'job-1', 'job-2', 'job-3', 'job-4'
+        ]
+        assert ck.config.get_knot_job_ids('knot other') == []
+
+        ck.config.remove_knot_job_ids('knot test')
+        assert ck.config.get_knot_job_ids('knot test') == []
+
+        # Processes forked after the first connection record jobs in the
+        # same database
+        process = multiprocessing.Process(
+            target=_add_knot_job_ids,
+            args=(config_file, ['job-5', 'job-6'], id(ck.config._connect()))
+        )
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        assert ck.config.get_knot_job_ids('knot test') == ['job-5', 'job-6']
+
+        ck.config.add_job('batch-jobs default us-east-1', 'job-5', 'name-5')
+        ck.config.remove_job('batch-jobs default us-east-1', 'job-5')
+        assert op.isfile(ck.config.get_state_file())
+    finally:
+        if old_config_file is None:
+            del os.environ['CLOUDKNOT_CONFIG_FILE']
+        else:
+            os.environ['CLOUDKNOT_CONFIG_FILE'] = old_config_file
+
+
+def test_read_config_cache():
+    old_config_file = os.environ.get('CLOUDKNOT_CONFIG_FILE')
+    config_file = op.join(tempfile.mkdtemp(), 'cloudknot')
+    os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+
+    try:
+        ck.config.add_resource('aws', 'region', 'us-east-1')
+
+        # The parsed config is reused while the file is unchanged
+        config = ck.config.read_config()
+        assert config.get('aws', 'region') == 'us-east-1'
+        assert ck.config.read_config() is config
+
+        # Writes through cloudknot are visible immediately
+        ck.config.add_resource('aws', 'region', 'us-west-2')
+        assert ck.config.read_config().get('aws', 'region') == 'us-west-2'
+
+        # So are changes to the file by other programs
+        with open(config_file, 'a') as f:
+            f.write('\n[other]\nkey = value\n')
+        assert ck.config.read_config().get('other', 'key') == 'value'
+
+        config = ck.config.read_config()
+        ck.config.invalidate_config_cache()
+        assert ck.config.read_config() is not config
+    finally:
+        if old_config_file is None:
+            del os.environ['CLOUDKNOT_CONFIG_FILE']
+        else:
+            os.environ['CLOUDKNOT_CONFIG_FILE'] = old_config_file
@@ -0,0 +1,38 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import subprocess
+import sys
+
+# Generous upper bound on the time to import cloudknot in a fresh process.
+# Without docker checks, AWS sessions, or heavy third-party imports, it
+# takes a fraction of this.
+IMPORT_TIME_BUDGET = 2.0
+
+IMPORT_SCRIPT = """
+import json
+import sys
+import time
+
+start = time.time()
+import cloudknot
+elapsed = time.time() - start
+
+heavy = ['boto3', 'botocore', 'docker', 'pipreqs', 'awscli']
+print(json.dumps({
+    'elapsed': elapsed,
+    'modules': [m for m in heavy if m in sys.modules],
+    'clients': len(cloudknot.aws.base_classes._client_registry._clients),
+}))
+"""
+
+
+def test_import_is_lazy():
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT])
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+    # Heavy dependencies and AWS clients are only loaded on first use
+    assert result['modules'] == []
+    assert result['clients'] == 0
+
+    assert result['elapsed'] < IMPORT_TIME_BUDGET
@@ -5,6 +5,8 @@ import configparser
 import os.path as op
 import pytest
 import uuid
+from collections import namedtuple
+from concurrent.futures import Future
 
 
 UNIT_TEST_PREFIX = 'ck-unit-test'
@@ -331,3 +333,278 @@ def test_knot_errors(cleanup_repos):
     # Assert ck.aws.CloudknotInputError on invalid ec2_key_pair
     with pytest.raises(ck.aws.CloudknotInputError):
         ck.Knot(ec2_key_pair=42)
+
+
+def test_knot_group_sharding():
+    # Shards are proportional to the weights and add up to the input size
+    assert ck.cloudknot._shard_sizes(10, [1, 1]) == [5, 5]
+    assert ck.cloudknot._shard_sizes(10, [1, 3]) == [3, 7]
+    assert ck.cloudknot._shard_sizes(5, [1, 1, 1]) == [2, 2, 1]
+    assert ck.cloudknot._shard_sizes(1, [1, 4]) == [0, 1]
+
+    # Assert ck.aws.CloudknotInputError on invalid knots
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.KnotGroup([])
+
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.KnotGroup([42])
+
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.map_knots([42], range(10))
+
+
+StubImage = namedtuple('StubImage', ['name'])
+
+
+def finished_future(outcome):
+    """Return a future with the given result or exception"""
+    future = Future()
+    if isinstance(outcome, Exception):
+        future.set_exception(outcome)
+    else:
+        future.set_result(outcome)
+    return future
+
+
+class StubArrayJob(object):
+    """Array job whose partial results are known in advance"""
+    array_job = True
+    gather = False
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+
+    def result(self, partial=False):
+        assert partial
+        return self.outcomes
+
+
+class StubIndependentJob(object):
+    """Independent job whose outcome is known in advance"""
+    array_job = False
+
+    def __init__(self, outcome, gather=False):
+        self.outcome = outcome
+        self.gather = gather
+
+    def result(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+class StubBatchClient(object):
+    """Batch client that reports a fixed number of runnable jobs, in
+    array jobs of `array_size` children if `array_size` is not None"""
+    def __init__(self, n_runnable, max_vcpus=16, array_size=None):
+        self.n_runnable = n_runnable
+        self.max_vcpus = max_vcpus
+        self.array_size = array_size
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, jobQueue, jobStatus):
+        if self.array_size is None:
+            summaries = [{} for _ in range(self.n_runnable)]
+        else:
+            summaries = [{'arrayProperties': {'size': self.array_size}}
+                         for _ in range(self.n_runnable // self.array_size)]
+
+        # Spread the summaries over several pages
+        for start in range(0, len(summaries), 100):
+            yield {'jobSummaryList': summaries[start:start + 100]}
+
+    def describe_compute_environments(self, computeEnvironments):
+        return {'computeEnvironments': [{'computeResources': {
+            'maxvCpus': self.max_vcpus, 'desiredvCpus': self.max_vcpus
+        }}]}
+
+
+class StubKnot(ck.Knot):
+    """Knot that applies `func` locally and fails on the given inputs"""
+    name = docker_image = jobs = clients = None
+    compute_environment = job_queue = None
+
+    def __init__(self, name, func, failing=(), n_runnable=0):
+        self.name = name
+        self.func = func
+        self.failing = set(failing)
+        self.docker_image = StubImage(name='image')
+        self.jobs = []
+        self.clients = {'batch': StubBatchClient(n_runnable)}
+        self.calls = []
+
+    def _outcome(self, item):
+        if item in self.failing:
+            return ck.aws.BatchJobFailedError(self.name, reason='stub')
+        return self.func(item)
+
+    def map(self, iterdata, job_type='array', **kwargs):
+        iterdata = list(iterdata)
+        self.calls.append((iterdata, job_type))
+        outcomes = [self._outcome(item) for item in iterdata]
+
+        if job_type == 'independent':
+            self.jobs.extend(None for _ in outcomes)
+            return [finished_future(o) for o in outcomes]
+
+        self.jobs.append(StubArrayJob(outcomes))
+        errors = [o for o in outcomes if isinstance(o, Exception)]
+        return finished_future(errors[0] if errors else outcomes)
+
+
+class StubDependentJob(object):
+    """Batch job that fails if any of its elements or of the jobs on which
+    it depends failed, as in AWS Batch"""
+    def __init__(self, input_, depends_on=(), failing=()):
+        self.input = list(input_)
+        self.depends_on = list(depends_on)
+        # Elements of reduction jobs are lists, so compare with a list
+        failing = list(failing)
+        self.failed = (any(job.failed for job in self.depends_on)
+                       or any(item in failing for item in self.input))
+
+    def output_ref(self, indices=None, skip_missing=False):
+        assert skip_missing
+        return list(range(len(self.input)) if indices is None else indices)
+
+
+class ReducingKnot(StubKnot):
+    """Knot that records the jobs submitted by map_reduce"""
+    profile = region = None
+
+    def _submit(self, iterdata, depends_on=(), **kwargs):
+        job = StubDependentJob(iterdata, depends_on, self.failing)
+        self.jobs.append(job)
+        return [job]
+
+    def _submit_dependent(self, upstream, **kwargs):
+        job = StubDependentJob([upstream.output_ref(skip_missing=True)],
+                               [upstream])
+        self.jobs.append(job)
+        return job
+
+    @staticmethod
+    def _futures(jobs, max_threads=64):
+        return [finished_future(ck.aws.BatchJobFailedError('job-id')
+                                if job.failed else 'reduced')
+                for job in jobs]
+
+
+def test_map_reduce():
+    mapper = ReducingKnot('mapper', None)
+    reducer = ReducingKnot('reducer', None)
+
+    assert mapper.map_reduce(range(40), reducer, fanin=4).result() == (
+        'reduced'
+    )
+
+    # The tree has levels of 10 and 3 reduction jobs and a final one, each
+    # depending on the previous level
+    assert [len(job.input) for job in reducer.jobs] == [10, 3, 1]
+    upstream = mapper.jobs + reducer.jobs[:-1]
+    assert [job.depends_on for job in reducer.jobs] == [[u] for u in upstream]
+
+    # A single failed element fails the whole reduction
+    mapper = ReducingKnot('mapper', None, failing=[7])
+    with pytest.raises(ck.aws.BatchJobFailedError):
+        mapper.map_reduce(range(40), reducer, fanin=4).result()
+
+    # Assert ck.aws.CloudknotInputError on invalid input
+    with pytest.raises(ck.aws.CloudknotInputError):
+        mapper.map_reduce([1], reducer)
+
+    with pytest.raises(ck.aws.CloudknotInputError):
+        mapper.map_reduce(range(4), sum)
+
+    with pytest.raises(ck.aws.CloudknotInputError):
+        mapper.map_reduce(range(4), reducer, fanin=1)
+
+
+def test_knot_group_retries():
+    def square(x):
+        return x ** 2
+
+    # Element 1 fails on the first knot, whose queue is busier
+    busy = StubKnot('busy', square, failing=[1], n_runnable=250)
+    idle = StubKnot('idle', square, n_runnable=10)
+    group = ck.KnotGroup([busy, idle], weights=[1, 1])
+
+    # Runnable jobs are counted across pages
+    assert group._backlog(busy) == 250 / 16.0
+    assert group.fastest_knot() is idle
+
+    # Each child of a runnable array job is counted
+    arrays = StubKnot('arrays', square)
+    arrays.clients['batch'] = StubBatchClient(250, array_size=50)
+    assert group._backlog(arrays) == 250 / 16.0
+
+    results = group.map(range(6), retries=1).result()
+    assert results == [x ** 2 for x in range(6)]
+
+    # Each knot mapped its shard and the failed element was retried on the
+    # knot with the shortest backlog, as an independent job
+    assert busy.calls == [([0, 1, 2], 'array')]
+    assert idle.calls == [([3, 4, 5], 'array'), ([1], 'independent')]
+
+    # The error is raised once the retries are exhausted
+    busy = StubKnot('busy', square, n_runnable=250)
+    broken = StubKnot('broken', square, failing=[4])
+    group = ck.KnotGroup([busy, broken], weights=[1, 2])
+    with pytest.raises(ck.aws.BatchJobFailedError):
+        group.map(range(6), retries=2).result()
+
+    # The element was retried on the fastest knot, which kept failing it
+    assert broken.calls == [([2, 3, 4, 5], 'array'),
+                            ([4], 'independent'), ([4], 'independent')]
+
+
+def test_knot_group_outcomes():
+    error = ck.aws.BatchJobFailedError('job-id', index=1)
+
+    # Futures of independent jobs each give one outcome
+    futures = [finished_future(42), finished_future(error)]
+    assert ck.KnotGroup._outcomes(futures, [None, None], [[0], [1]]) == [
+        42, error
+    ]
+
+    # Failed array jobs are resolved element by element
+    future = finished_future(error)
+    job = StubArrayJob([0, error, 4])
+    assert ck.KnotGroup._outcomes(future, [job], [[0, 1, 2]]) == [
+        0, error, 4
+    ]
+
+    # Gather jobs are skipped in favor of the array job that they gather
+    gather_job = StubIndependentJob(error, gather=True)
+    assert ck.KnotGroup._outcomes(
+        future, [job, gather_job], [[0, 1, 2]]
+    ) == [0, error, 4]
+
+    # Shards with several jobs, e.g. one for each resource class, are
+    # resolved job by job and the outcomes are put back in item order
+    jobs = [StubArrayJob([error, 1]), StubIndependentJob(9),
+            StubArrayJob([16, 25])]
+    groups = [[1, 0], [3], [2, 4]]
+    assert ck.KnotGroup._outcomes(future, jobs, groups) == [
+        1, error, 16, 9, 25
+    ]
+
+    # Otherwise, all items share the error
+    assert ck.KnotGroup._outcomes(future, [], [[0, 1]]) == [error, error]
+
+
+def test_check_array_input():
+    # Iterables are returned as lists
+    assert ck.cloudknot._check_array_input(range(3)) == [0, 1, 2]
+    assert ck.cloudknot._check_array_input(x for x in 'ab') == ['a', 'b']
+
+    # Assert TypeError on non-iterable input
+    with pytest.raises(TypeError):
+        ck.cloudknot._check_array_input(42)
+
+    # Assert ck.aws.CloudknotInputError on fewer than two elements
+    for iterdata in [[], [1], range(1)]:
+        with pytest.raises(ck.aws.CloudknotInputError):
+            ck.cloudknot._check_array_input(iterdata)
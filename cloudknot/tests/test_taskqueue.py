@@ -0,0 +1,146 @@
+from __future__ import absolute_import, division, print_function
+
+import cloudknot.taskqueue as taskqueue
+import pytest
+import tempfile
+import threading
+
+
+def test_local_task_queue():
+    n_tasks = 100
+    n_workers = 4
+    directory = tempfile.mkdtemp()
+
+    claimed = [[] for _ in range(n_workers)]
+
+    def work(worker):
+        queue = taskqueue.LocalTaskQueue(n_tasks=n_tasks, directory=directory)
+        for task in queue.claims(worker, n_workers):
+            claimed[worker].append(task)
+
+    threads = [threading.Thread(target=work, args=(w,))
+               for w in range(n_workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Each task is claimed exactly once
+    all_claimed = sorted(sum(claimed, []))
+    assert all_claimed == list(range(n_tasks))
+
+    # Workers can recover their claims
+    queue = taskqueue.LocalTaskQueue(n_tasks=n_tasks, directory=directory)
+    for worker in range(n_workers):
+        assert queue.claimed_by(worker) == sorted(claimed[worker])
+
+    # Nothing is left to claim
+    assert list(queue.claims(0, n_workers)) == []
+
+
+class OrderOnlyTaskQueue(taskqueue.TaskQueue):
+    """Task queue that only computes the order of claims"""
+    def _try_claim(self, task, worker):
+        return False
+
+    def claimed_by(self, worker):
+        return []
+
+    def claimed(self):
+        return set()
+
+
+class StubClientError(Exception):
+    def __init__(self, code):
+        self.response = {'Error': {'Code': code}}
+
+
+class StubS3(object):
+    """In-memory S3 client that counts conditional writes"""
+    class exceptions(object):
+        ClientError = StubClientError
+
+    def __init__(self):
+        self.objects = {}
+        self.conditional_puts = 0
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, **kwargs):
+        if IfNoneMatch is not None:
+            self.conditional_puts += 1
+            if Key in self.objects:
+                raise StubClientError('PreconditionFailed')
+        self.objects[Key] = Body
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': k} for k in sorted(self.objects)
+                            if k.startswith(Prefix)]}
+
+
+@pytest.mark.parametrize('n_workers', [2, 8, 32])
+def test_s3_task_queue_claim_cost(n_workers):
+    n_tasks = 256
+    s3 = StubS3()
+
+    def claims(worker):
+        queue = taskqueue.S3TaskQueue(n_tasks=n_tasks, bucket='bucket',
+                                      prefix='job/', client=s3)
+        return queue.claims(worker, n_workers)
+
+    # Interleave the workers' claims, one item at a time
+    claimed = []
+    workers = [claims(w) for w in range(n_workers)]
+    while workers:
+        for worker in list(workers):
+            try:
+                claimed.append(next(worker))
+            except StopIteration:
+                workers.remove(worker)
+
+    assert sorted(claimed) == list(range(n_tasks))
+
+    # Failed claims are bounded by the number of workers rather than
+    # growing with the number of items times the number of workers
+    assert s3.conditional_puts <= n_tasks + 2 * n_workers
+
+
+def test_s3_task_queue_steal_cost():
+    n_tasks = 10
+    s3 = StubS3()
+    queues = [taskqueue.S3TaskQueue(n_tasks=n_tasks, bucket='bucket',
+                                    prefix='job/', client=s3,
+                                    ranking=list(range(n_tasks))[::-1])
+              for _ in range(2)]
+
+    # Worker 1 claims its own slice and worker 0 then drains the queue
+    claims = queues[1].claims(1, 2)
+    own = [next(claims) for _ in range(n_tasks // 2)]
+    assert sorted(list(queues[0].claims(0, 2)) + own) == list(
+        range(n_tasks)
+    )
+
+    # Worker 0 read the claims before stealing, so it did not try to claim
+    # any of the items of worker 1
+    assert s3.conditional_puts == n_tasks
+
+
+def test_task_queue_order():
+    queue = OrderOnlyTaskQueue(n_tasks=10)
+
+    # Workers start with their own slice and then try all other tasks,
+    # stealing from the back of the other slices
+    order = queue.order(1, 3)
+    assert order == [1, 4, 7, 8, 9, 5, 6, 2, 3, 0]
+
+    # Slices are dealt from the ranked tasks
+    queue = OrderOnlyTaskQueue(n_tasks=6, ranking=[5, 4, 3, 2, 1, 0])
+    assert queue.order(0, 2) == [5, 3, 1, 0, 2, 4]
+
+    with pytest.raises(ValueError):
+        OrderOnlyTaskQueue(n_tasks=3, ranking=[0, 1, 1])
+
+    # The base class does not implement claims
+    with pytest.raises(TypeError):
+        taskqueue.TaskQueue(n_tasks=3)